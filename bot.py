@@ -14,17 +14,22 @@ from aiohttp import web
 from loader import bot, config, logger, marzban_client
 
 # --- ШАГ 2: Импортируем наши новые модули и хендлеры ---
-from db import setup_database_sync
+from database.migrations import check_schema
 from tgbot.handlers import routers_list
 from tgbot.middlewares.flood import ThrottlingMiddleware
-from tgbot.handlers.webhook_handlers import yookassa_webhook_handler
+from tgbot.handlers.webhook_handlers import yookassa_webhook_handler, marzban_webhook_handler, metrics_handler
 from utils import broadcaster
 
 scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
 async def on_startup(bot, marzban): # Добавили marzban в аргументы
     """Выполняется при запуске бота."""
-    # 1. Инициализируем базу данных
-    setup_database_sync()
+    # 1. Проверяем схему БД (только чтение; миграции применяет python3 -m database.migrations)
+    pending = await check_schema()
+    if pending:
+        logger.error(
+            "Database schema is behind, pending migrations: "
+            f"{', '.join(f'{m.version:04d}_{m.name}' for m in pending)}. Run: python3 -m database.migrations"
+        )
 
     # 2. Запускаем планировщик
     try:
@@ -136,6 +141,10 @@ def main_webhook():
     
     # 2. Регистрируем обработчик для вебхуков YooKassa на отдельный путь
     app.router.add_post('/yookassa', yookassa_webhook_handler)
+    # 3. Уведомления Marzban о пользователях
+    app.router.add_post('/marzban', marzban_webhook_handler)
+    # 4. Метрики пула БД
+    app.router.add_get('/metrics', metrics_handler)
 
     setup_application(app, dp, bot=bot, marzban=marzban_client)
     
@@ -177,6 +186,8 @@ async def start_yookassa_webhook_server(dp: Dispatcher):
     app['dp'] = dp
     
     app.router.add_post('/yookassa', yookassa_webhook_handler)
+    app.router.add_post('/marzban', marzban_webhook_handler)
+    app.router.add_get('/metrics', metrics_handler)
     
     runner = web.AppRunner(app)
     await runner.setup()
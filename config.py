@@ -42,6 +42,21 @@ class DataBase:
     user: str
     password: str
     db_name: str
+    # Процесс, которому принадлежит пул: bot / site (DB_WORKLOAD задаётся в docker-compose).
+    # Любую настройку ниже можно переопределить для процесса: DB_SITE_POOL_SIZE, DB_BOT_STATEMENT_TIMEOUT_MS, ...
+    workload: str = "bot"
+    # Пул: постоянные соединения, сверх них при пиках, ожидание свободного (сек), пересоздание (сек)
+    pool_size: int = 10
+    max_overflow: int = 5
+    pool_timeout: float = 10.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    # Кэш prepared statements asyncpg на соединение (0 — выкл., нужно за pgbouncer в transaction mode)
+    statement_cache_size: int = 100
+    # statement_timeout на стороне Postgres (мс, 0 — без ограничения)
+    statement_timeout_ms: int = 30_000
+    # Токен для GET /metrics (метрики пула); None — эндпоинт выключен
+    metrics_token: str | None = None
 
     @staticmethod
     def from_env(env: Env):
@@ -50,7 +65,22 @@ class DataBase:
         user = env.str("DB_USER")
         password = env.str("DB_PASSWORD")
         db_name = env.str("DB_NAME")
-        return DataBase(host=host, port=port, user=user, password=password, db_name=db_name)
+        workload = env.str("DB_WORKLOAD", "bot").lower()
+        prefix = f"DB_{workload.upper()}_"
+
+        def setting(parse, name, default):
+            return parse(prefix + name, parse("DB_" + name, default))
+
+        return DataBase(host=host, port=port, user=user, password=password, db_name=db_name,
+                        workload=workload,
+                        pool_size=setting(env.int, "POOL_SIZE", 10),
+                        max_overflow=setting(env.int, "MAX_OVERFLOW", 5),
+                        pool_timeout=setting(env.float, "POOL_TIMEOUT", 10.0),
+                        pool_recycle=setting(env.int, "POOL_RECYCLE", 1800),
+                        pool_pre_ping=setting(env.bool, "POOL_PRE_PING", True),
+                        statement_cache_size=setting(env.int, "STATEMENT_CACHE_SIZE", 100),
+                        statement_timeout_ms=setting(env.int, "STATEMENT_TIMEOUT_MS", 30_000),
+                        metrics_token=env.str("DB_METRICS_TOKEN", None) or None)
 
 
 @dataclass
@@ -73,6 +103,29 @@ class Marzban:
     password: str
     token_expire: int
     verify_ssl: bool
+    # Пул соединений к API Marzban
+    pool_size: int = 20
+    keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    # TTL кэша шаблона inbounds (секунды)
+    inbounds_ttl: int = 300
+    # Read-through кэш get_user
+    user_cache_ttl: int = 15
+    user_cache_size: int = 10000
+    # Массовые операции: стартовая/максимальная параллельность и целевая задержка ответа (сек)
+    bulk_concurrency: int = 4
+    bulk_max_concurrency: int = 16
+    bulk_target_latency: float = 1.0
+    # Circuit breaker и повторы GET-запросов
+    breaker_threshold: int = 5
+    breaker_reset_timeout: float = 15.0
+    retry_attempts: int = 3
+    # Зеркало marzban_users: допустимая давность данных (сек) и интервал фоновой сверки (сек, 0 — выкл.)
+    mirror_max_age: int = 300
+    mirror_sync_interval: int = 120
+    # Секрет вебхука Marzban (WEBHOOK_SECRET из .env.marzban), None — эндпоинт выключен
+    webhook_secret: str | None = None
 
     @staticmethod
     def from_env(env: Env, env_marz: Env):
@@ -80,9 +133,154 @@ class Marzban:
         password = env_marz.str("SUDO_PASSWORD")
         token_expire = env_marz.int("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", 1440)
         verify_ssl = env.bool("MARZ_HAS_CERTIFICATE")
+        pool_size = env.int("MARZ_POOL_SIZE", 20)
+        keepalive_connections = env.int("MARZ_KEEPALIVE_CONNECTIONS", 10)
+        keepalive_expiry = env.float("MARZ_KEEPALIVE_EXPIRY", 30.0)
+        http2 = env.bool("MARZ_HTTP2", False)
+        inbounds_ttl = env.int("MARZ_INBOUNDS_TTL", 300)
+        user_cache_ttl = env.int("MARZ_USER_CACHE_TTL", 15)
+        user_cache_size = env.int("MARZ_USER_CACHE_SIZE", 10000)
+        bulk_concurrency = env.int("MARZ_BULK_CONCURRENCY", 4)
+        bulk_max_concurrency = env.int("MARZ_BULK_MAX_CONCURRENCY", 16)
+        bulk_target_latency = env.float("MARZ_BULK_TARGET_LATENCY", 1.0)
+        breaker_threshold = env.int("MARZ_BREAKER_THRESHOLD", 5)
+        breaker_reset_timeout = env.float("MARZ_BREAKER_RESET_TIMEOUT", 15.0)
+        retry_attempts = env.int("MARZ_RETRY_ATTEMPTS", 3)
+        mirror_max_age = env.int("MARZ_MIRROR_MAX_AGE", 300)
+        mirror_sync_interval = env.int("MARZ_MIRROR_SYNC_INTERVAL", 120)
+        webhook_secret = env_marz.str("WEBHOOK_SECRET", None)
         return Marzban(username=username, password=password,
                        token_expire=token_expire,
-                       verify_ssl=verify_ssl)
+                       verify_ssl=verify_ssl,
+                       pool_size=pool_size,
+                       keepalive_connections=keepalive_connections,
+                       keepalive_expiry=keepalive_expiry,
+                       http2=http2,
+                       inbounds_ttl=inbounds_ttl,
+                       user_cache_ttl=user_cache_ttl,
+                       user_cache_size=user_cache_size,
+                       bulk_concurrency=bulk_concurrency,
+                       bulk_max_concurrency=bulk_max_concurrency,
+                       bulk_target_latency=bulk_target_latency,
+                       breaker_threshold=breaker_threshold,
+                       breaker_reset_timeout=breaker_reset_timeout,
+                       retry_attempts=retry_attempts,
+                       mirror_max_age=mirror_max_age,
+                       mirror_sync_interval=mirror_sync_interval,
+                       webhook_secret=webhook_secret)
+
+
+@dataclass
+class SubProxy:
+    # Адрес Marzban для /sub/ внутри Docker-сети (переопределяется, например, в бенчмарке)
+    marzban_url: str = "https://marzban:8002"
+    # Сколько секунд ответ /sub/ считается свежим (отдаём из памяти / 304 без запроса к Marzban)
+    cache_ttl: int = 60
+    # Максимум пользователей и байт ответов в памяти
+    cache_max_entries: int = 20000
+    cache_max_bytes: int = 64 * 1024 * 1024
+    # После окна свежести: столько секунд отдаём старый ответ сразу и обновляем в фоне
+    stale_while_revalidate: int = 600
+    # Сколько секунд можно отдавать последний удачный ответ, если Marzban недоступен
+    stale_if_error: int = 7 * 24 * 3600
+    # Каталог для вытесненных из памяти ответов (пусто — без диска)
+    spill_dir: str | None = None
+    # Token bucket на /sub/: ёмкость и пополнение в минуту по username и по IP (0 в PER_MINUTE — выкл.)
+    rate_user_burst: int = 10
+    rate_user_per_minute: float = 6
+    rate_ip_burst: int = 60
+    rate_ip_per_minute: float = 60
+    rate_max_keys: int = 100_000
+    # Аналитика запросов: размер кольцевого буфера (0 — выкл.), период сброса в БД (сек), хранение сырых событий (дни)
+    analytics_buffer: int = 50_000
+    analytics_flush_interval: float = 5.0
+    analytics_retention_days: int = 7
+    # UDP-порт приёма access log nginx (syslog) — события по всем /sub/, включая ответы из кэша nginx.
+    # 0 — без nginx: события пишет сам обработчик /sub/ (видит только запросы, дошедшие до приложения)
+    analytics_syslog_port: int = 5140
+
+    @staticmethod
+    def from_env(env: Env):
+        marzban_url = env.str("SUB_MARZBAN_URL", "https://marzban:8002")
+        cache_ttl = env.int("SUB_CACHE_TTL", 60)
+        cache_max_entries = env.int("SUB_CACHE_MAX_ENTRIES", 20000)
+        cache_max_bytes = env.int("SUB_CACHE_MAX_MB", 64) * 1024 * 1024
+        stale_while_revalidate = env.int("SUB_CACHE_STALE_WHILE_REVALIDATE", 600)
+        stale_if_error = env.int("SUB_CACHE_STALE_IF_ERROR", 7 * 24 * 3600)
+        spill_dir = env.str("SUB_CACHE_SPILL_DIR", None) or None
+        rate_user_burst = env.int("SUB_RATE_USER_BURST", 10)
+        rate_user_per_minute = env.float("SUB_RATE_USER_PER_MINUTE", 6)
+        rate_ip_burst = env.int("SUB_RATE_IP_BURST", 60)
+        rate_ip_per_minute = env.float("SUB_RATE_IP_PER_MINUTE", 60)
+        rate_max_keys = env.int("SUB_RATE_MAX_KEYS", 100_000)
+        analytics_buffer = env.int("SUB_ANALYTICS_BUFFER", 50_000)
+        analytics_flush_interval = env.float("SUB_ANALYTICS_FLUSH_INTERVAL", 5.0)
+        analytics_retention_days = env.int("SUB_ANALYTICS_RETENTION_DAYS", 7)
+        analytics_syslog_port = env.int("SUB_ANALYTICS_SYSLOG_PORT", 5140)
+        return SubProxy(marzban_url=marzban_url, cache_ttl=cache_ttl, cache_max_entries=cache_max_entries,
+                        cache_max_bytes=cache_max_bytes,
+                        stale_while_revalidate=stale_while_revalidate,
+                        stale_if_error=stale_if_error,
+                        spill_dir=spill_dir,
+                        rate_user_burst=rate_user_burst,
+                        rate_user_per_minute=rate_user_per_minute,
+                        rate_ip_burst=rate_ip_burst,
+                        rate_ip_per_minute=rate_ip_per_minute,
+                        rate_max_keys=rate_max_keys,
+                        analytics_buffer=analytics_buffer,
+                        analytics_flush_interval=analytics_flush_interval,
+                        analytics_retention_days=analytics_retention_days,
+                        analytics_syslog_port=analytics_syslog_port)
+
+
+@dataclass
+class ExternalVpn:
+    # Проверка внешних серверов: интервал (сек, 0 — выкл.), таймаут одной проверки и число одновременных
+    probe_interval: int = 300
+    probe_timeout: float = 5.0
+    probe_concurrency: int = 20
+    # Сколько проверок подряд должно провалиться, чтобы сервер перестал отдаваться в /sub/
+    probe_fail_threshold: int = 3
+    # Обновление внешних подписок: интервал (сек, 0 — выкл.), параллельность, таймаут запроса
+    refresh_interval: int = 1800
+    refresh_concurrency: int = 5
+    refresh_timeout: float = 15.0
+    # Новые серверы из обновлённой подписки сразу включаются в /sub/
+    refresh_activate_new: bool = True
+
+    @staticmethod
+    def from_env(env: Env):
+        probe_interval = env.int("EXT_PROBE_INTERVAL", 300)
+        probe_timeout = env.float("EXT_PROBE_TIMEOUT", 5.0)
+        probe_concurrency = env.int("EXT_PROBE_CONCURRENCY", 20)
+        probe_fail_threshold = env.int("EXT_PROBE_FAIL_THRESHOLD", 3)
+        refresh_interval = env.int("EXT_REFRESH_INTERVAL", 1800)
+        refresh_concurrency = env.int("EXT_REFRESH_CONCURRENCY", 5)
+        refresh_timeout = env.float("EXT_REFRESH_TIMEOUT", 15.0)
+        refresh_activate_new = env.bool("EXT_REFRESH_ACTIVATE_NEW", True)
+        return ExternalVpn(probe_interval=probe_interval, probe_timeout=probe_timeout,
+                           probe_concurrency=probe_concurrency,
+                           probe_fail_threshold=probe_fail_threshold,
+                           refresh_interval=refresh_interval,
+                           refresh_concurrency=refresh_concurrency,
+                           refresh_timeout=refresh_timeout,
+                           refresh_activate_new=refresh_activate_new)
+
+
+@dataclass
+class WebApp:
+    # Сжатие ответов: минимальный размер тела (байт) и уровни gzip / brotli
+    compress_min_size: int = 500
+    gzip_level: int = 6
+    brotli_quality: int = 5
+
+    @staticmethod
+    def from_env(env: Env):
+        compress_min_size = env.int("COMPRESS_MIN_SIZE", 500)
+        gzip_level = env.int("COMPRESS_GZIP_LEVEL", 6)
+        brotli_quality = env.int("COMPRESS_BROTLI_QUALITY", 5)
+        return WebApp(compress_min_size=compress_min_size, gzip_level=gzip_level,
+                      brotli_quality=brotli_quality)
 
 
 @dataclass
@@ -92,6 +290,9 @@ class Config:
     marzban: Marzban
     dataBase: DataBase
     yookassa: YooKassa
+    sub_proxy: SubProxy
+    webapp: WebApp
+    external_vpn: ExternalVpn
 
 
 def load_config():
@@ -105,5 +306,8 @@ def load_config():
         webhook=Webhook.from_env(env),
         marzban=Marzban.from_env(env, env_marz),
         dataBase=DataBase.from_env(env),
-        yookassa=YooKassa.from_env(env)
+        yookassa=YooKassa.from_env(env),
+        sub_proxy=SubProxy.from_env(env),
+        webapp=WebApp.from_env(env),
+        external_vpn=ExternalVpn.from_env(env),
     )
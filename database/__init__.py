@@ -6,6 +6,9 @@ from database.repositories.channel import ChannelRepository
 from database.repositories.stats import StatsRepository
 from database.repositories.payment import PaymentRepository
 from database.repositories.external_vpn import ExternalSubscriptionRepository, ExternalConfigRepository
+from database.repositories.marzban_mirror import MarzbanMirrorRepository
+from database.repositories.cache_version import CacheVersionRepository
+from database.repositories.sub_analytics import SubscriptionAnalyticsRepository
 
 user_repo = UserRepository(async_session_maker)
 tariff_repo = TariffRepository(async_session_maker)
@@ -15,3 +18,6 @@ stats_repo = StatsRepository(async_session_maker)
 payment_repo = PaymentRepository(async_session_maker)
 external_sub_repo = ExternalSubscriptionRepository(async_session_maker)
 external_config_repo = ExternalConfigRepository(async_session_maker)
+marzban_mirror_repo = MarzbanMirrorRepository(async_session_maker)
+cache_version_repo = CacheVersionRepository(async_session_maker)
+sub_analytics_repo = SubscriptionAnalyticsRepository(async_session_maker)
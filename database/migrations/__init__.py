@@ -0,0 +1,29 @@
+# database/migrations/__init__.py
+"""
+Версионные миграции схемы БД.
+
+Новая миграция — модуль vNNNN_<name>.py с MIGRATION = Migration(...), добавленный в MIGRATIONS.
+Индексы на живых таблицах — только через ConcurrentIndex.
+
+Применить:        python3 -m database.migrations
+Показать шаги:    python3 -m database.migrations --dry-run
+Проверить:        python3 -m database.migrations --check   (код выхода 1, если есть неприменённые)
+"""
+from db import async_engine
+from .runner import ConcurrentIndex, Migration, Python, Sql, migrate, pending_migrations
+from . import v0001_baseline, v0002_performance_indexes, v0003_sub_fetch_cache_status
+
+MIGRATIONS: tuple[Migration, ...] = (
+    v0001_baseline.MIGRATION,
+    v0002_performance_indexes.MIGRATION,
+    v0003_sub_fetch_cache_status.MIGRATION,
+)
+
+
+async def check_schema() -> list[Migration]:
+    """Для старта бота и сайта: неприменённые миграции (только чтение, без DDL-блокировок)."""
+    return await pending_migrations(async_engine, MIGRATIONS)
+
+
+async def apply_migrations(dry_run: bool = False, lock_timeout: str = "5s", report=print) -> list[Migration]:
+    return await migrate(async_engine, MIGRATIONS, dry_run=dry_run, lock_timeout=lock_timeout, report=report)
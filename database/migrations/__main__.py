@@ -0,0 +1,39 @@
+# database/migrations/__main__.py — python3 -m database.migrations [--dry-run | --check]
+import argparse
+import asyncio
+import sys
+
+from db import async_engine
+from database.migrations import apply_migrations, check_schema
+
+
+async def main(args) -> int:
+    try:
+        if args.check:
+            pending = await check_schema()
+            for migration in pending:
+                print(f"pending: {migration.version:04d} {migration.name}")
+            print("✅ Схема актуальна" if not pending else f"⚠️ Неприменённых миграций: {len(pending)}")
+            return 1 if pending else 0
+
+        done = await apply_migrations(dry_run=args.dry_run, lock_timeout=args.lock_timeout)
+        if args.dry_run:
+            print(f"Будет применено миграций: {len(done)}")
+        else:
+            print(f"🎉 Применено миграций: {len(done)}" if done else "✅ Схема актуальна")
+        return 0
+    finally:
+        await async_engine.dispose()
+
+
+def run(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--dry-run", action="store_true", help="Показать шаги, ничего не выполняя")
+    parser.add_argument("--check", action="store_true", help="Только проверить, есть ли неприменённые миграции")
+    parser.add_argument("--lock-timeout", default="5s",
+                        help="lock_timeout для транзакционных шагов (например 5s, 500ms)")
+    return asyncio.run(main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,95 @@
+# database/migrations/_identity_v1.py
+"""
+Замороженная копия utils.vpn_links.link_identity (и нужного ей разбора ссылок) на момент миграции 0001.
+Миграция должна давать тот же результат при любом будущем коде: сюда не импортируем ничего из utils,
+а изменения алгоритма в utils.vpn_links оформляются новой миграцией, пересчитывающей identity_key.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+_PREFIXES = ("vless://", "vmess://", "trojan://", "ss://", "hysteria2://", "hy2://", "tuic://")
+_IDENTITY_PARAMS = (
+    "type", "security", "sni", "host", "path", "serviceName", "mode", "headerType",
+    "pbk", "sid", "spx", "flow", "obfs", "obfs-password",
+)
+_IDENTITY_DEFAULTS = {"type": "tcp", "security": "none", "headerType": "none"}
+
+
+def _b64decode(value: str) -> str:
+    value = value.strip().replace("-", "+").replace("_", "/")
+    return base64.b64decode(value + "=" * (-len(value) % 4)).decode("utf-8")
+
+
+def _parse_vmess(link: str) -> tuple:
+    data = json.loads(_b64decode(link[len("vmess://"):]))
+    params = {
+        "type": data.get("net") or "tcp",
+        "security": "tls" if data.get("tls") in ("tls", "reality") else "none",
+        "sni": data.get("sni") or "",
+        "host": data.get("host") or "",
+        "path": data.get("path") or "",
+        "headerType": data.get("type") or "",
+    }
+    return ("vmess", data.get("add", ""), int(data.get("port") or 0), data.get("scy") or "auto",
+            data.get("id", ""), "", {k: v for k, v in params.items() if v})
+
+
+def _parse_ss(link: str) -> tuple:
+    body = link[len("ss://"):].partition("#")[0].split("?", 1)[0]
+    if "@" in body:
+        userinfo, _, hostport = body.rpartition("@")
+        userinfo = unquote(userinfo)
+        if ":" not in userinfo:
+            userinfo = _b64decode(userinfo)
+    else:
+        userinfo, _, hostport = _b64decode(body).rpartition("@")
+    method, _, password = userinfo.partition(":")
+    host, _, port = hostport.rpartition(":")
+    return "ss", host.strip("[]"), int(port), method, password, password, {}
+
+
+def _parse_url(link: str) -> tuple | None:
+    parts = urlsplit(link)
+    protocol = "hysteria2" if parts.scheme == "hy2" else parts.scheme
+    credential = unquote(parts.username or "")
+    password = unquote(parts.password or "")
+    if protocol in ("trojan", "hysteria2"):
+        password = credential
+    if not parts.hostname or not parts.port:
+        return None
+    return protocol, parts.hostname, parts.port, "", credential, password, dict(parse_qsl(parts.query))
+
+
+def _parse(link: str) -> tuple | None:
+    """(protocol, server, port, method, credential, password, params) или None."""
+    link = link.strip()
+    try:
+        if link.startswith("vmess://"):
+            return _parse_vmess(link)
+        if link.startswith("ss://"):
+            return _parse_ss(link)
+        if link.startswith(_PREFIXES):
+            return _parse_url(link)
+    except (ValueError, KeyError, UnicodeDecodeError, binascii.Error, json.JSONDecodeError):
+        return None
+    return None
+
+
+def link_identity_v1(link: str) -> str:
+    node = _parse(link)
+    if node is None:
+        canonical = link.strip().split("#", 1)[0]
+    else:
+        protocol, server, port, method, credential, password, node_params = node
+        params = []
+        for key in _IDENTITY_PARAMS:
+            value = node_params.get(key, "")
+            if key in ("sni", "host"):
+                value = value.lower()
+            if value and value != _IDENTITY_DEFAULTS.get(key):
+                params.append(f"{key}={value}")
+        canonical = "|".join((protocol, server.lower(), str(port), method, credential, password, *params))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
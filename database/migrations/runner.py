@@ -0,0 +1,175 @@
+# database/migrations/runner.py
+"""
+Исполнитель миграций.
+
+Применённые версии хранятся в schema_migrations. Одновременный запуск из двух контейнеров
+исключён advisory-lock'ом. Обычные шаги (Sql, Python) идут в транзакции с lock_timeout —
+ALTER не встанет в очередь за долгой транзакцией и не заблокирует таблицу для всех.
+ConcurrentIndex выполняется вне транзакции (CREATE INDEX CONCURRENTLY не блокирует запись).
+
+Шаги должны быть идемпотентны (IF NOT EXISTS и т.п.): версия записывается после
+последнего шага, и прерванная миграция при следующем запуске выполняется заново.
+"""
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# Ключ pg_advisory_lock для миграций (произвольная константа)
+_LOCK_KEY = 748_201_113
+
+_CREATE_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version     INTEGER PRIMARY KEY,
+        name        VARCHAR NOT NULL,
+        applied_at  TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+        duration_ms FLOAT NOT NULL DEFAULT 0
+    );
+"""
+
+
+@dataclass(frozen=True)
+class Sql:
+    """SQL-выражение в транзакции миграции."""
+    statement: str
+
+    def describe(self) -> str:
+        return " ".join(self.statement.split())
+
+
+@dataclass(frozen=True)
+class Python:
+    """Произвольный код в транзакции миграции (заполнение колонок и т.п.)."""
+    func: Callable[[AsyncConnection], Awaitable[None]]
+    description: str
+
+    def describe(self) -> str:
+        return f"python: {self.description}"
+
+
+@dataclass(frozen=True)
+class ConcurrentIndex:
+    """CREATE INDEX CONCURRENTLY — без блокировки записи в таблицу, вне транзакции."""
+    name: str
+    table: str
+    columns: str
+    unique: bool = False
+    where: str | None = None
+
+    @property
+    def statement(self) -> str:
+        unique = "UNIQUE " if self.unique else ""
+        where = f" WHERE {self.where}" if self.where else ""
+        return (f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {self.name} "
+                f"ON {self.table} ({self.columns}){where}")
+
+    def describe(self) -> str:
+        return self.statement
+
+
+Step = Sql | Python | ConcurrentIndex
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    steps: tuple[Step, ...]
+
+
+async def applied_versions(conn: AsyncConnection) -> set[int]:
+    """Применённые версии; только чтение (без DDL), если таблицы ещё нет — пусто."""
+    exists = (await conn.execute(text("SELECT to_regclass('schema_migrations') IS NOT NULL"))).scalar()
+    if not exists:
+        return set()
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    return {row[0] for row in result}
+
+
+async def pending_migrations(engine: AsyncEngine, migrations: Iterable[Migration]) -> list[Migration]:
+    """Проверка схемы при старте: какие миграции ещё не применены. Блокировок DDL не берёт."""
+    async with engine.connect() as conn:
+        applied = await applied_versions(conn)
+    return [m for m in sorted(migrations, key=lambda m: m.version) if m.version not in applied]
+
+
+async def _run_transactional(engine: AsyncEngine, steps: list[Step], lock_timeout: str):
+    async with engine.begin() as conn:
+        await conn.execute(text("SET LOCAL statement_timeout = 0"))
+        await conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+        for step in steps:
+            if isinstance(step, Sql):
+                await conn.execute(text(step.statement))
+            else:
+                await step.func(conn)
+
+
+async def _build_index(conn: AsyncConnection, step: ConcurrentIndex):
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс, а IF NOT EXISTS его пропустит
+    valid = (await conn.execute(text(
+        "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+    ), {"name": step.name})).scalar()
+    if valid is False:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {step.name}"))
+    await conn.execute(text(step.statement))
+
+
+async def _apply(engine: AsyncEngine, lock_conn: AsyncConnection, migration: Migration,
+                 lock_timeout: str, report: Callable[[str], None]):
+    started = time.monotonic()
+    batch: list[Step] = []
+    for step in migration.steps:
+        report(f"    {step.describe()}")
+        if isinstance(step, ConcurrentIndex):
+            if batch:
+                await _run_transactional(engine, batch, lock_timeout)
+                batch = []
+            await _build_index(lock_conn, step)
+        else:
+            batch.append(step)
+    if batch:
+        await _run_transactional(engine, batch, lock_timeout)
+    await lock_conn.execute(
+        text("INSERT INTO schema_migrations (version, name, duration_ms) VALUES (:version, :name, :duration)"),
+        {"version": migration.version, "name": migration.name,
+         "duration": round((time.monotonic() - started) * 1000, 1)},
+    )
+
+
+async def migrate(engine: AsyncEngine, migrations: Iterable[Migration], dry_run: bool = False,
+                  lock_timeout: str = "5s", report: Callable[[str], None] = print) -> list[Migration]:
+    """Применяет недостающие миграции по порядку; dry_run — только показывает шаги. Возвращает список."""
+    if not re.fullmatch(r"\d+(ms|s|min)?", lock_timeout):
+        raise ValueError(f"Invalid lock_timeout: {lock_timeout!r}")
+    migrations = sorted(migrations, key=lambda m: m.version)
+    if dry_run:
+        pending = await pending_migrations(engine, migrations)
+        for migration in pending:
+            report(f"[dry-run] {migration.version:04d} {migration.name}")
+            for step in migration.steps:
+                report(f"    {step.describe()}")
+        return pending
+
+    applied_now = []
+    async with engine.connect() as lock_conn:
+        # Отдельное соединение в autocommit: держит advisory lock и выполняет CONCURRENTLY-шаги
+        await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SET statement_timeout = 0"))
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _LOCK_KEY})
+        try:
+            await lock_conn.execute(text(_CREATE_VERSION_TABLE))
+            # Перечитываем под блокировкой: параллельный запуск мог уже всё применить
+            applied = await applied_versions(lock_conn)
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+                report(f"→ {migration.version:04d} {migration.name}")
+                await _apply(engine, lock_conn, migration, lock_timeout, report)
+                applied_now.append(migration)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LOCK_KEY})
+            await lock_conn.execute(text("RESET statement_timeout"))
+    return applied_now
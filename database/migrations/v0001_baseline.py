@@ -0,0 +1,241 @@
+# database/migrations/v0001_baseline.py
+"""
+Базовая схема: всё, что раньше делали setup_database_sync() (create_all) и fix_db.py.
+DDL зафиксирован здесь явно, а не берётся из моделей db.py: новая колонка в модели
+оформляется своей миграцией и на новой БД создаётся ею же, а не этим шагом.
+На старой БД недостающие колонки добавляются ALTER ... IF NOT EXISTS; все шаги безопасно повторять.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ._identity_v1 import link_identity_v1
+from .runner import Migration, Python, Sql
+
+_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id                  BIGINT PRIMARY KEY,
+        username                 VARCHAR,
+        full_name                VARCHAR NOT NULL,
+        reg_date                 TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+        subscription_end_date    TIMESTAMP WITHOUT TIME ZONE,
+        marzban_username         VARCHAR UNIQUE,
+        has_received_trial       BOOLEAN NOT NULL DEFAULT FALSE,
+        referrer_id              BIGINT REFERENCES users(user_id) ON DELETE SET NULL,
+        referral_bonus_days      INTEGER NOT NULL DEFAULT 0,
+        is_first_payment_made    BOOLEAN NOT NULL DEFAULT FALSE,
+        support_topic_id         INTEGER,
+        email                    VARCHAR(255) UNIQUE,
+        password_hash            VARCHAR(255),
+        reset_code               VARCHAR(10),
+        reset_code_expire        TIMESTAMP WITHOUT TIME ZONE,
+        verification_code        VARCHAR(10),
+        verification_code_expire TIMESTAMP WITHOUT TIME ZONE,
+        is_email_verified        BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tariffs (
+        id            BIGSERIAL PRIMARY KEY,
+        name          VARCHAR NOT NULL,
+        price         FLOAT NOT NULL,
+        duration_days INTEGER NOT NULL,
+        is_active     BOOLEAN NOT NULL DEFAULT TRUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS promo_codes (
+        id               BIGSERIAL PRIMARY KEY,
+        code             VARCHAR NOT NULL UNIQUE,
+        bonus_days       INTEGER NOT NULL DEFAULT 0,
+        discount_percent INTEGER NOT NULL DEFAULT 0,
+        expire_date      TIMESTAMP WITHOUT TIME ZONE,
+        max_uses         INTEGER NOT NULL DEFAULT 1,
+        uses_left        INTEGER NOT NULL DEFAULT 1
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS used_promo_codes (
+        id            BIGSERIAL PRIMARY KEY,
+        user_id       BIGINT NOT NULL REFERENCES users(user_id),
+        promo_code_id BIGINT NOT NULL REFERENCES promo_codes(id),
+        used_date     TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id                  BIGSERIAL PRIMARY KEY,
+        yookassa_payment_id VARCHAR NOT NULL,
+        user_id             BIGINT NOT NULL REFERENCES users(user_id),
+        tariff_id           BIGINT NOT NULL REFERENCES tariffs(id),
+        original_amount     FLOAT NOT NULL,
+        final_amount        FLOAT NOT NULL,
+        promo_code          VARCHAR,
+        discount_percent    INTEGER NOT NULL DEFAULT 0,
+        status              VARCHAR NOT NULL DEFAULT 'pending',
+        source              VARCHAR NOT NULL DEFAULT 'bot',
+        created_at          TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+        completed_at        TIMESTAMP WITHOUT TIME ZONE
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_payments_yookassa_payment_id ON payments(yookassa_payment_id)",
+    """
+    CREATE TABLE IF NOT EXISTS channels (
+        id          BIGSERIAL PRIMARY KEY,
+        channel_id  BIGINT NOT NULL UNIQUE,
+        title       VARCHAR NOT NULL,
+        invite_link VARCHAR NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS external_subscriptions (
+        id              SERIAL PRIMARY KEY,
+        name            VARCHAR NOT NULL,
+        url             VARCHAR NOT NULL,
+        added_at        TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+        is_active       BOOLEAN NOT NULL DEFAULT TRUE,
+        etag            VARCHAR,
+        last_modified   VARCHAR,
+        content_hash    VARCHAR,
+        last_fetched_at TIMESTAMP WITHOUT TIME ZONE,
+        last_error      VARCHAR
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS external_configs (
+        id              SERIAL PRIMARY KEY,
+        subscription_id INTEGER NOT NULL REFERENCES external_subscriptions(id) ON DELETE CASCADE,
+        name            VARCHAR NOT NULL,
+        raw_link        VARCHAR NOT NULL,
+        identity_key    VARCHAR(40),
+        is_active       BOOLEAN NOT NULL DEFAULT TRUE,
+        added_at        TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+        is_healthy      BOOLEAN NOT NULL DEFAULT TRUE,
+        latency_ms      FLOAT,
+        availability    FLOAT NOT NULL DEFAULT 1,
+        fail_streak     INTEGER NOT NULL DEFAULT 0,
+        health_rank     INTEGER,
+        checked_at      TIMESTAMP WITHOUT TIME ZONE,
+        last_error      VARCHAR,
+        missing_since   TIMESTAMP WITHOUT TIME ZONE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS marzban_users (
+        username         VARCHAR PRIMARY KEY,
+        status           VARCHAR NOT NULL,
+        expire           BIGINT,
+        used_traffic     BIGINT NOT NULL DEFAULT 0,
+        data_limit       BIGINT NOT NULL DEFAULT 0,
+        subscription_url VARCHAR,
+        updated_at       TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS marzban_sync_state (
+        id           INTEGER PRIMARY KEY,
+        last_sync_at TIMESTAMP WITHOUT TIME ZONE,
+        users_total  INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name       VARCHAR PRIMARY KEY,
+        version    BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS subscription_fetches (
+        id             BIGSERIAL PRIMARY KEY,
+        fetched_at     TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        username       VARCHAR NOT NULL,
+        client_app     VARCHAR NOT NULL,
+        client_version VARCHAR,
+        user_agent     VARCHAR,
+        ip             VARCHAR,
+        status         INTEGER NOT NULL,
+        bytes          INTEGER NOT NULL DEFAULT 0,
+        latency_ms     FLOAT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_subscription_fetches_fetched_at ON subscription_fetches(fetched_at)",
+    """
+    CREATE TABLE IF NOT EXISTS subscription_fetch_hourly (
+        hour           TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        client_app     VARCHAR NOT NULL,
+        fetches        INTEGER NOT NULL DEFAULT 0,
+        users          INTEGER NOT NULL DEFAULT 0,
+        ips            INTEGER NOT NULL DEFAULT 0,
+        errors         INTEGER NOT NULL DEFAULT 0,
+        bytes          BIGINT NOT NULL DEFAULT 0,
+        avg_latency_ms FLOAT NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, client_app)
+    )
+    """,
+)
+
+
+async def _backfill_identity_keys(conn: AsyncConnection):
+    rows = (await conn.execute(text(
+        "SELECT id, raw_link FROM external_configs WHERE identity_key IS NULL"
+    ))).all()
+    if rows:
+        await conn.execute(
+            text("UPDATE external_configs SET identity_key = :key WHERE id = :id"),
+            [{"id": row.id, "key": link_identity_v1(row.raw_link)} for row in rows],
+        )
+
+
+_LEGACY_COLUMNS = (
+    # users: авторизация на сайте и верификация email
+    ("users", "email VARCHAR(255) UNIQUE"),
+    ("users", "password_hash VARCHAR(255)"),
+    ("users", "reset_code VARCHAR(10)"),
+    ("users", "reset_code_expire TIMESTAMP WITHOUT TIME ZONE"),
+    ("users", "verification_code VARCHAR(10)"),
+    ("users", "verification_code_expire TIMESTAMP WITHOUT TIME ZONE"),
+    ("users", "is_email_verified BOOLEAN NOT NULL DEFAULT FALSE"),
+    # external_configs: проверка доступности
+    ("external_configs", "is_healthy BOOLEAN NOT NULL DEFAULT TRUE"),
+    ("external_configs", "latency_ms FLOAT"),
+    ("external_configs", "availability FLOAT NOT NULL DEFAULT 1"),
+    ("external_configs", "fail_streak INTEGER NOT NULL DEFAULT 0"),
+    ("external_configs", "health_rank INTEGER"),
+    ("external_configs", "checked_at TIMESTAMP WITHOUT TIME ZONE"),
+    ("external_configs", "last_error VARCHAR"),
+    # Фоновое обновление внешних подписок
+    ("external_subscriptions", "etag VARCHAR"),
+    ("external_subscriptions", "last_modified VARCHAR"),
+    ("external_subscriptions", "content_hash VARCHAR"),
+    ("external_subscriptions", "last_fetched_at TIMESTAMP WITHOUT TIME ZONE"),
+    ("external_subscriptions", "last_error VARCHAR"),
+    ("external_configs", "missing_since TIMESTAMP WITHOUT TIME ZONE"),
+    ("external_configs", "identity_key VARCHAR(40)"),
+)
+
+MIGRATION = Migration(
+    version=1,
+    name="baseline",
+    steps=(
+        *(Sql(statement) for statement in _TABLES),
+        *(Sql(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}") for table, column in _LEGACY_COLUMNS),
+        Python(_backfill_identity_keys, "заполнить external_configs.identity_key"),
+        # Из дублей внутри источника оставляем включённый и присутствующий у провайдера,
+        # при равенстве — самый старый; один сервер у разных источников дублем не считается
+        Sql("""
+            DELETE FROM external_configs WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY subscription_id, identity_key
+                        ORDER BY is_active DESC, (missing_since IS NULL) DESC, id
+                    ) AS rn
+                    FROM external_configs
+                ) ranked WHERE rn > 1
+            )
+        """),
+        Sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_external_configs_subscription_identity "
+            "ON external_configs(subscription_id, identity_key)"),
+        Sql("ALTER TABLE external_configs ALTER COLUMN identity_key SET NOT NULL"),
+    ),
+)
@@ -0,0 +1,20 @@
+# database/migrations/v0002_performance_indexes.py
+"""Индексы под запросы планировщика, админки и вебхуков; строятся без блокировки записи."""
+from .runner import ConcurrentIndex, Migration
+
+MIGRATION = Migration(
+    version=2,
+    name="performance_indexes",
+    steps=(
+        # Напоминания об окончании подписки (UserRepository.get_with_expiring_subscription*)
+        ConcurrentIndex("ix_users_subscription_end_date", "users", "subscription_end_date"),
+        # Рефералы пользователя (StatsRepository)
+        ConcurrentIndex("ix_users_referrer_id", "users", "referrer_id"),
+        # Поиск по username Marzban без учёта регистра (вебхуки Marzban)
+        ConcurrentIndex("ix_users_lower_marzban_username", "users", "lower(marzban_username)"),
+        # История платежей пользователя и поиск незавершённого
+        ConcurrentIndex("ix_payments_user_id_created_at", "payments", "user_id, created_at DESC"),
+        ConcurrentIndex("ix_payments_pending_created_at", "payments", "created_at", where="status = 'pending'"),
+        # Серверы источника и каскадное удаление покрывает уникальный (subscription_id, identity_key)
+    ),
+)
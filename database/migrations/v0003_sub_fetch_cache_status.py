@@ -0,0 +1,12 @@
+# database/migrations/v0003_sub_fetch_cache_status.py
+"""Аналитика /sub/ из access log nginx: статус кэша nginx у события и число попаданий в часовых агрегатах."""
+from .runner import Migration, Sql
+
+MIGRATION = Migration(
+    version=3,
+    name="sub_fetch_cache_status",
+    steps=(
+        Sql("ALTER TABLE subscription_fetches ADD COLUMN IF NOT EXISTS cache_status VARCHAR(16)"),
+        Sql("ALTER TABLE subscription_fetch_hourly ADD COLUMN IF NOT EXISTS cache_hits INTEGER NOT NULL DEFAULT 0"),
+    ),
+)
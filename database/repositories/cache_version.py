@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+
+from db import CacheVersion
+
+# Канал LISTEN/NOTIFY, в который уходит имя кэша после bump
+CACHE_VERSION_CHANNEL = "cache_versions"
+# Активные внешние VPN-ссылки для прокси /sub/ (webapp/core/external_links.py)
+EXTERNAL_LINKS_CACHE = "external_links"
+
+
+class CacheVersionRepository:
+    def __init__(self, session_maker):
+        self._session_maker = session_maker
+
+    async def get(self, name: str) -> int:
+        async with self._session_maker() as session:
+            result = await session.execute(select(CacheVersion.version).where(CacheVersion.name == name))
+            return result.scalar_one_or_none() or 0
+
+    async def bump(self, name: str) -> int:
+        """Увеличивает версию кэша и оповещает другие процессы через pg_notify. Возвращает новую версию."""
+        async with self._session_maker() as session:
+            stmt = insert(CacheVersion).values(name=name, version=1, updated_at=datetime.now())
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CacheVersion.name],
+                set_={"version": CacheVersion.version + 1, "updated_at": stmt.excluded.updated_at},
+            ).returning(CacheVersion.version)
+            version = (await session.execute(stmt)).scalar_one()
+            # NOTIFY доставляется после COMMIT
+            await session.execute(select(func.pg_notify(CACHE_VERSION_CHANNEL, name)))
+            await session.commit()
+            return version
@@ -1,6 +1,11 @@
 from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
 
 from db import ExternalSubscription, ExternalConfig
+from utils.vpn_links import link_identity
+
+_INSERT_CHUNK = 1000
 
 
 class ExternalSubscriptionRepository:
@@ -24,6 +29,24 @@ class ExternalSubscriptionRepository:
         async with self._session_maker() as session:
             return await session.get(ExternalSubscription, sub_id)
 
+    async def get_refreshable(self) -> list[ExternalSubscription]:
+        """Активные источники с URL (вставленные вручную конфиги обновлять неоткуда)."""
+        async with self._session_maker() as session:
+            result = await session.execute(
+                select(ExternalSubscription)
+                .where(ExternalSubscription.is_active == True)
+                .where(ExternalSubscription.url.like("http%"))
+            )
+            return list(result.scalars().all())
+
+    async def update_feed_state(self, sub_id: int, **fields):
+        """Записывает etag / last_modified / content_hash / last_fetched_at / last_error."""
+        async with self._session_maker() as session:
+            await session.execute(
+                update(ExternalSubscription).where(ExternalSubscription.id == sub_id).values(**fields)
+            )
+            await session.commit()
+
     async def delete(self, sub_id: int):
         async with self._session_maker() as session:
             await session.execute(delete(ExternalSubscription).where(ExternalSubscription.id == sub_id))
@@ -34,28 +57,103 @@ class ExternalConfigRepository:
     def __init__(self, session_maker):
         self._session_maker = session_maker
 
+    @staticmethod
+    def _rows(subscription_id: int, configs: list[dict]) -> list[dict]:
+        """Строки для INSERT с identity_key; повторы внутри пачки отбрасываются."""
+        rows: dict[str, dict] = {}
+        for c in configs:
+            key = link_identity(c["raw_link"])
+            if key not in rows:
+                rows[key] = {"subscription_id": subscription_id, "name": c["name"], "raw_link": c["raw_link"],
+                             "identity_key": key, "is_active": c.get("is_active", True)}
+        return list(rows.values())
+
     async def create_many(self, subscription_id: int, configs: list[dict]) -> int:
-        """Создать несколько конфигов сразу. configs: [{name, raw_link}, ...]"""
+        """
+        Создать несколько конфигов сразу. configs: [{name, raw_link[, is_active]}, ...]
+        Уже сохранённые в этом источнике серверы (по identity_key) не дублируются; если такой сервер
+        выключен, а его выбрали снова — включается. Возвращает число вставленных и включённых.
+        """
+        rows = self._rows(subscription_id, configs)
+        affected = 0
         async with self._session_maker() as session:
-            objs = [
-                ExternalConfig(subscription_id=subscription_id, name=c["name"], raw_link=c["raw_link"])
-                for c in configs
-            ]
-            session.add_all(objs)
+            for i in range(0, len(rows), _INSERT_CHUNK):
+                stmt = insert(ExternalConfig).values(rows[i:i + _INSERT_CHUNK])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[ExternalConfig.subscription_id, ExternalConfig.identity_key],
+                    set_={"is_active": True},
+                    where=stmt.excluded.is_active & (ExternalConfig.is_active == False),
+                ).returning(ExternalConfig.id)
+                result = await session.execute(stmt)
+                affected += len(result.all())
             await session.commit()
-            return len(objs)
+        return affected
 
-    async def get_active(self) -> list[ExternalConfig]:
-        async with self._session_maker() as session:
-            stmt = (
-                select(ExternalConfig)
-                .join(ExternalSubscription, ExternalConfig.subscription_id == ExternalSubscription.id)
-                .where(ExternalConfig.is_active == True)
-                .where(ExternalSubscription.is_active == True)
+    async def get_active(self, healthy_only: bool = False, unique: bool = False) -> list[ExternalConfig]:
+        """
+        Активные конфиги в порядке health_rank (быстрые и доступные — первыми).
+        unique — сервер, который есть в нескольких источниках, один раз (лучшая по рангу копия):
+        для выдачи в /sub/. Проверке доступности нужны все строки.
+        """
+        rank_order = (ExternalConfig.health_rank.asc().nulls_last(), ExternalConfig.id)
+        stmt = (
+            select(ExternalConfig)
+            .join(ExternalSubscription, ExternalConfig.subscription_id == ExternalSubscription.id)
+            .where(ExternalConfig.is_active == True)
+            .where(ExternalConfig.missing_since.is_(None))
+            .where(ExternalSubscription.is_active == True)
+        )
+        if healthy_only:
+            stmt = stmt.where(ExternalConfig.is_healthy == True)
+        if unique:
+            ranked = (
+                stmt.distinct(ExternalConfig.identity_key)
+                .order_by(ExternalConfig.identity_key, *rank_order)
+                .subquery()
             )
+            config = aliased(ExternalConfig, ranked)
+            stmt = select(config).order_by(config.health_rank.asc().nulls_last(), config.id)
+        else:
+            stmt = stmt.order_by(*rank_order)
+        async with self._session_maker() as session:
             result = await session.execute(stmt)
             return list(result.scalars().all())
 
+    async def apply_refresh(self, subscription_id: int, inserts: list[dict], updates: list[dict],
+                            feed_state: dict) -> int:
+        """
+        Применяет результат сверки обновлённой подписки одной транзакцией.
+        inserts: [{name, raw_link, is_active}, ...]; updates: [{id, name, raw_link, missing_since}, ...]
+        Возвращает число реально вставленных строк.
+        """
+        inserted = 0
+        async with self._session_maker() as session:
+            rows = self._rows(subscription_id, inserts)
+            for i in range(0, len(rows), _INSERT_CHUNK):
+                # Сервер, уже сохранённый в этом источнике (гонка с ручным добавлением), не дублируем
+                stmt = (
+                    insert(ExternalConfig).values(rows[i:i + _INSERT_CHUNK])
+                    .on_conflict_do_nothing(index_elements=[ExternalConfig.subscription_id,
+                                                            ExternalConfig.identity_key])
+                    .returning(ExternalConfig.id)
+                )
+                inserted += len((await session.execute(stmt)).all())
+            if updates:
+                await session.execute(update(ExternalConfig), updates)
+            await session.execute(
+                update(ExternalSubscription).where(ExternalSubscription.id == subscription_id).values(**feed_state)
+            )
+            await session.commit()
+        return inserted
+
+    async def update_health(self, rows: list[dict]):
+        """Пакетно записывает результаты проверки. rows: [{id, is_healthy, latency_ms, ...}, ...]"""
+        if not rows:
+            return
+        async with self._session_maker() as session:
+            await session.execute(update(ExternalConfig), rows)
+            await session.commit()
+
     async def get_by_subscription(self, subscription_id: int) -> list[ExternalConfig]:
         async with self._session_maker() as session:
             result = await session.execute(
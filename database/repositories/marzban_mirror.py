@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from sqlalchemy import ARRAY, String, all_, bindparam, delete, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from db import MarzbanUser, MarzbanSyncState
+
+_SYNC_STATE_ID = 1
+
+
+class MarzbanMirrorRepository:
+    def __init__(self, session_maker):
+        self._session_maker = session_maker
+
+    async def upsert_many(self, rows: list[dict]) -> int:
+        """
+        Вставляет/обновляет строки зеркала одним запросом.
+        Строки, у которых данные не поменялись, не перезаписываются. Возвращает число изменённых.
+        rows: [{username, status, expire, used_traffic, data_limit, subscription_url}, ...]
+        """
+        if not rows:
+            return 0
+        now = datetime.now()
+        stmt = insert(MarzbanUser).values([{**row, "updated_at": now} for row in rows])
+        tracked = ("status", "expire", "used_traffic", "data_limit", "subscription_url")
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MarzbanUser.username],
+            set_={col: stmt.excluded[col] for col in tracked + ("updated_at",)},
+            where=tuple_(*(getattr(MarzbanUser, col) for col in tracked)).is_distinct_from(
+                tuple_(*(stmt.excluded[col] for col in tracked))
+            ),
+        )
+        async with self._session_maker() as session:
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount or 0
+
+    async def delete(self, username: str):
+        async with self._session_maker() as session:
+            await session.execute(delete(MarzbanUser).where(MarzbanUser.username == username))
+            await session.commit()
+
+    async def delete_missing(self, seen_usernames: list[str]) -> int:
+        """Удаляет строки пользователей, которых больше нет в Marzban."""
+        stmt = delete(MarzbanUser).where(
+            MarzbanUser.username != all_(bindparam("seen", seen_usernames, type_=ARRAY(String)))
+        )
+        async with self._session_maker() as session:
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount or 0
+
+    async def get_if_fresh(self, username: str, not_older_than: datetime) -> MarzbanUser | None:
+        """
+        Строку зеркала, если она актуальна: последняя полная синхронизация или
+        собственное изменение строки не старше not_older_than.
+        """
+        async with self._session_maker() as session:
+            stmt = (
+                select(MarzbanUser)
+                .outerjoin(MarzbanSyncState, MarzbanSyncState.id == _SYNC_STATE_ID)
+                .where(MarzbanUser.username == username.lower())
+                .where(or_(
+                    MarzbanUser.updated_at >= not_older_than,
+                    MarzbanSyncState.last_sync_at >= not_older_than,
+                ))
+            )
+            result = await session.execute(stmt)
+            return result.scalar_one_or_none()
+
+    async def get(self, username: str) -> MarzbanUser | None:
+        async with self._session_maker() as session:
+            return await session.get(MarzbanUser, username.lower())
+
+    async def mark_synced(self, synced_at: datetime, users_total: int):
+        stmt = insert(MarzbanSyncState).values(id=_SYNC_STATE_ID, last_sync_at=synced_at, users_total=users_total)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MarzbanSyncState.id],
+            set_={"last_sync_at": synced_at, "users_total": users_total},
+        )
+        async with self._session_maker() as session:
+            await session.execute(stmt)
+            await session.commit()
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func, case
+from sqlalchemy.dialects.postgresql import insert
+
+from db import SubscriptionFetch, SubscriptionFetchHourly
+
+# Сколько строк в одном INSERT ... VALUES
+_INSERT_CHUNK = 1000
+# $upstream_cache_status, при которых ответ отдал кэш nginx (REVALIDATED/MISS/EXPIRED дошли до vpn_site)
+CACHE_HIT_STATUSES = ("HIT", "STALE", "UPDATING")
+
+
+class SubscriptionAnalyticsRepository:
+    def __init__(self, session_maker):
+        self._session_maker = session_maker
+
+    async def insert_fetches(self, rows: list[dict]) -> int:
+        """Многострочная вставка событий /sub/. rows: [{fetched_at, username, client_app, ...}, ...]"""
+        if not rows:
+            return 0
+        async with self._session_maker() as session:
+            for i in range(0, len(rows), _INSERT_CHUNK):
+                await session.execute(insert(SubscriptionFetch).values(rows[i:i + _INSERT_CHUNK]))
+            await session.commit()
+        return len(rows)
+
+    async def rollup(self, since: datetime) -> int:
+        """Пересчитывает почасовые агрегаты начиная с часа since (идемпотентно). Возвращает число строк."""
+        since = since.replace(minute=0, second=0, microsecond=0)
+        hour = func.date_trunc("hour", SubscriptionFetch.fetched_at)
+        source = (
+            select(
+                hour.label("hour"),
+                SubscriptionFetch.client_app,
+                func.count().label("fetches"),
+                func.count(SubscriptionFetch.username.distinct()).label("users"),
+                func.count(SubscriptionFetch.ip.distinct()).label("ips"),
+                func.sum(case((SubscriptionFetch.status >= 400, 1), else_=0)).label("errors"),
+                func.coalesce(func.sum(SubscriptionFetch.bytes), 0).label("bytes"),
+                func.avg(SubscriptionFetch.latency_ms).label("avg_latency_ms"),
+                func.sum(case((SubscriptionFetch.cache_status.in_(CACHE_HIT_STATUSES), 1), else_=0)).label("cache_hits"),
+            )
+            .where(SubscriptionFetch.fetched_at >= since)
+            .group_by(hour, SubscriptionFetch.client_app)
+        )
+        columns = ["hour", "client_app", "fetches", "users", "ips", "errors", "bytes", "avg_latency_ms", "cache_hits"]
+        stmt = insert(SubscriptionFetchHourly).from_select(columns, source)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SubscriptionFetchHourly.hour, SubscriptionFetchHourly.client_app],
+            set_={col: stmt.excluded[col] for col in columns[2:]},
+        )
+        async with self._session_maker() as session:
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount or 0
+
+    async def purge_raw(self, older_than: datetime) -> int:
+        async with self._session_maker() as session:
+            result = await session.execute(delete(SubscriptionFetch).where(SubscriptionFetch.fetched_at < older_than))
+            await session.commit()
+            return result.rowcount or 0
+
+    async def get_summary(self, hours: int = 24) -> dict:
+        """Итоги за последние hours часов по агрегатам."""
+        since = datetime.now() - timedelta(hours=hours)
+        async with self._session_maker() as session:
+            stmt = select(
+                func.coalesce(func.sum(SubscriptionFetchHourly.fetches), 0),
+                func.coalesce(func.sum(SubscriptionFetchHourly.errors), 0),
+                func.coalesce(func.sum(SubscriptionFetchHourly.bytes), 0),
+                func.coalesce(func.sum(SubscriptionFetchHourly.cache_hits), 0),
+            ).where(SubscriptionFetchHourly.hour >= since)
+            fetches, errors, total_bytes, cache_hits = (await session.execute(stmt)).one()
+            # Уникальных пользователей за период нельзя сложить из часовых агрегатов — считаем по сырым данным
+            users = (await session.execute(
+                select(func.count(SubscriptionFetch.username.distinct())).where(SubscriptionFetch.fetched_at >= since)
+            )).scalar_one()
+        return {"fetches": fetches, "errors": errors, "bytes": total_bytes, "users": users, "cache_hits": cache_hits}
+
+    async def get_top_clients(self, hours: int = 24, limit: int = 8) -> list[tuple[str, int]]:
+        since = datetime.now() - timedelta(hours=hours)
+        async with self._session_maker() as session:
+            total = func.sum(SubscriptionFetchHourly.fetches)
+            stmt = (
+                select(SubscriptionFetchHourly.client_app, total)
+                .where(SubscriptionFetchHourly.hour >= since)
+                .group_by(SubscriptionFetchHourly.client_app)
+                .order_by(total.desc())
+                .limit(limit)
+            )
+            return [(row[0], row[1]) for row in (await session.execute(stmt)).all()]
+
+    async def get_top_versions(self, hours: int = 24, limit: int = 5) -> list[tuple[str, str, int]]:
+        since = datetime.now() - timedelta(hours=hours)
+        async with self._session_maker() as session:
+            users = func.count(SubscriptionFetch.username.distinct())
+            stmt = (
+                select(SubscriptionFetch.client_app, SubscriptionFetch.client_version, users)
+                .where(SubscriptionFetch.fetched_at >= since)
+                .group_by(SubscriptionFetch.client_app, SubscriptionFetch.client_version)
+                .order_by(users.desc())
+                .limit(limit)
+            )
+            return [(row[0], row[1] or "?", row[2]) for row in (await session.execute(stmt)).all()]
+
+    async def get_hourly(self, hours: int = 12) -> list[tuple[datetime, int, int, float]]:
+        """(час, запросов, ошибок, средняя задержка) по всем клиентам."""
+        since = datetime.now() - timedelta(hours=hours)
+        async with self._session_maker() as session:
+            fetches = func.sum(SubscriptionFetchHourly.fetches)
+            latency = func.sum(SubscriptionFetchHourly.avg_latency_ms * SubscriptionFetchHourly.fetches) / func.nullif(fetches, 0)
+            stmt = (
+                select(SubscriptionFetchHourly.hour, fetches, func.sum(SubscriptionFetchHourly.errors), latency)
+                .where(SubscriptionFetchHourly.hour >= since)
+                .group_by(SubscriptionFetchHourly.hour)
+                .order_by(SubscriptionFetchHourly.hour)
+            )
+            return [(row[0], row[1], row[2], float(row[3] or 0)) for row in (await session.execute(stmt)).all()]
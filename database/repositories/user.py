@@ -33,6 +33,12 @@ class UserRepository:
             result = await session.execute(stmt)
             return result.scalar_one_or_none()
 
+    async def get_by_marzban_username(self, marzban_username: str) -> User | None:
+        async with self._session_maker() as session:
+            stmt = select(User).where(func.lower(User.marzban_username) == marzban_username.lower())
+            result = await session.execute(stmt)
+            return result.scalars().first()
+
     async def get_all_ids(self) -> list[int]:
         async with self._session_maker() as session:
             stmt = select(User.user_id)
@@ -55,6 +61,12 @@ class UserRepository:
             user.subscription_end_date = new_date
             await session.commit()
 
+    async def set_subscription_end_date(self, user_id: int, end_date: datetime | None):
+        async with self._session_maker() as session:
+            stmt = update(User).where(User.user_id == user_id).values(subscription_end_date=end_date)
+            await session.execute(stmt)
+            await session.commit()
+
     async def set_referrer(self, user_id: int, referrer_id: int):
         async with self._session_maker() as session:
             stmt = update(User).where(User.user_id == user_id).values(referrer_id=referrer_id)
@@ -2,22 +2,46 @@
 
 import datetime
 from sqlalchemy import (
-    create_engine, BigInteger, String, DateTime, Boolean, ForeignKey,
-    Integer, Float, select, func
+    BigInteger, String, DateTime, Boolean, ForeignKey,
+    Index, Integer, Float, select, func
 )
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 from config import load_config
+from db_pool import InstrumentedAsyncPool, pool_metrics
 
 # --- 1. Настройка ---
 config = load_config()
 db_config = config.dataBase
 DSN = f"postgresql+asyncpg://{db_config.user}:{db_config.password}@{db_config.host}:{db_config.port}/{db_config.db_name}"
-SYNC_DSN = f"postgresql://{db_config.user}:{db_config.password}@{db_config.host}:{db_config.port}/{db_config.db_name}"
+
+# Серверные настройки сессии: имя процесса видно в pg_stat_activity
+_server_settings = {"application_name": f"vpn_{db_config.workload}"}
+if db_config.statement_timeout_ms > 0:
+    _server_settings["statement_timeout"] = str(db_config.statement_timeout_ms)
 
 # Создаем асинхронный "движок" и фабрику сессий
-async_engine = create_async_engine(DSN)
+async_engine = create_async_engine(
+    # prepared_statement_cache_size — кэш диалекта SQLAlchemy, statement_cache_size — самого asyncpg
+    f"{DSN}?prepared_statement_cache_size={db_config.statement_cache_size}",
+    poolclass=InstrumentedAsyncPool,
+    pool_size=db_config.pool_size,
+    max_overflow=db_config.max_overflow,
+    pool_timeout=db_config.pool_timeout,
+    pool_recycle=db_config.pool_recycle,
+    pool_pre_ping=db_config.pool_pre_ping,
+    connect_args={
+        "statement_cache_size": db_config.statement_cache_size,
+        "server_settings": _server_settings,
+    },
+)
+POOL_CAPACITY = db_config.pool_size + max(db_config.max_overflow, 0)
+
+
+def render_pool_metrics() -> str:
+    """Метрики пула этого процесса в формате Prometheus (GET /metrics)."""
+    return pool_metrics.render_prometheus(async_engine.pool, POOL_CAPACITY, db_config.workload)
 async_session_maker = async_sessionmaker(async_engine, expire_on_commit=False)
 
 # --- 2. Базовая модель ---
@@ -108,22 +132,101 @@ class ExternalSubscription(Base):
     url: Mapped[str] = mapped_column(String)
     added_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.utcnow)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    # Состояние фонового обновления: валидаторы для условного GET и хэш последнего тела
+    etag: Mapped[str] = mapped_column(String, nullable=True)
+    last_modified: Mapped[str] = mapped_column(String, nullable=True)
+    content_hash: Mapped[str] = mapped_column(String, nullable=True)
+    last_fetched_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(String, nullable=True)
 
 
 class ExternalConfig(Base):
-    """Отдельный сервер из внешней подписки, выбранный админом."""
+    """Отдельный сервер из внешней подписки (невыбранные админом хранятся с is_active=False)."""
     __tablename__ = 'external_configs'
+    # Один сервер хранится один раз в пределах источника; общий для двух источников — у каждого свой,
+    # повторы между источниками убираются при выдаче (ExternalConfigRepository.get_active(unique=True))
+    __table_args__ = (
+        Index("ix_external_configs_subscription_identity", "subscription_id", "identity_key", unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     subscription_id: Mapped[int] = mapped_column(Integer, ForeignKey('external_subscriptions.id', ondelete='CASCADE'))
     name: Mapped[str] = mapped_column(String)
     raw_link: Mapped[str] = mapped_column(String)
+    # utils.vpn_links.link_identity(raw_link): ключ сервера без учёта названия
+    identity_key: Mapped[str] = mapped_column(String(40))
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     added_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.utcnow)
-
-
-# --- 4. Функция для создания таблиц ---
-def setup_database_sync():
-    """Создает таблицы синхронно при старте бота."""
-    engine = create_engine(SYNC_DSN)
-    Base.metadata.create_all(engine)
-    print("INFO: Database tables created or already exist via SQLAlchemy.")
\ No newline at end of file
+    # Результаты фоновой проверки доступности (ExternalHealthService)
+    is_healthy: Mapped[bool] = mapped_column(Boolean, default=True)
+    # Скользящее среднее задержки подключения (мс) и доли удачных проверок (0..1)
+    latency_ms: Mapped[float] = mapped_column(Float, nullable=True)
+    availability: Mapped[float] = mapped_column(Float, default=1.0)
+    fail_streak: Mapped[int] = mapped_column(Integer, default=0)
+    # Порядок выдачи в /sub/ (меньше — выше); NULL — ещё не проверялся
+    health_rank: Mapped[int] = mapped_column(Integer, nullable=True)
+    checked_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(String, nullable=True)
+    # С какого момента сервера нет в подписке провайдера (NULL — есть); такие в /sub/ не отдаются
+    missing_since: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+
+
+class MarzbanUser(Base):
+    """Локальное зеркало пользователя Marzban (обновляется фоновой синхронизацией и при записи)."""
+    __tablename__ = 'marzban_users'
+    username: Mapped[str] = mapped_column(String, primary_key=True)
+    status: Mapped[str] = mapped_column(String)
+    expire: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    used_traffic: Mapped[int] = mapped_column(BigInteger, default=0)
+    data_limit: Mapped[int] = mapped_column(BigInteger, default=0)
+    subscription_url: Mapped[str] = mapped_column(String, nullable=True)
+    # Когда строка последний раз менялась (неизменённые строки синхронизация не трогает)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+
+
+class MarzbanSyncState(Base):
+    """Состояние синхронизации зеркала marzban_users (одна строка, id=1)."""
+    __tablename__ = 'marzban_sync_state'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    last_sync_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    users_total: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class CacheVersion(Base):
+    """Версии разделяемых кэшей: процессы сверяют version и перечитывают данные при её смене."""
+    __tablename__ = 'cache_versions'
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+
+
+class SubscriptionFetch(Base):
+    """Сырой журнал запросов /sub/ (пишется пачками из vpn_site, чистится через retention)."""
+    __tablename__ = 'subscription_fetches'
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    fetched_at: Mapped[datetime.datetime] = mapped_column(DateTime, index=True)
+    username: Mapped[str] = mapped_column(String)
+    client_app: Mapped[str] = mapped_column(String)
+    client_version: Mapped[str] = mapped_column(String, nullable=True)
+    user_agent: Mapped[str] = mapped_column(String, nullable=True)
+    ip: Mapped[str] = mapped_column(String, nullable=True)
+    status: Mapped[int] = mapped_column(Integer)
+    bytes: Mapped[int] = mapped_column(Integer, default=0)
+    latency_ms: Mapped[float] = mapped_column(Float)
+    # $upstream_cache_status nginx: HIT/STALE/UPDATING — ответ из кэша nginx, без запроса к vpn_site
+    cache_status: Mapped[str] = mapped_column(String(16), nullable=True)
+
+
+class SubscriptionFetchHourly(Base):
+    """Почасовые агрегаты subscription_fetches по клиентскому приложению."""
+    __tablename__ = 'subscription_fetch_hourly'
+    hour: Mapped[datetime.datetime] = mapped_column(DateTime, primary_key=True)
+    client_app: Mapped[str] = mapped_column(String, primary_key=True)
+    fetches: Mapped[int] = mapped_column(Integer, default=0)
+    users: Mapped[int] = mapped_column(Integer, default=0)
+    ips: Mapped[int] = mapped_column(Integer, default=0)
+    errors: Mapped[int] = mapped_column(Integer, default=0)
+    bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    avg_latency_ms: Mapped[float] = mapped_column(Float, default=0)
+    cache_hits: Mapped[int] = mapped_column(Integer, default=0)
+
+# Схема создаётся и обновляется миграциями: python3 -m database.migrations (database/migrations)
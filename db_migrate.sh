@@ -85,9 +85,9 @@ echo "    ✅ Данные восстановлены"
 
 # ── Шаг 4: Применяем миграции схемы ──────────────────────────
 echo ""
-echo "4️⃣  Применяю миграции (fix_db.py)..."
+echo "4️⃣  Применяю миграции (database/migrations)..."
 
-docker exec vpn_bot python3 fix_db.py
+docker exec vpn_bot python3 -m database.migrations
 
 # ── Шаг 5: Перезапуск сервисов ───────────────────────────────
 echo ""
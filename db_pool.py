@@ -0,0 +1,100 @@
+# db_pool.py — пул соединений SQLAlchemy с замером ожидания и метрики пула для /metrics
+
+import hmac
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Границы гистограммы ожидания соединения (секунды)
+_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolMetrics:
+    """Счётчики ожидания соединения из пула; одни на процесс (бот и сайт — разные процессы)."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.peak_checked_out = 0
+        self._buckets = [0] * len(_WAIT_BUCKETS)
+
+    def observe(self, wait: float, checked_out: int):
+        self.checkouts += 1
+        self.wait_sum += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.peak_checked_out = max(self.peak_checked_out, checked_out)
+        for i, bound in enumerate(_WAIT_BUCKETS):
+            if wait <= bound:
+                self._buckets[i] += 1
+                break
+
+    def snapshot(self, pool, capacity: int) -> dict:
+        checked_out = pool.checkedout()
+        return {
+            "size": pool.size(),
+            "checked_out": checked_out,
+            "overflow": max(pool.overflow(), 0),
+            "capacity": capacity,
+            "utilization": round(checked_out / capacity, 3) if capacity else 0.0,
+            "peak_checked_out": self.peak_checked_out,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_sum / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+    def render_prometheus(self, pool, capacity: int, workload: str) -> str:
+        """Текстовый формат Prometheus."""
+        label = f'workload="{workload}"'
+        snap = self.snapshot(pool, capacity)
+        lines = [
+            "# HELP db_pool_checkout_wait_seconds Time to get a DB connection from the pool, including "
+            "opening a new one when the pool grows (first use or overflow), not only queue wait.",
+            "# TYPE db_pool_checkout_wait_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(_WAIT_BUCKETS, self._buckets):
+            cumulative += count
+            lines.append(f'db_pool_checkout_wait_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines += [
+            f'db_pool_checkout_wait_seconds_bucket{{{label},le="+Inf"}} {self.checkouts}',
+            f"db_pool_checkout_wait_seconds_sum{{{label}}} {self.wait_sum:.6f}",
+            f"db_pool_checkout_wait_seconds_count{{{label}}} {self.checkouts}",
+            "# TYPE db_pool_checkout_timeouts_total counter",
+            f"db_pool_checkout_timeouts_total{{{label}}} {self.timeouts}",
+        ]
+        for name in ("size", "checked_out", "overflow", "capacity", "utilization", "peak_checked_out"):
+            lines.append(f"# TYPE db_pool_{name} gauge")
+            lines.append(f"db_pool_{name}{{{label}}} {snap[name]}")
+        return "\n".join(lines) + "\n"
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool, который меряет время выдачи соединения. Если свободного нет и пул может
+    вырасти, _do_get открывает новое — это время тоже попадает в замер (см. HELP метрики).
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        pool_metrics.observe(time.perf_counter() - started, self.checkedout())
+        return conn
+
+
+def metrics_authorized(authorization: str | None, token: str | None) -> bool:
+    """Проверка заголовка 'Authorization: Bearer <DB_METRICS_TOKEN>'."""
+    if not token or not authorization:
+        return False
+    scheme, _, value = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(value.strip(), token)
@@ -88,4 +88,4 @@ echo ""
 echo "✅ Готово! База '$LOCAL_DB' восстановлена из $REMOTE"
 echo ""
 echo "Следующий шаг — примените миграции (на случай если схема новее дампа):"
-echo "  python3 fix_db.py"
+echo "  python3 -m database.migrations"
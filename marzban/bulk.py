@@ -0,0 +1,166 @@
+# marzban/bulk.py — конкурентное выполнение массовых изменений в Marzban с адаптивным лимитом
+
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Optional, Tuple, Union
+
+
+@dataclass(slots=True)
+class BulkItemResult:
+    """Результат обработки одного элемента."""
+    key: str
+    ok: bool
+    result: Any = None
+    error: Optional[str] = None
+    latency: float = 0.0
+
+
+@dataclass(slots=True)
+class BulkProgress:
+    done: int = 0
+    ok: int = 0
+    failed: int = 0
+    concurrency: int = 0
+
+
+class AimdLimiter:
+    """
+    Лимит параллельных запросов по схеме AIMD:
+    - ответ быстрее target_latency без ошибки → после `limit` таких ответов лимит +1;
+    - ошибка или медленный ответ → лимит делится пополам (не чаще раза в cooldown секунд,
+      чтобы одна волна ошибок от уже запущенных запросов не обрушила лимит до минимума).
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16,
+                 target_latency: float = 1.0, cooldown: float = 1.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self._active = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+    async def release(self, latency: float, ok: bool):
+        async with self._cond:
+            self._active -= 1
+            if ok and latency <= self.target_latency:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit = min(self.limit + 1, self.maximum)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self._successes = 0
+                    self.limit = max(self.limit // 2, self.minimum)
+            self._cond.notify_all()
+
+
+BulkItems = Union[Iterable[Tuple[str, Any]], AsyncIterable[Tuple[str, Any]]]
+ProgressCallback = Callable[[BulkItemResult, BulkProgress], Union[None, Awaitable[None]]]
+# По исключению worker'а: через сколько секунд повторить тот же элемент, или None — это сбой элемента
+BackoffPolicy = Callable[[Exception], Optional[float]]
+
+
+async def _aiter(items: BulkItems):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def run_bulk(items: BulkItems,
+                   worker: Callable[[str, Any], Awaitable[Any]],
+                   limiter: AimdLimiter,
+                   progress: Optional[ProgressCallback] = None,
+                   backoff: Optional[BackoffPolicy] = None,
+                   max_pause: float = 600.0) -> list[BulkItemResult]:
+    """
+    Выполняет worker(key, payload) для каждого элемента с адаптивной параллельностью.
+    Элементы читаются лениво (подходит для async-генераторов вроде iter_users).
+    backoff — исключения-сигналы «подождать» (например, открытый circuit breaker): задание
+    приостанавливается, лимит снижается, элемент повторяется, а не считается сбоем. Если пауза
+    без единого успешного элемента длится дольше max_pause секунд, такие исключения — обычные сбои.
+    Возвращает результаты по каждому элементу в порядке завершения.
+    """
+    results: list[BulkItemResult] = []
+    stats = BulkProgress()
+    tasks: set[asyncio.Task] = set()
+    # Общая пауза задания и начало непрерывной серии пауз (None — последний элемент прошёл)
+    resume_at = 0.0
+    paused_since: Optional[float] = None
+
+    def pause_delay(error: Exception) -> Optional[float]:
+        nonlocal resume_at, paused_since
+        delay = backoff(error) if backoff is not None else None
+        if delay is None:
+            return None
+        now = time.monotonic()
+        if paused_since is None:
+            paused_since = now
+        elif now - paused_since > max_pause:
+            return None
+        resume_at = max(resume_at, now + max(delay, 0.1))
+        return resume_at - now
+
+    async def run_one(key: str, payload: Any):
+        nonlocal paused_since
+        while True:
+            wait = resume_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                value = await worker(key, payload)
+                item = BulkItemResult(key=key, ok=True, result=value)
+                paused_since = None
+            except Exception as e:
+                delay = pause_delay(e)
+                if delay is not None:
+                    # Не сбой элемента: уступаем слот, снижаем лимит и повторяем после паузы
+                    await limiter.release(time.monotonic() - started, ok=False)
+                    await asyncio.sleep(delay)
+                    await limiter.acquire()
+                    continue
+                item = BulkItemResult(key=key, ok=False, error=str(e) or e.__class__.__name__)
+            break
+        item.latency = time.monotonic() - started
+        await limiter.release(item.latency, item.ok)
+
+        results.append(item)
+        stats.done += 1
+        if item.ok:
+            stats.ok += 1
+        else:
+            stats.failed += 1
+        stats.concurrency = limiter.limit
+        if progress is not None:
+            maybe_awaitable = progress(item, stats)
+            if inspect.isawaitable(maybe_awaitable):
+                await maybe_awaitable
+
+    try:
+        async for key, payload in _aiter(items):
+            await limiter.acquire()
+            task = asyncio.create_task(run_one(key, payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return results
@@ -1,18 +1,34 @@
 # marzban/init_client.py (оптимизированная версия + метод delete)
 
+import asyncio
+
 import httpx
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Hashable
+
+from cachetools import TTLCache
 
-from marzban_api_client.api.admin import admin_token
-from marzban_api_client.models.body_admin_token_api_admin_token_post import (
-    BodyAdminTokenApiAdminTokenPost,
-)
-from marzban_api_client.client import Client
+from marzban.bulk import AimdLimiter, BulkItemResult, BulkItems, ProgressCallback, run_bulk
+from marzban.records import MarzbanUserRecord
+from marzban.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from marzban.templates import InboundTemplateCache
 
 DATA_LIMIT_BYTES = 1_000 * 1024 ** 3  # 1000 ГБ в байтах
 DATA_LIMIT_RESET_STRATEGY = "month"   # сброс лимита каждый месяц
 
+_TOKEN_PATH = "/api/admin/token"
+
+# Таймауты по типам запросов: короткие для интерактивных чтений, длиннее для списков
+_ENDPOINT_TIMEOUTS = {
+    "token": httpx.Timeout(10.0, connect=3.0),
+    "user": httpx.Timeout(5.0, connect=3.0),
+    "users": httpx.Timeout(20.0, connect=3.0),
+    "system": httpx.Timeout(5.0, connect=3.0),
+    "nodes": httpx.Timeout(5.0, connect=3.0),
+    "inbounds": httpx.Timeout(5.0, connect=3.0),
+    "write": httpx.Timeout(10.0, connect=3.0),
+}
+
 
 class MarzClientCache:
     def __init__(self, base_url: str, config, logger):
@@ -22,104 +38,243 @@ class MarzClientCache:
         self._config = config
         self._logger = logger
         self._token: str = ''
+        # Один in-flight refresh на всех: конкурентные вызовы ждут его результата
+        self._token_lock = asyncio.Lock()
+        # Шаблон proxies/inbounds для add_user (не запрашиваем /api/inbounds на каждого юзера)
+        self.templates = InboundTemplateCache(self._fetch_inbounds, config.marzban.inbounds_ttl, logger)
+        # Read-through кэш get_user: TTL + LRU-вытеснение, сбрасывается при любой записи
+        self._user_cache: TTLCache = TTLCache(
+            maxsize=config.marzban.user_cache_size, ttl=config.marzban.user_cache_ttl
+        )
+        self._user_cache_hits = 0
+        self._user_cache_misses = 0
+        # Счётчик записей: ответ GET, начатого до записи, не должен попасть в кэш
+        self._write_gen = 0
+        # Одинаковые конкурентные GET'ы ждут один общий запрос
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # Пока панель лежит, запросы падают сразу, а не висят до таймаута
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.marzban.breaker_threshold,
+            reset_timeout=config.marzban.breaker_reset_timeout,
+            logger=logger,
+        )
+        self._retry = RetryPolicy(attempts=config.marzban.retry_attempts)
+        # Подписчики на изменения пользователей (например, локальное зеркало в БД)
+        self._user_listeners: list[Callable[[str, Optional[Dict[str, Any]]], Awaitable[None]]] = []
+
+    def _token_is_valid(self) -> bool:
+        return bool(self._token) and self._exp_at is not None and self._exp_at > datetime.now()
 
     async def _get_token(self) -> str:
-        """Получает токен доступа для API Marzban."""
+        """Получает токен доступа для API Marzban (через общий пул соединений)."""
         try:
-            login_data = BodyAdminTokenApiAdminTokenPost(
-                username=self._config.marzban.username, 
-                password=self._config.marzban.password
+            response = await self._get_or_create_client().post(
+                _TOKEN_PATH,
+                data={
+                    "username": self._config.marzban.username,
+                    "password": self._config.marzban.password,
+                },
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=_ENDPOINT_TIMEOUTS["token"],
             )
-            async with Client(base_url=self._base_url, verify_ssl=False) as temp_client:
-                token_response = await admin_token.asyncio(client=temp_client, body=login_data)
-                return token_response.access_token
+            response.raise_for_status()
+            return response.json()["access_token"]
         except Exception as e:
             self._logger.error(f"Error getting Marzban token: {e}", exc_info=True)
             raise
 
-    async def get_http_client(self) -> httpx.AsyncClient:
-        """Возвращает аутентифицированный httpx клиент, обновляя токен при необходимости."""
-        if not self._http_client or self._exp_at < datetime.now():
+    async def _ensure_token(self) -> str:
+        """Обновляет токен, если он истёк. Параллельные вызовы ждут один общий логин."""
+        if self._token_is_valid():
+            return self._token
+        async with self._token_lock:
+            # Пока ждали lock, токен мог обновить другой вызов
+            if self._token_is_valid():
+                return self._token
             self._logger.info('Getting new Marzban token...')
-            token = await self._get_token()
+            self._token = await self._get_token()
             self._exp_at = datetime.now() + timedelta(minutes=self._config.marzban.token_expire - 1)
-            
-            headers = {
-                "Authorization": f"Bearer {token}", 
-                "Content-Type": "application/json", 
-                "Accept": "application/json"
-            }
-            # Закрываем старый клиент, если он был, чтобы освободить ресурсы
-            if self._http_client:
-                await self._http_client.aclose()
-            
-            self._http_client = httpx.AsyncClient(base_url=self._base_url, headers=headers, verify=False, timeout=30.0)
-            self._logger.info('New Marzban http client created.')
+            self._logger.info('Marzban token refreshed.')
+            return self._token
+
+    async def _inject_token(self, request: httpx.Request):
+        """Request hook: подставляет актуальный Bearer-токен в каждый запрос."""
+        if request.url.path == _TOKEN_PATH:
+            return
+        token = await self._ensure_token()
+        request.headers["Authorization"] = f"Bearer {token}"
+
+    async def _drop_token_on_401(self, response: httpx.Response):
+        """Response hook: если Marzban отверг токен (рестарт панели), следующий запрос перелогинится."""
+        if response.status_code == 401 and response.request.url.path != _TOKEN_PATH:
+            self._exp_at = None
+
+    def _get_or_create_client(self) -> httpx.AsyncClient:
+        """Создаёт один долгоживущий клиент с keep-alive пулом (токен подставляется hook'ом)."""
+        if self._http_client is None or self._http_client.is_closed:
+            marz_cfg = self._config.marzban
+            http2 = marz_cfg.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    self._logger.warning("MARZ_HTTP2 is enabled, but 'h2' is not installed. Falling back to HTTP/1.1.")
+                    http2 = False
+
+            self._http_client = httpx.AsyncClient(
+                base_url=self._base_url,
+                headers={"Content-Type": "application/json", "Accept": "application/json"},
+                verify=False,
+                timeout=30.0,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=marz_cfg.pool_size,
+                    max_keepalive_connections=marz_cfg.keepalive_connections,
+                    keepalive_expiry=marz_cfg.keepalive_expiry,
+                ),
+                event_hooks={
+                    "request": [self._inject_token],
+                    "response": [self._drop_token_on_401],
+                },
+            )
+            self._logger.info(
+                f'Marzban http client created (pool={marz_cfg.pool_size}, http2={http2}).'
+            )
         return self._http_client
 
-        
+    async def get_http_client(self) -> httpx.AsyncClient:
+        """Возвращает аутентифицированный httpx клиент. Клиент один на весь процесс."""
+        client = self._get_or_create_client()
+        await self._ensure_token()
+        return client
+
+    async def close(self):
+        """Закрывает пул соединений (при остановке приложения)."""
+        if self._http_client and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+
+    @property
+    def is_available(self) -> bool:
+        """False, пока circuit breaker открыт (Marzban недавно не отвечал)."""
+        return self.breaker.is_available
+
+    async def _send(self, method: str, path: str, endpoint: str, **kwargs) -> httpx.Response:
+        """
+        Единая точка запросов к Marzban:
+        - таймаут по типу запроса (endpoint);
+        - circuit breaker: при открытом сразу CircuitOpenError;
+        - повторы с jitter только для GET (сетевые ошибки и 5xx).
+        Для breaker'а это один вызов: сбой (включая логин и повторы) считается один раз.
+        4xx не считаются сбоем панели и возвращаются как есть.
+        """
+        self.breaker.before_call()
+        try:
+            response = await self._send_with_retries(method, path, endpoint, **kwargs)
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def _send_with_retries(self, method: str, path: str, endpoint: str, **kwargs) -> httpx.Response:
+        attempts = self._retry.attempts if method == "GET" else 1
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                client = await self.get_http_client()
+                response = await client.request(method, path, timeout=_ENDPOINT_TIMEOUTS[endpoint], **kwargs)
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self._retry.delay(attempt))
+                continue
+            if response.status_code >= 500 and not last_attempt:
+                await asyncio.sleep(self._retry.delay(attempt))
+                continue
+            return response
+
+    async def _coalesce(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Объединяет одинаковые конкурентные чтения: пока запрос с ключом key в полёте,
+        остальные вызовы ждут его результат вместо повторного запроса.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget_inflight(k, t))
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget_inflight(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Помечаем исключение полученным, даже если все ожидающие уже ушли
+            task.exception()
+
+    async def _fetch_json(self, path: str, endpoint: str) -> Any:
+        response = await self._send("GET", path, endpoint)
+        response.raise_for_status()
+        return response.json()
+
     async def get_system_stats(self) -> Dict[str, Any]:
         """Получает системную статистику из Marzban (включая онлайн)."""
-        client = await self.get_http_client()
         try:
-            response = await client.get("/api/system")
-            response.raise_for_status()
-            return response.json()
+            return await self._coalesce(("GET", "/api/system"), lambda: self._fetch_json("/api/system", "system"))
         except Exception as e:
             self._logger.error(f"Failed to get system stats from Marzban: {e}")
             # Возвращаем пустой словарь с дефолтными значениями
             return {"online_clients": 0, "cpu_usage": 0, "mem_usage": 0}
-    
+
     async def get_nodes(self) -> list:
         """Получает список всех узлов (серверов) из Marzban."""
-        client = await self.get_http_client()
         try:
-            response = await client.get("/api/nodes")
-            response.raise_for_status()
-            nodes_list = response.json()
+            nodes_list = await self._coalesce(("GET", "/api/nodes"), lambda: self._fetch_json("/api/nodes", "nodes"))
             return nodes_list if isinstance(nodes_list, list) else []
         except Exception as e:
             self._logger.error(f"Failed to get nodes from Marzban: {e}")
             return []
+
+    async def _fetch_inbounds(self) -> Dict[str, list]:
+        return await self._coalesce(("GET", "/api/inbounds"), lambda: self._fetch_json("/api/inbounds", "inbounds"))
+
     async def get_inbounds(self) -> Dict[str, list]:
         """Получает доступные inbounds из Marzban."""
-        client = await self.get_http_client()
         try:
-            response = await client.get("/api/inbounds")
-            response.raise_for_status()
-            return response.json()
+            return await self._fetch_inbounds()
         except Exception as e:
             self._logger.error(f"Failed to get inbounds from Marzban: {e}")
             return {}
 
-    async def add_user(self, username: str, expire_days: int) -> Dict[str, Any]:
-        """Создает нового пользователя в Marzban, автоматически определяя доступные inbounds."""
-        client = await self.get_http_client()
-        expire_timestamp = int((datetime.now() + timedelta(days=expire_days)).timestamp())
-
-        # Запрашиваем доступные inbounds у Marzban
-        inbounds = await self.get_inbounds()
-        self._logger.info(f"Available Marzban inbounds: {inbounds}")
-
-        # Строим proxies и inbounds на основе доступных
-        proxies = {}
-        inbounds_map = {}
-        for protocol, items in inbounds.items():
-            if items:
-                # items может быть списком объектов [{tag, protocol, ...}] или строк
-                tags = []
-                for item in items:
-                    if isinstance(item, dict):
-                        tags.append(item["tag"])
-                    else:
-                        tags.append(item)
-                inbounds_map[protocol] = tags
-                if protocol == "vless":
-                    proxies[protocol] = {"flow": "xtls-rprx-vision"}
-                else:
-                    proxies[protocol] = {}
+    async def refresh_templates(self):
+        """Фоновое обновление шаблона inbounds (вызывается планировщиком)."""
+        try:
+            await self.templates.refresh(force=True)
+        except Exception as e:
+            self._logger.warning(f"Failed to refresh Marzban inbound template: {e}")
 
-        if not proxies:
+    async def add_user(self, username: str, expire_days: int = 0,
+                       expire_ts: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Создает нового пользователя в Marzban по закэшированному шаблону inbounds.
+        Срок задаётся либо в днях от текущего момента, либо абсолютным timestamp (expire_ts).
+        """
+        if expire_ts is not None:
+            expire_timestamp = int(expire_ts)
+        else:
+            expire_timestamp = int((datetime.now() + timedelta(days=expire_days)).timestamp())
+
+        template = await self.templates.get()
+        if not template.proxies:
+            self.templates.invalidate()
             raise ValueError(f"No inbounds available in Marzban. Configure at least one inbound in Marzban dashboard.")
 
         json_body = {
@@ -127,86 +282,165 @@ class MarzClientCache:
             "expire": expire_timestamp,
             "data_limit": DATA_LIMIT_BYTES,
             "data_limit_reset_strategy": DATA_LIMIT_RESET_STRATEGY,
-            "proxies": proxies,
-            "inbounds": inbounds_map,
+            "proxies": template.proxies,
+            "inbounds": template.inbounds,
         }
 
-        self._logger.info(f"Creating Marzban user '{username}' with inbounds: {inbounds_map}")
-        response = await client.post("/api/user", json=json_body)
+        self._logger.info(f"Creating Marzban user '{username}' with inbounds v{template.version}: {template.inbounds}")
+        try:
+            response = await self._send("POST", "/api/user", "write", json=json_body)
+            if response.status_code in (400, 422):
+                # Вероятно, inbounds поменялись с момента кэширования — перечитываем и пробуем ещё раз
+                self._logger.warning(f"Marzban rejected user '{username}' with cached inbounds, refreshing template.")
+                template = await self.templates.refresh(force=True)
+                json_body["proxies"] = template.proxies
+                json_body["inbounds"] = template.inbounds
+                response = await self._send("POST", "/api/user", "write", json=json_body)
+        finally:
+            self.invalidate_user(username)
         if response.status_code != 200:
             self._logger.error(f"Marzban add_user failed: {response.status_code} {response.text}")
             response.raise_for_status()
-        return response.json()
+        user = response.json()
+        await self._notify_user_changed(username, user)
+        return user
+
+    async def _request_user(self, key: str) -> Optional[Dict[str, Any]]:
+        write_gen = self._write_gen
+        response = await self._send("GET", f"/api/user/{key}", "user")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        user = response.json()
+        # Отсутствующих не кэшируем; ответ, обогнанный записью, тоже
+        if write_gen == self._write_gen:
+            self._user_cache[key] = user
+        return user
+
+    async def _fetch_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """GET /api/user/{name}: None если пользователя нет (404), иначе исключение при ошибке."""
+        key = username.lower()
+        return await self._coalesce(("GET", "/api/user", key), lambda: self._request_user(key))
+
+    def invalidate_user(self, username: str):
+        """Удаляет пользователя из read-through кэша (после любой записи)."""
+        key = username.lower()
+        self._write_gen += 1
+        self._user_cache.pop(key, None)
+        # Новые читатели не должны присоединяться к GET, начатому до записи
+        self._inflight.pop(("GET", "/api/user", key), None)
+
+    def add_user_listener(self, listener: Callable[[str, Optional[Dict[str, Any]]], Awaitable[None]]):
+        """Регистрирует listener(username, payload) — вызывается после успешной записи (payload=None при удалении)."""
+        self._user_listeners.append(listener)
+
+    async def _notify_user_changed(self, username: str, payload: Optional[Dict[str, Any]]):
+        for listener in self._user_listeners:
+            try:
+                await listener(username.lower(), payload)
+            except Exception as e:
+                self._logger.error(f"User change listener failed for '{username}': {e}", exc_info=True)
+
+    async def apply_external_change(self, username: str, payload: Optional[Dict[str, Any]]):
+        """
+        Изменение пользователя, пришедшее извне (вебхук Marzban): сбрасывает кэш
+        и уведомляет listeners так же, как после собственной записи.
+        """
+        self.invalidate_user(username)
+        await self._notify_user_changed(username, payload)
+
+    def user_cache_stats(self) -> Dict[str, int]:
+        """Счётчики кэша get_user: попадания, промахи, текущий размер."""
+        return {
+            "hits": self._user_cache_hits,
+            "misses": self._user_cache_misses,
+            "size": len(self._user_cache),
+        }
 
     async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
-        """Получает информацию о пользователе из Marzban."""
-        client = await self.get_http_client()
+        """Получает информацию о пользователе из Marzban (через короткий TTL-кэш)."""
+        key = username.lower()
+        cached = self._user_cache.get(key)
+        if cached is not None:
+            self._user_cache_hits += 1
+            return cached
+        self._user_cache_misses += 1
         try:
-            response = await client.get(f"/api/user/{username.lower()}")
-            if response.status_code == 200:
-                return response.json()
-            # Если юзер не найден, Marzban вернет 404, что будет поймано в except
-            return None
+            return await self._fetch_user(username)
+        except CircuitOpenError:
+            # Пусть вызывающий деградирует сам (например, покажет данные из БД)
+            raise
         except httpx.HTTPStatusError as e:
-            # Логируем только если это не 404 (юзер не найден)
-            if e.response.status_code != 404:
-                self._logger.error(f"Error getting user {username}: {e}", exc_info=True)
+            self._logger.error(f"Error getting user {username}: {e}", exc_info=True)
             return None
         except Exception as e:
             self._logger.error(f"An unexpected error occurred in get_user for {username}: {e}", exc_info=True)
             return None
 
+    @staticmethod
+    def _extended_expire(current_expire_ts: Optional[int], days: int) -> int:
+        """Новая дата истечения: от текущей, если подписка активна, иначе от сегодняшнего дня."""
+        now_ts = int(datetime.now().timestamp())
+        if current_expire_ts and current_expire_ts > now_ts:
+            new_expire_date = datetime.fromtimestamp(current_expire_ts) + timedelta(days=days)
+        else:
+            new_expire_date = datetime.now() + timedelta(days=days)
+        return int(new_expire_date.timestamp())
+
+    async def upsert_user(self, username: str, extend_days: Optional[int] = None,
+                          expire_ts: Optional[int] = None,
+                          current: Optional[Dict[str, Any]] = None) -> tuple[Dict[str, Any], bool]:
+        """
+        Создаёт или продлевает пользователя: не больше одного чтения и одной записи.
+
+        - expire_ts: абсолютная дата истечения (например, посчитанная по нашей БД);
+        - extend_days: продлить на N дней от текущего expire в Marzban;
+        - current: уже полученный payload пользователя — тогда GET не выполняется.
+
+        Возвращает (пользователь из Marzban, создан_ли_новый).
+        """
+        if (extend_days is None) == (expire_ts is None):
+            raise ValueError("upsert_user: pass exactly one of extend_days / expire_ts")
+
+        if current is None:
+            current = await self._fetch_user(username)
+
+        if not current:
+            self._logger.info(f"User '{username}' not found in Marzban. Creating a new user.")
+            created = await self.add_user(username=username, expire_days=extend_days or 0, expire_ts=expire_ts)
+            return created, True
+
+        if expire_ts is None:
+            expire_ts = self._extended_expire(current.get('expire'), extend_days)
+
+        json_body = {
+            "expire": int(expire_ts),
+            "data_limit": DATA_LIMIT_BYTES,
+            "data_limit_reset_strategy": DATA_LIMIT_RESET_STRATEGY,
+        }
+        self._logger.info(f"Updating Marzban user '{username}': expire={json_body['expire']}.")
+        try:
+            response = await self._send("PUT", f"/api/user/{username.lower()}", "write", json=json_body)
+        finally:
+            self.invalidate_user(username)
+        response.raise_for_status()
+        user = response.json()
+        await self._notify_user_changed(username, user)
+        return user, False
+
     async def modify_user(self, username: str, expire_days: int) -> Dict[str, Any]:
         """
         Продлевает подписку существующего пользователя.
         Если пользователь не найден в Marzban - создает его с указанным сроком.
         """
         self._logger.info(f"Modifying/Ensuring subscription for user '{username}' for {expire_days} days.")
-        
-        # 1. Проверяем, существует ли пользователь
-        user_exists = await self.get_user(username)
-        
-        # 2. Сценарий: Пользователь существует -> Продлеваем
-        if user_exists:
-            self._logger.info(f"User '{username}' exists. Extending subscription.")
-            
-            # Получаем текущую дату истечения из словаря
-            current_expire_ts = user_exists.get('expire') or int(datetime.now().timestamp())
-            
-            # Рассчитываем новую дату
-            if current_expire_ts > int(datetime.now().timestamp()):
-                # Если подписка еще активна, добавляем дни к дате окончания
-                new_expire_date = datetime.fromtimestamp(current_expire_ts) + timedelta(days=expire_days)
-            else:
-                # Если подписка истекла, добавляем дни к сегодняшней дате
-                new_expire_date = datetime.now() + timedelta(days=expire_days)
-            
-            # Формируем тело запроса для изменения
-            json_body = {
-                "expire": int(new_expire_date.timestamp()),
-                "data_limit": DATA_LIMIT_BYTES,
-                "data_limit_reset_strategy": DATA_LIMIT_RESET_STRATEGY,
-            }
-            
-            # Отправляем PUT запрос на изменение
-            client = await self.get_http_client()
-            response = await client.put(f"/api/user/{username.lower()}", json=json_body)
-            response.raise_for_status()
-            return response.json()
-
-        # 3. Сценарий: Пользователя нет -> Создаем
-        else:
-            self._logger.warning(f"User '{username}' not found in Marzban. Creating a new user instead.")
-            # Если пользователя нет, мы не можем его "изменить". Вместо этого мы вызываем
-            # наш же метод add_user, чтобы создать его с нужным сроком.
-            # Это избавляет от дублирования кода.
-            return await self.add_user(username=username, expire_days=expire_days)
+        user, _ = await self.upsert_user(username, extend_days=expire_days)
+        return user
 
     async def get_users(self, offset: int = 0, limit: int = 1000) -> Dict[str, Any]:
         """Получает список всех пользователей из Marzban."""
-        client = await self.get_http_client()
         try:
-            response = await client.get("/api/users", params={"offset": offset, "limit": limit})
+            response = await self._send("GET", "/api/users", "users", params={"offset": offset, "limit": limit})
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -215,10 +449,9 @@ class MarzClientCache:
 
     async def set_data_limit(self, username: str, limit_bytes: int = DATA_LIMIT_BYTES) -> bool:
         """Устанавливает лимит трафика для существующего пользователя."""
-        client = await self.get_http_client()
         try:
-            response = await client.put(
-                f"/api/user/{username.lower()}",
+            response = await self._send(
+                "PUT", f"/api/user/{username.lower()}", "write",
                 json={
                     "data_limit": limit_bytes,
                     "data_limit_reset_strategy": DATA_LIMIT_RESET_STRATEGY,
@@ -226,10 +459,80 @@ class MarzClientCache:
             )
             response.raise_for_status()
             self._logger.info(f"Set data_limit={limit_bytes} for user '{username}'.")
+            await self._notify_user_changed(username, response.json())
             return True
         except Exception as e:
             self._logger.error(f"Failed to set data_limit for user '{username}': {e}")
             return False
+        finally:
+            self.invalidate_user(username)
+
+    async def _fetch_users_page(self, offset: int, limit: int) -> list:
+        # Порядок по username: без сортировки Marzban отдаёт строки в порядке, который БД не гарантирует
+        response = await self._send(
+            "GET", "/api/users", "users", params={"offset": offset, "limit": limit, "sort": "username"},
+        )
+        response.raise_for_status()
+        return response.json().get("users", [])
+
+    async def count_users(self) -> int:
+        """Число пользователей в Marzban. В отличие от get_users, ошибки запроса пробрасываются."""
+        response = await self._send("GET", "/api/users", "users", params={"offset": 0, "limit": 1})
+        response.raise_for_status()
+        return int(response.json()["total"])
+
+    async def iter_users(self, page_size: int = 500, offset: int = 0) -> AsyncIterator[MarzbanUserRecord]:
+        """
+        Постранично обходит всех пользователей Marzban в порядке username.
+        Следующая страница запрашивается, пока обрабатывается текущая; в памяти не больше двух страниц.
+        offset позволяет продолжить обход с места остановки. Ошибки запроса пробрасываются.
+        Удаление пользователя во время обхода сдвигает страницы: следующий за ним может быть пропущен.
+        """
+        next_page: Optional[asyncio.Task] = asyncio.create_task(self._fetch_users_page(offset, page_size))
+        try:
+            while next_page is not None:
+                users = await next_page
+                next_page = None
+                if len(users) >= page_size:
+                    next_page = asyncio.create_task(self._fetch_users_page(offset + page_size, page_size))
+                for user in users:
+                    yield MarzbanUserRecord.from_api(user)
+                offset += page_size
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    async def bulk_modify_users(self, items: BulkItems,
+                                progress: Optional[ProgressCallback] = None,
+                                concurrency: Optional[int] = None,
+                                max_concurrency: Optional[int] = None) -> list[BulkItemResult]:
+        """
+        Массовый PUT /api/user/{name} для пар (username, body) с адаптивной параллельностью:
+        лимит растёт, пока Marzban отвечает быстро, и падает вдвое на ошибках/медленных ответах.
+        Открытый circuit breaker приостанавливает задание до пробного запроса, а не проваливает
+        оставшиеся элементы. Возвращает результат по каждому пользователю.
+        """
+        marz_cfg = self._config.marzban
+        limiter = AimdLimiter(
+            initial=concurrency or marz_cfg.bulk_concurrency,
+            maximum=max_concurrency or marz_cfg.bulk_max_concurrency,
+            target_latency=marz_cfg.bulk_target_latency,
+        )
+
+        async def put_user(username: str, body: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                response = await self._send("PUT", f"/api/user/{username.lower()}", "write", json=body)
+            finally:
+                self.invalidate_user(username)
+            response.raise_for_status()
+            user = response.json()
+            await self._notify_user_changed(username, user)
+            return user
+
+        def wait_for_breaker(error: Exception) -> Optional[float]:
+            return error.retry_after if isinstance(error, CircuitOpenError) else None
+
+        return await run_bulk(items, put_user, limiter, progress, backoff=wait_for_breaker)
 
     async def apply_data_limit_to_all(self, limit_bytes: int = DATA_LIMIT_BYTES) -> Dict[str, int]:
         """
@@ -237,38 +540,42 @@ class MarzClientCache:
         Возвращает {'updated': N, 'skipped': M, 'failed': K}.
         """
         result = {"updated": 0, "skipped": 0, "failed": 0}
-        data = await self.get_users(limit=4096)
-        users = data.get("users", [])
-        self._logger.info(f"apply_data_limit_to_all: found {len(users)} users in Marzban.")
-        for user in users:
-            username = user.get("username", "")
-            current_limit = user.get("data_limit") or 0
-            if current_limit == 0:
-                ok = await self.set_data_limit(username, limit_bytes)
-                if ok:
-                    result["updated"] += 1
+        body = {"data_limit": limit_bytes, "data_limit_reset_strategy": DATA_LIMIT_RESET_STRATEGY}
+
+        async def users_without_limit():
+            async for user in self.iter_users():
+                if user.data_limit == 0:
+                    yield user.username, body
                 else:
-                    result["failed"] += 1
+                    result["skipped"] += 1
+
+        for item in await self.bulk_modify_users(users_without_limit()):
+            if item.ok:
+                result["updated"] += 1
             else:
-                result["skipped"] += 1
+                result["failed"] += 1
+                self._logger.error(f"Failed to set data_limit for user '{item.key}': {item.error}")
         self._logger.info(f"apply_data_limit_to_all done: {result}")
         return result
 
     async def delete_user(self, username: str) -> bool:
         """Удаляет пользователя из Marzban."""
-        client = await self.get_http_client()
         try:
-            response = await client.delete(f"/api/user/{username.lower()}")
+            response = await self._send("DELETE", f"/api/user/{username.lower()}", "write")
             response.raise_for_status()
             self._logger.info(f"Successfully deleted user '{username}' from Marzban.")
+            await self._notify_user_changed(username, None)
             return True
         except httpx.HTTPStatusError as e:
             # Если юзер уже удален (404), считаем это успехом
             if e.response.status_code == 404:
                 self._logger.warning(f"Attempted to delete user '{username}', but they were not found (already deleted?).")
+                await self._notify_user_changed(username, None)
                 return True
             self._logger.error(f"Failed to delete user '{username}': {e}", exc_info=True)
             return False
         except Exception as e:
             self._logger.error(f"An unexpected error occurred in delete_user for '{username}': {e}", exc_info=True)
-            return False
\ No newline at end of file
+            return False
+        finally:
+            self.invalidate_user(username)
@@ -0,0 +1,41 @@
+# marzban/records.py — облегчённые записи пользователей Marzban для массовых операций
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True, slots=True)
+class MarzbanUserRecord:
+    """Только поля, нужные массовым задачам (без links, excluded_inbounds и т.п.)."""
+    username: str
+    status: str
+    expire: Optional[int]
+    data_limit: int
+    data_limit_reset_strategy: str
+    used_traffic: int
+    proxies: Tuple[str, ...]
+    subscription_url: str
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> "MarzbanUserRecord":
+        return cls(
+            username=data.get("username", ""),
+            status=data.get("status", ""),
+            expire=data.get("expire") or None,
+            data_limit=data.get("data_limit") or 0,
+            data_limit_reset_strategy=data.get("data_limit_reset_strategy") or "",
+            used_traffic=data.get("used_traffic") or 0,
+            proxies=tuple(sorted((data.get("proxies") or {}).keys())),
+            subscription_url=data.get("subscription_url") or "",
+        )
+
+    def to_mirror_row(self) -> Dict[str, Any]:
+        """Строка для таблицы marzban_users."""
+        return {
+            "username": self.username.lower(),
+            "status": self.status,
+            "expire": self.expire,
+            "used_traffic": self.used_traffic,
+            "data_limit": self.data_limit,
+            "subscription_url": self.subscription_url,
+        }
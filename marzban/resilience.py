@@ -0,0 +1,96 @@
+# marzban/resilience.py — circuit breaker и политика повторов для запросов к Marzban
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Marzban считается недоступным: запрос не отправлялся."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Marzban is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    - closed: запросы идут как обычно, считаем подряд идущие сбои;
+    - open: после failure_threshold сбоев запросы сразу падают с CircuitOpenError;
+    - half_open: через reset_timeout пропускаем один пробный запрос —
+      успех закрывает breaker, сбой снова открывает его.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 15.0, logger=None):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._logger = logger
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_started_at = None
+        return self._state
+
+    @property
+    def is_available(self) -> bool:
+        """False, пока breaker открыт: вызывающий может сразу деградировать, не дожидаясь таймаута."""
+        return self.state != OPEN
+
+    def before_call(self):
+        state = self.state
+        now = time.monotonic()
+        if state == OPEN:
+            raise CircuitOpenError(self._reset_timeout - (now - self._opened_at))
+        if state == HALF_OPEN:
+            # Один пробный запрос; зависший пробник не блокирует breaker дольше reset_timeout
+            if self._probe_started_at is not None and now - self._probe_started_at < self._reset_timeout:
+                raise CircuitOpenError(self._reset_timeout - (now - self._probe_started_at))
+            self._probe_started_at = now
+
+    def record_success(self):
+        if self._state != CLOSED and self._logger:
+            self._logger.info("Marzban circuit breaker closed: panel is responding again.")
+        self._state = CLOSED
+        self._failures = 0
+        self._probe_started_at = None
+
+    def release_probe(self):
+        """Вызов отменён, не дойдя до результата: в half_open пропускаем следующий пробный запрос."""
+        self._probe_started_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == HALF_OPEN or self._failures >= self._failure_threshold:
+            if self._state != OPEN and self._logger:
+                self._logger.warning(
+                    f"Marzban circuit breaker opened after {self._failures} failures "
+                    f"(next probe in {self._reset_timeout:.0f}s)."
+                )
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started_at = None
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self._failures}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Повторы только для идемпотентных запросов, задержка — full jitter."""
+    attempts: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 2.0
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
@@ -0,0 +1,95 @@
+# marzban/templates.py — кэш шаблонов proxies/inbounds для создания пользователей
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ProxyTemplate:
+    """Готовые proxies/inbounds для POST /api/user. version растёт при изменении набора inbounds."""
+    version: int
+    proxies: Dict[str, dict] = field(default_factory=dict)
+    inbounds: Dict[str, list] = field(default_factory=dict)
+    fetched_at: float = 0.0
+
+
+def build_proxies_and_inbounds(inbounds_raw: Dict[str, list]) -> Tuple[Dict[str, dict], Dict[str, list]]:
+    """Строит proxies и inbounds из ответа GET /api/inbounds."""
+    proxies = {}
+    inbounds_map = {}
+    for protocol, items in (inbounds_raw or {}).items():
+        if items:
+            # items может быть списком объектов [{tag, protocol, ...}] или строк
+            tags = [item["tag"] if isinstance(item, dict) else item for item in items]
+            inbounds_map[protocol] = tags
+            proxies[protocol] = {"flow": "xtls-rprx-vision"} if protocol == "vless" else {}
+    return proxies, inbounds_map
+
+
+class InboundTemplateCache:
+    """
+    TTL-кэш шаблона inbounds.
+
+    - свежий шаблон отдаётся без запросов к Marzban;
+    - устаревший отдаётся сразу, а обновление идёт в фоне;
+    - при пустом кэше вызывающий ждёт загрузку (одну на всех конкурентных вызовов).
+    """
+
+    def __init__(self, loader: Callable[[], Awaitable[Dict[str, Any]]], ttl: float, logger):
+        self._loader = loader
+        self._ttl = ttl
+        self._logger = logger
+        self._template: Optional[ProxyTemplate] = None
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _is_fresh(self) -> bool:
+        return self._template is not None and time.monotonic() - self._template.fetched_at < self._ttl
+
+    async def get(self) -> ProxyTemplate:
+        if self._is_fresh():
+            return self._template
+        if self._template is not None:
+            self._schedule_refresh()
+            return self._template
+        return await self.refresh()
+
+    async def refresh(self, force: bool = False) -> ProxyTemplate:
+        """Загружает шаблон из Marzban. Параллельные вызовы ждут одну загрузку."""
+        async with self._lock:
+            if not force and self._is_fresh():
+                return self._template
+            inbounds_raw = await self._loader()
+            proxies, inbounds_map = build_proxies_and_inbounds(inbounds_raw)
+            if self._template is None or (proxies, inbounds_map) != (self._template.proxies, self._template.inbounds):
+                self._version += 1
+                self._logger.info(f"Marzban inbound template v{self._version}: {inbounds_map}")
+            self._template = ProxyTemplate(
+                version=self._version,
+                proxies=proxies,
+                inbounds=inbounds_map,
+                fetched_at=time.monotonic(),
+            )
+            return self._template
+
+    def invalidate(self):
+        """Сбрасывает шаблон: следующий get() загрузит его заново."""
+        self._template = None
+
+    def _schedule_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            # Остаёмся на старом шаблоне, попробуем при следующем обращении
+            self._logger.warning(f"Background refresh of Marzban inbounds failed: {e}")
@@ -4,7 +4,8 @@
  - Обновляет proxies/inbounds до актуальных (из текущей конфигурации Marzban)
 
 Функции:
- - Пагинация: запрашивает пользователей батчами (--batch), не грузит Marzban целиком
+ - Пагинация: обходит пользователей потоком батчами (--batch), список целиком в памяти не держит
+ - Параллельность: PUT-запросы идут конкурентно, без фиксированных пауз
  - Сохранение прогресса: при прерывании продолжает с места остановки
  - Возобновление: повторный запуск автоматически пропускает уже обработанных
 
@@ -12,9 +13,12 @@
     docker exec vpn_bot python3 scripts/migrate_users.py
 
 Параметры:
-    --delay   задержка между PUT запросами (сек, default=0.5)
+    --concurrency      стартовая параллельность PUT запросов (default=4)
+    --max-concurrency  верхняя граница параллельности (default=16); фактическая
+                       подстраивается под задержку и ошибки Marzban (AIMD)
     --batch   размер батча при получении пользователей (default=100)
     --reset   сбросить прогресс и начать заново
+    --offset  начать обход пользователей с указанного смещения
 """
 
 import asyncio
@@ -49,39 +53,12 @@ def save_progress(done: set):
 
 
 async def build_proxies_and_inbounds():
-    """Строит актуальные proxies и inbounds из конфигурации Marzban."""
-    inbounds_raw = await marzban_client.get_inbounds()
-    proxies = {}
-    inbounds_map = {}
-    for protocol, items in inbounds_raw.items():
-        if items:
-            tags = [item["tag"] if isinstance(item, dict) else item for item in items]
-            inbounds_map[protocol] = tags
-            proxies[protocol] = {"flow": "xtls-rprx-vision"} if protocol == "vless" else {}
-    return proxies, inbounds_map
-
-
-async def fetch_all_users(batch_size: int, delay: float) -> list:
-    """Получает всех пользователей постранично, чтобы не перегружать Marzban."""
-    all_users = []
-    offset = 0
-    while True:
-        print(f"  Загрузка пользователей: offset={offset}...", flush=True)
-        data = await marzban_client.get_users(offset=offset, limit=batch_size)
-        users = data.get("users", [])
-        if not users:
-            break
-        all_users.extend(users)
-        total = data.get("total", 0)
-        print(f"  Загружено {len(all_users)}/{total}", flush=True)
-        if len(all_users) >= total:
-            break
-        offset += batch_size
-        await asyncio.sleep(delay)
-    return all_users
-
-
-async def migrate(delay: float, batch_size: int, reset: bool):
+    """Строит актуальные proxies и inbounds из конфигурации Marzban (общий кэш шаблонов)."""
+    template = await marzban_client.templates.refresh(force=True)
+    return template.proxies, template.inbounds
+
+
+async def migrate(concurrency: int, max_concurrency: int, batch_size: int, reset: bool, offset: int = 0):
     if reset and os.path.exists(PROGRESS_FILE):
         os.remove(PROGRESS_FILE)
         print("Прогресс сброшен.")
@@ -90,7 +67,7 @@ async def migrate(delay: float, batch_size: int, reset: bool):
     if done:
         print(f"Найден прогресс: уже обработано {len(done)} пользователей. Продолжаем...")
 
-    print(f"Запуск миграции (задержка={delay}с, батч={batch_size})...")
+    print(f"Запуск миграции (параллельность={concurrency}..{max_concurrency}, батч={batch_size})...")
 
     # Получаем актуальные inbounds один раз
     proxies, inbounds_map = await build_proxies_and_inbounds()
@@ -101,70 +78,69 @@ async def migrate(delay: float, batch_size: int, reset: bool):
     print(f"Протоколы: {list(proxies.keys())}")
     print(f"Inbounds: {inbounds_map}")
 
-    # Загружаем всех пользователей батчами
-    print("Получение списка пользователей...")
-    users = await fetch_all_users(batch_size=batch_size, delay=delay)
-    total = len(users)
-    print(f"Всего пользователей: {total}")
-
-    updated = skipped = failed = already_done = 0
-    client = await marzban_client.get_http_client()
-
-    for i, user in enumerate(users, 1):
-        username = user.get("username", "")
-        if not username:
-            continue
-
-        # Пропускаем уже обработанных (resume после разрыва)
-        if username in done:
-            already_done += 1
-            continue
-
-        current_limit = user.get("data_limit") or 0
-        current_strategy = user.get("data_limit_reset_strategy", "")
-        current_proxies = set(user.get("proxies", {}).keys())
-        target_proxies = set(proxies.keys())
-
-        needs_limit = current_limit == 0 or current_strategy != DATA_LIMIT_RESET_STRATEGY
-        needs_proxies = current_proxies != target_proxies
-
-        if not needs_limit and not needs_proxies:
-            print(f"[{i}/{total}] {username} — пропущен (всё актуально)", flush=True)
-            skipped += 1
-            done.add(username)
-            continue
-
-        body = {}
-        if needs_limit:
-            body["data_limit"] = DATA_LIMIT_BYTES
-            body["data_limit_reset_strategy"] = DATA_LIMIT_RESET_STRATEGY
-        if needs_proxies:
-            body["proxies"] = proxies
-            body["inbounds"] = inbounds_map
+    # Пользователей не грузим целиком: обходим постранично (следующая страница подгружается заранее)
+    total = (await marzban_client.get_users(offset=0, limit=1)).get("total", 0)
+    print(f"Всего пользователей: {total} (начинаем с offset={offset})")
 
-        try:
-            response = await client.put(f"/api/user/{username.lower()}", json=body)
-            response.raise_for_status()
+    counters = {"skipped": 0, "already_done": 0}
+    reasons_by_user: dict[str, str] = {}
+    target_proxies = set(proxies.keys())
+
+    async def users_to_update():
+        async for user in marzban_client.iter_users(page_size=batch_size, offset=offset):
+            username = user.username
+            if not username:
+                continue
+
+            # Пропускаем уже обработанных (resume после разрыва)
+            if username in done:
+                counters["already_done"] += 1
+                continue
+
+            needs_limit = user.data_limit == 0 or user.data_limit_reset_strategy != DATA_LIMIT_RESET_STRATEGY
+            needs_proxies = set(user.proxies) != target_proxies
+
+            if not needs_limit and not needs_proxies:
+                print(f"{username} — пропущен (всё актуально)", flush=True)
+                counters["skipped"] += 1
+                done.add(username)
+                continue
+
+            body = {}
             reasons = []
             if needs_limit:
+                body["data_limit"] = DATA_LIMIT_BYTES
+                body["data_limit_reset_strategy"] = DATA_LIMIT_RESET_STRATEGY
                 reasons.append("лимит")
             if needs_proxies:
+                body["proxies"] = proxies
+                body["inbounds"] = inbounds_map
                 reasons.append("proxies")
-            print(f"[{i}/{total}] {username} — обновлён ({', '.join(reasons)})", flush=True)
-            updated += 1
-            done.add(username)
-        except Exception as e:
-            print(f"[{i}/{total}] {username} — ОШИБКА: {e}", flush=True)
-            failed += 1
-
+            reasons_by_user[username] = ", ".join(reasons)
+            yield username, body
+
+    def on_progress(item, stats):
+        reasons = reasons_by_user.pop(item.key, "")
+        if item.ok:
+            done.add(item.key)
+            print(f"[{stats.done}] {item.key} — обновлён ({reasons}), "
+                  f"{item.latency * 1000:.0f} мс, параллельность={stats.concurrency}", flush=True)
+        else:
+            print(f"[{stats.done}] {item.key} — ОШИБКА: {item.error}", flush=True)
         # Сохраняем прогресс каждые 10 пользователей
-        if len(done) % 10 == 0:
+        if stats.done % 10 == 0:
             save_progress(done)
 
-        await asyncio.sleep(delay)
+    results = await marzban_client.bulk_modify_users(
+        users_to_update(), progress=on_progress,
+        concurrency=concurrency, max_concurrency=max_concurrency,
+    )
+    updated = sum(1 for r in results if r.ok)
+    failed = len(results) - updated
 
     save_progress(done)
-    print(f"\nГотово: обновлено={updated}, пропущено={skipped}, уже было={already_done}, ошибок={failed}")
+    print(f"\nГотово: обновлено={updated}, пропущено={counters['skipped']}, "
+          f"уже было={counters['already_done']}, ошибок={failed}")
 
     # Если всё успешно — удаляем файл прогресса
     if failed == 0 and os.path.exists(PROGRESS_FILE):
@@ -174,9 +150,12 @@ async def migrate(delay: float, batch_size: int, reset: bool):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--delay", type=float, default=0.5, help="Задержка между запросами в секундах")
+    parser.add_argument("--concurrency", type=int, default=4, help="Стартовое число параллельных PUT-запросов")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="Максимум параллельных PUT-запросов")
     parser.add_argument("--batch", type=int, default=100, help="Размер батча при получении пользователей")
     parser.add_argument("--reset", action="store_true", help="Сбросить прогресс и начать заново")
+    parser.add_argument("--offset", type=int, default=0, help="Начать обход пользователей с этого смещения")
     args = parser.parse_args()
 
-    asyncio.run(migrate(delay=args.delay, batch_size=args.batch, reset=args.reset))
+    asyncio.run(migrate(concurrency=args.concurrency, max_concurrency=args.max_concurrency,
+                        batch_size=args.batch, reset=args.reset, offset=args.offset))
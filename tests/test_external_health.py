@@ -0,0 +1,97 @@
+# tests/test_external_health.py — логика ExternalHealthService.probe_all на локальных сокетах
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiogram")
+
+from database.repositories.cache_version import EXTERNAL_LINKS_CACHE  # noqa: E402
+from tgbot.services.external_health_service import ExternalHealthService  # noqa: E402
+
+UUID = "11111111-2222-3333-4444-555555555555"
+
+
+class _ConfigRepo:
+    def __init__(self, configs):
+        self.configs = configs
+        self.updates: list[list[dict]] = []
+
+    async def get_active(self, healthy_only: bool = False, unique: bool = False):
+        return self.configs
+
+    async def update_health(self, rows: list[dict]):
+        self.updates.append(rows)
+
+
+class _VersionRepo:
+    def __init__(self):
+        self.bumped: list[str] = []
+
+    async def bump(self, name: str):
+        self.bumped.append(name)
+
+
+def _config(config_id: int, port: int, **state) -> SimpleNamespace:
+    fields = dict(is_healthy=True, latency_ms=None, availability=1.0, fail_streak=0,
+                  last_error=None, checked_at=None, health_rank=None)
+    fields.update(state)
+    link = f"vless://{UUID}@127.0.0.1:{port}?type=tcp&security=none#S{config_id}"
+    return SimpleNamespace(id=config_id, raw_link=link, **fields)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _close_at_once(reader, writer):
+    writer.close()
+
+
+async def _run(configs, fail_threshold: int = 3):
+    config_repo, version_repo = _ConfigRepo(configs), _VersionRepo()
+    service = ExternalHealthService(config_repo, version_repo, timeout=2, fail_threshold=fail_threshold)
+    return await service.probe_all(), config_repo, version_repo
+
+
+def test_probe_all_ranks_healthy_and_counts_fail_streak():
+    async def scenario():
+        server = await asyncio.start_server(_close_at_once, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        dead = _free_port()
+        async with server:
+            return await _run([
+                _config(3, port),
+                _config(1, port, fail_streak=2, last_error="timeout"),
+                _config(2, dead, fail_streak=2, health_rank=0),
+                _config(4, dead),
+            ])
+
+    summary, config_repo, version_repo = asyncio.run(scenario())
+    rows = {row["id"]: row for row in config_repo.updates[0]}
+
+    # Живые серверы с задержкой в одном интервале — по id; успех сбрасывает серию ошибок
+    assert (rows[1]["health_rank"], rows[3]["health_rank"]) == (0, 1)
+    assert rows[1]["fail_streak"] == 0 and rows[1]["last_error"] is None
+    # Третья ошибка подряд при пороге 3 выключает сервер, первая — ещё нет
+    assert rows[2]["fail_streak"] == 3 and not rows[2]["is_healthy"] and rows[2]["health_rank"] is None
+    assert rows[4]["fail_streak"] == 1 and rows[4]["is_healthy"] and rows[4]["health_rank"] == 2
+    assert rows[4]["last_error"].startswith("ConnectionRefusedError")
+    assert summary == {"checked": 4, "healthy": 3, "failed": 2, "reordered": 1}
+    assert version_repo.bumped == [EXTERNAL_LINKS_CACHE]
+
+
+def test_probe_all_discards_results_when_everything_failed():
+    dead = _free_port()
+    configs = [_config(1, dead, health_rank=0), _config(2, dead, health_rank=1)]
+
+    summary, config_repo, version_repo = asyncio.run(_run(configs, fail_threshold=1))
+
+    # Всё недоступно разом — проблема у бота: ни метрики, ни версия кэша не меняются
+    assert summary is None
+    assert config_repo.updates == []
+    assert version_repo.bumped == []
@@ -0,0 +1,86 @@
+# tests/test_probe.py — проверка доступности серверов (utils/probe.py) на локальных сокетах
+import asyncio
+import shutil
+import socket
+import ssl
+import subprocess
+
+import pytest
+
+from utils.probe import probe_tcp, probe_tls
+
+
+async def _serve(handler, ssl_context: ssl.SSLContext | None = None):
+    server = await asyncio.start_server(handler, "127.0.0.1", 0, ssl=ssl_context)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def _close_at_once(reader, writer):
+    writer.close()
+
+
+async def _hang(reader, writer):
+    # Принимает TCP, но не отвечает на ClientHello — рукопожатие не завершится
+    await asyncio.sleep(5)
+    writer.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server_tls(tmp_path) -> ssl.SSLContext:
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is required to issue a test certificate")
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+def test_tcp_connect_success():
+    async def scenario():
+        server, port = await _serve(_close_at_once)
+        async with server:
+            return await probe_tcp("127.0.0.1", port, timeout=2)
+
+    result = asyncio.run(scenario())
+    assert result.ok and result.error is None
+    assert result.latency_ms is not None and result.latency_ms >= 0
+
+
+def test_tls_handshake_success(server_tls):
+    async def scenario():
+        server, port = await _serve(_close_at_once, server_tls)
+        async with server:
+            # Самоподписанный сертификат и чужой SNI не считаются ошибкой
+            return await probe_tls("127.0.0.1", port, server_name="example.com", timeout=2)
+
+    result = asyncio.run(scenario())
+    assert result.ok, result.error
+
+
+def test_refused_port():
+    result = asyncio.run(probe_tcp("127.0.0.1", _free_port(), timeout=2))
+    assert not result.ok
+    assert result.latency_ms is None
+    assert result.error.startswith("ConnectionRefusedError")
+
+
+def test_tls_handshake_timeout():
+    async def scenario():
+        server, port = await _serve(_hang)
+        async with server:
+            return await probe_tls("127.0.0.1", port, timeout=0.3)
+
+    result = asyncio.run(scenario())
+    assert not result.ok
+    assert result.error == "timeout"
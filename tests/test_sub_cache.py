@@ -0,0 +1,22 @@
+# tests/test_sub_cache.py — валидатор ответов /sub/ (webapp/core/sub_cache.py)
+from webapp.core.sub_cache import etag_matches, make_etag
+
+BODY = "dmxlc3M6Ly9hQGg6MSNPbmU="
+
+
+def _userinfo(expire: int, download: int = 0) -> dict[str, str]:
+    return {"subscription-userinfo": f"upload=0; download={download}; total=0; expire={expire}"}
+
+
+def test_etag_changes_with_userinfo_only():
+    # Продление или расход трафика при тех же ссылках: 304 оставил бы у nginx старый subscription-userinfo
+    before = make_etag(BODY, 3, "announce", "v2ray", _userinfo(1700000000))
+    assert make_etag(BODY, 3, "announce", "v2ray", _userinfo(1800000000)) != before
+    assert make_etag(BODY, 3, "announce", "v2ray", _userinfo(1700000000, download=1024)) != before
+
+
+def test_etag_stable_for_same_response():
+    headers = {**_userinfo(1700000000), "profile-update-interval": "12"}
+    etag = make_etag(BODY, 3, "announce", "v2ray", headers)
+    assert make_etag(BODY, 3, "announce", "v2ray", dict(reversed(list(headers.items())))) == etag
+    assert etag_matches(f'W/{etag}, "other"', etag)
@@ -0,0 +1,52 @@
+# tests/test_sub_feed.py — разбор подписок провайдеров (utils/sub_feed.py)
+import base64
+
+from utils.sub_feed import FORMAT_BASE64, FORMAT_PLAIN, SubscriptionStreamParser, parse_feed
+
+LINKS = ["vless://a@h:1#One", "trojan://p@h2:443#Two"]
+
+
+def _stream(data: bytes, chunk_size: int) -> list[dict]:
+    parser = SubscriptionStreamParser()
+    links = []
+    for i in range(0, len(data), chunk_size):
+        links += parser.feed(data[i:i + chunk_size])
+    return links + parser.close()
+
+
+def test_plain_feed_with_title_line():
+    # Первая строка из символов алфавита base64 не делает тело base64, если дальше идут ссылки
+    parser = SubscriptionStreamParser()
+    links = parser.feed(b"Servers\n" + "\n".join(LINKS).encode()) + parser.close()
+    assert parser.format == FORMAT_PLAIN
+    assert [item["raw_link"] for item in links] == LINKS
+    assert [item["name"] for item in parse_feed("Servers\n" + "\n".join(LINKS) + "\n")] == ["One", "Two"]
+
+
+def test_base64_feed_any_chunking():
+    body = base64.b64encode("\n".join(LINKS * 50).encode())
+    wrapped = b"\n".join(body[i:i + 76] for i in range(0, len(body), 76))
+    for chunk_size in (1, 3, 7, 64, len(wrapped)):
+        assert [item["raw_link"] for item in _stream(wrapped, chunk_size)] == LINKS * 50
+
+
+def test_urlsafe_base64_with_junk_bytes():
+    body = base64.urlsafe_b64encode("\n".join(LINKS).encode())
+    parser = SubscriptionStreamParser()
+    # Посторонние байты во второй строке не сдвигают выравнивание base64
+    links = parser.feed(body[:10] + b"\r\n*\x00" + body[10:]) + parser.close()
+    assert parser.format == FORMAT_BASE64
+    assert [item["raw_link"] for item in links] == LINKS
+    assert parser.decode_errors == 0
+
+
+def test_undecodable_block_does_not_splice_links():
+    parser = SubscriptionStreamParser()
+    parser.format = FORMAT_BASE64
+    first = base64.b64encode(b"vless://a@h:1#One\nvless://cut")
+    parser.feed(first)
+    # Блок с паддингом в середине не декодируется: хвост "vless://cut" не должен склеиться со следующим
+    parser.feed(b"QQ=A")
+    rest = parser.feed(base64.b64encode(b"@h:2#Bad\ntrojan://p@h2:443#Two\n")) + parser.close()
+    assert parser.decode_errors == 1
+    assert [item["raw_link"] for item in rest] == ["trojan://p@h2:443#Two"]
@@ -234,7 +234,8 @@ async def ext_vpn_save(call: CallbackQuery, state: FSMContext):
         return
 
     chosen = [servers[i] for i in selected]
-    sub, count = await external_vpn_service.save_configs(url=url, name=name, selected=chosen)
+    sub, count = await external_vpn_service.save_configs(url=url, name=name, selected=chosen,
+                                                          all_servers=servers)
 
     await state.clear()
     await call.message.edit_text(
@@ -63,7 +63,9 @@ async def admin_stats_handler(call: CallbackQuery):
         f"└ Всего: <b>{stats['revenue_total']['revenue']:.2f} RUB</b> ({stats['revenue_total']['count']})",
         "",
         "<b>Серверы Marzban (v0.8.4):</b>",
-        f"└ 🖥️ Онлайн на основном сервере: <b>{host_online}</b>\n", # Показываем онлайн хоста
+        f"├ 🖥️ Онлайн на основном сервере: <b>{host_online}</b>", # Показываем онлайн хоста
+        f"└ 🗄 Кэш пользователей: <b>{stats['marzban_cache']['hits']}</b> попаданий / "
+        f"<b>{stats['marzban_cache']['misses']}</b> промахов\n",
         "<b>Подключенные узлы (Nodes):</b>",
     ]
 
@@ -104,3 +106,61 @@ async def admin_stats_handler(call: CallbackQuery):
             # Если это другая ошибка BadRequest, логируем ее
             logger.error(f"Error editing stats message: {e}")
             await call.answer("Произошла ошибка при обновлении.", show_alert=True)
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+
+@admin_main_router.callback_query(F.data == "admin_sub_analytics")
+async def admin_sub_analytics_handler(call: CallbackQuery):
+    """Кто и как часто забирает подписки (почасовые агрегаты subscription_fetch_hourly)."""
+    await call.answer()
+    data = await admin_stats_service.get_subscription_analytics(24)
+    summary = data["summary"]
+
+    text_parts = [
+        "📡 <b>Запросы подписок за 24 часа</b>\n",
+        f"├ Запросов: <b>{summary['fetches']}</b>",
+        f"├ Пользователей: <b>{summary['users']}</b>",
+        f"├ Ошибок/429: <b>{summary['errors']}</b>",
+        f"├ Из кэша nginx: <b>{summary['cache_hits']}</b>",
+        f"└ Отдано: <b>{_format_bytes(summary['bytes'])}</b>",
+        "",
+        "<b>Приложения:</b>",
+    ]
+    clients = data["top_clients"]
+    if clients:
+        for i, (app, fetches) in enumerate(clients):
+            prefix = "└" if i == len(clients) - 1 else "├"
+            text_parts.append(f"{prefix} {app}: <b>{fetches}</b>")
+    else:
+        text_parts.append("└ Нет данных (агрегаты пересчитываются раз в 15 минут)")
+
+    versions = data["top_versions"]
+    if versions:
+        text_parts += ["", "<b>Популярные версии (польз.):</b>"]
+        for i, (app, version, users) in enumerate(versions):
+            prefix = "└" if i == len(versions) - 1 else "├"
+            text_parts.append(f"{prefix} {app} {version}: <b>{users}</b>")
+
+    hourly = data["hourly"]
+    if hourly:
+        text_parts += ["", "<b>По часам (запросы / ошибки / мс):</b>"]
+        for hour, fetches, errors, latency in hourly:
+            text_parts.append(f"<code>{hour:%d.%m %H:00}</code> — {fetches} / {errors} / {latency:.0f}")
+
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🔄 Обновить", callback_data="admin_sub_analytics")
+    kb.button(text="⬅️ Назад", callback_data="admin_main_menu")
+    kb.adjust(1)
+
+    try:
+        await call.message.edit_text("\n".join(text_parts), reply_markup=kb.as_markup())
+    except TelegramBadRequest as e:
+        if "message is not modified" not in e.message:
+            logger.error(f"Error editing subscription analytics message: {e}")
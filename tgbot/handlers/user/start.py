@@ -34,7 +34,18 @@ async def _show_main_menu(target: Message | CallbackQuery, user_id: int, full_na
 
     profile_data = await profile_service.get_profile(user_id)
 
-    if profile_data.error or not profile_data.marzban_user:
+    if profile_data.degraded:
+        # Marzban недоступен: показываем срок из нашей БД вместо «нет подписки»
+        end_date = user.subscription_end_date if user else None
+        has_active_sub = bool(end_date and end_date > datetime.now())
+        date_str = end_date.strftime('%d.%m.%Y') if end_date else "—"
+        text = (
+            f"👋 Добро пожаловать, <b>{full_name}</b>!\n\n"
+            f"📋 <b>Ваша подписка:</b>\n"
+            f"📅 Активна до: {date_str}\n\n"
+            "⚠️ Сервер временно недоступен, актуальный статус и трафик покажем чуть позже."
+        )
+    elif profile_data.error or not profile_data.marzban_user:
         text = (
             f"👋 Добро пожаловать, <b>{full_name}</b>!\n\n"
             "📋 У вас пока нет активной подписки.\n"
@@ -1,14 +1,17 @@
 # tgbot/handlers/webhook_handlers.py
 
+import hmac
 from datetime import datetime
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey
 from aiohttp import web
 from aiogram import Bot, Dispatcher
 
-from tgbot.services import payment_service
+from tgbot.services import payment_service, marzban_event_service
 from tgbot.services.payment import parse_webhook_notification
 from database import user_repo
+from db import render_pool_metrics
+from db_pool import metrics_authorized
 from loader import logger, config
 from tgbot.handlers.user.profile import show_profile_logic
 
@@ -200,3 +203,45 @@ async def yookassa_webhook_handler(request: web.Request):
     except Exception as e:
         logger.error(f"FATAL Webhook Error: {e}", exc_info=True)
         return web.Response(status=500)
+
+
+async def marzban_webhook_handler(request: web.Request):
+    """
+    Уведомления Marzban о пользователях (WEBHOOK_ADDRESS в .env.marzban).
+    Тело — JSON-массив событий {action, username, user, enqueued_at, ...}.
+    """
+    secret = config.marzban.webhook_secret
+    if not secret:
+        return web.Response(status=404)
+    if not hmac.compare_digest(request.headers.get("x-webhook-secret", ""), secret):
+        logger.warning("Marzban webhook: invalid secret")
+        return web.Response(status=403)
+
+    try:
+        events = await request.json()
+    except Exception:
+        return web.Response(status=400)
+    if isinstance(events, dict):
+        events = [events]
+    if not isinstance(events, list):
+        return web.Response(status=400)
+
+    try:
+        result = await marzban_event_service.handle_batch(events, request.app['bot'])
+        logger.info(f"Marzban webhook: {result}")
+        return web.Response(status=200)
+    except Exception as e:
+        # 5xx — Marzban повторит доставку, уже обработанные события будут пропущены
+        logger.error(f"Marzban Webhook Error: {e}", exc_info=True)
+        return web.Response(status=500)
+
+
+async def metrics_handler(request: web.Request):
+    """Метрики пула соединений с БД процесса бота (Prometheus)."""
+    token = config.dataBase.metrics_token
+    if not token:
+        return web.Response(status=404)
+    if not metrics_authorized(request.headers.get("Authorization"), token):
+        return web.Response(status=403)
+    return web.Response(text=render_pool_metrics(), content_type="text/plain")
+
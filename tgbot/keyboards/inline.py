@@ -147,6 +147,7 @@ def admin_main_menu_keyboard() -> InlineKeyboardMarkup:
     """Главное меню админ-панели."""
     builder = InlineKeyboardBuilder()
     builder.button(text="📈 Статистика", callback_data="admin_stats")
+    builder.button(text="📡 Запросы подписок", callback_data="admin_sub_analytics")
     builder.button(text="👤 Управление пользователями", callback_data="admin_users_menu")
     builder.button(text="📢 Управление каналами", callback_data="admin_channels_menu")
     builder.button(text="💳 Управление тарифами", callback_data="admin_tariffs_menu")
@@ -409,7 +410,15 @@ def ext_vpn_configs_keyboard(configs, sub_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for cfg in configs:
         icon = "✅" if cfg.is_active else "❌"
-        builder.button(text=f"{icon} {cfg.name[:35]}", callback_data=f"ext_vpn_cfg_toggle_{cfg.id}")
+        if cfg.missing_since:
+            health = " · ⛔"
+        elif not cfg.is_healthy:
+            health = " · 💀"
+        elif cfg.latency_ms is not None:
+            health = f" · {int(cfg.latency_ms)}мс"
+        else:
+            health = ""
+        builder.button(text=f"{icon} {cfg.name[:30]}{health}", callback_data=f"ext_vpn_cfg_toggle_{cfg.id}")
     builder.button(text="⬅️ Назад", callback_data=f"ext_vpn_sub_{sub_id}")
     builder.adjust(1)
     return builder.as_markup()
\ No newline at end of file
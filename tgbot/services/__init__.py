@@ -1,5 +1,9 @@
-from database import user_repo, tariff_repo, promo_repo, channel_repo, stats_repo, payment_repo, external_sub_repo, external_config_repo
-from loader import marzban_client
+from database import (
+    user_repo, tariff_repo, promo_repo, channel_repo, stats_repo, payment_repo,
+    external_sub_repo, external_config_repo, marzban_mirror_repo, cache_version_repo,
+    sub_analytics_repo,
+)
+from loader import config, marzban_client
 
 from .subscription_service import SubscriptionService
 from .referral_service import ReferralService
@@ -10,13 +14,30 @@ from .admin_stats_service import AdminStatsService
 from .payment_service import PaymentService
 from .support_service import SupportService
 from .external_vpn_service import ExternalVpnService
+from .marzban_sync_service import MarzbanSyncService
+from .marzban_event_service import MarzbanEventService
+from .external_health_service import ExternalHealthService
 
 subscription_service = SubscriptionService(user_repo, marzban_client)
 referral_service = ReferralService(user_repo, subscription_service)
 promo_service = PromoCodeService(promo_repo, user_repo)
 user_service = UserService(user_repo, stats_repo)
-profile_service = ProfileService(user_repo, marzban_client)
-admin_stats_service = AdminStatsService(stats_repo, marzban_client, payment_repo)
+marzban_sync_service = MarzbanSyncService(marzban_mirror_repo, marzban_client)
+marzban_client.add_user_listener(marzban_sync_service.on_user_changed)
+marzban_event_service = MarzbanEventService(user_repo, tariff_repo, marzban_client)
+profile_service = ProfileService(user_repo, marzban_client, marzban_mirror_repo, config.marzban.mirror_max_age)
+admin_stats_service = AdminStatsService(stats_repo, marzban_client, payment_repo, sub_analytics_repo)
 payment_service = PaymentService(subscription_service, referral_service, user_repo, tariff_repo, payment_repo)
 support_service = SupportService(user_repo)
-external_vpn_service = ExternalVpnService(external_sub_repo, external_config_repo)
+external_vpn_service = ExternalVpnService(
+    external_sub_repo, external_config_repo, cache_version_repo,
+    refresh_concurrency=config.external_vpn.refresh_concurrency,
+    refresh_timeout=config.external_vpn.refresh_timeout,
+    refresh_activate_new=config.external_vpn.refresh_activate_new,
+)
+external_health_service = ExternalHealthService(
+    external_config_repo, cache_version_repo,
+    timeout=config.external_vpn.probe_timeout,
+    concurrency=config.external_vpn.probe_concurrency,
+    fail_threshold=config.external_vpn.probe_fail_threshold,
+)
@@ -1,14 +1,16 @@
 from database.repositories.stats import StatsRepository
 from database.repositories.payment import PaymentRepository
+from database.repositories.sub_analytics import SubscriptionAnalyticsRepository
 from marzban.init_client import MarzClientCache
 
 
 class AdminStatsService:
     def __init__(self, stats_repo: StatsRepository, marzban: MarzClientCache,
-                 payment_repo: PaymentRepository):
+                 payment_repo: PaymentRepository, sub_analytics_repo: SubscriptionAnalyticsRepository):
         self._stats_repo = stats_repo
         self._marzban = marzban
         self._payment_repo = payment_repo
+        self._sub_analytics_repo = sub_analytics_repo
 
     async def get_dashboard_stats(self) -> dict:
         """Агрегирует статистику из БД и Marzban для админ-панели."""
@@ -21,9 +23,19 @@ class AdminStatsService:
             "users_month": await self._stats_repo.count_new_users_for_period(30),
             "system_stats": await self._marzban.get_system_stats(),
             "nodes": await self._marzban.get_nodes(),
+            "marzban_cache": self._marzban.user_cache_stats(),
             # Revenue stats
             "revenue_today": await self._payment_repo.get_revenue_stats(1),
             "revenue_week": await self._payment_repo.get_revenue_stats(7),
             "revenue_month": await self._payment_repo.get_revenue_stats(30),
             "revenue_total": await self._payment_repo.get_total_revenue(),
         }
+
+    async def get_subscription_analytics(self, hours: int = 24) -> dict:
+        """Запросы /sub/ за последние hours часов: итоги, клиенты, версии, почасовая динамика."""
+        return {
+            "summary": await self._sub_analytics_repo.get_summary(hours),
+            "top_clients": await self._sub_analytics_repo.get_top_clients(hours),
+            "top_versions": await self._sub_analytics_repo.get_top_versions(hours),
+            "hourly": await self._sub_analytics_repo.get_hourly(12),
+        }
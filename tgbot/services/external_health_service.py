@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime
+from typing import Dict
+
+from database.repositories.external_vpn import ExternalConfigRepository
+from database.repositories.cache_version import CacheVersionRepository, EXTERNAL_LINKS_CACHE
+from db import ExternalConfig
+from utils.probe import ProbeResult, probe_node
+from utils.vpn_links import parse_link
+from loader import logger
+
+# Вес последней проверки в скользящих средних задержки и доступности
+_EWMA_ALPHA = 0.3
+# Задержки внутри одного интервала (мс) считаются равными — порядок не скачет от шума
+_LATENCY_BUCKET_MS = 50
+
+
+def _ewma(old: float | None, new: float) -> float:
+    if old is None:
+        return new
+    return round(old * (1 - _EWMA_ALPHA) + new * _EWMA_ALPHA, 2)
+
+
+class ExternalHealthService:
+    """Периодически проверяет внешние серверы и раскладывает их по доступности и задержке."""
+
+    def __init__(
+        self,
+        config_repo: ExternalConfigRepository,
+        version_repo: CacheVersionRepository,
+        timeout: float = 5.0,
+        concurrency: int = 20,
+        fail_threshold: int = 3,
+    ):
+        self._config_repo = config_repo
+        self._version_repo = version_repo
+        self._timeout = timeout
+        self._concurrency = max(concurrency, 1)
+        self._fail_threshold = max(fail_threshold, 1)
+        self._lock = asyncio.Lock()
+
+    async def _probe(self, config: ExternalConfig, semaphore: asyncio.Semaphore) -> ProbeResult | None:
+        node = parse_link(config.raw_link)
+        if node is None:
+            return ProbeResult(ok=False, error="unparsable link")
+        async with semaphore:
+            return await probe_node(node, self._timeout)
+
+    async def probe_all(self) -> Dict[str, int] | None:
+        """
+        Проверяет все активные конфиги, обновляет скользящие метрики и порядок выдачи.
+        Версию кэша ссылок увеличивает, только если изменился набор доступных серверов или их порядок.
+        """
+        if self._lock.locked():
+            return None
+        async with self._lock:
+            configs = await self._config_repo.get_active()
+            if not configs:
+                return None
+            semaphore = asyncio.Semaphore(self._concurrency)
+            results = await asyncio.gather(*(self._probe(c, semaphore) for c in configs))
+
+            probed = [r for r in results if r is not None]
+            if len(probed) > 1 and not any(r.ok for r in probed):
+                # Недоступно всё сразу — скорее проблема сети у бота, чем у серверов
+                logger.warning(f"External probe: all {len(probed)} servers failed, results discarded")
+                return None
+
+            now = datetime.now()
+            rows = []
+            for config, result in zip(configs, results):
+                row = {
+                    "id": config.id,
+                    "is_healthy": config.is_healthy,
+                    "latency_ms": config.latency_ms,
+                    "availability": config.availability,
+                    "fail_streak": config.fail_streak,
+                    "last_error": config.last_error,
+                    "checked_at": config.checked_at,
+                }
+                if result is not None:
+                    row["availability"] = _ewma(config.availability, 1.0 if result.ok else 0.0)
+                    row["checked_at"] = now
+                    if result.ok:
+                        row["latency_ms"] = _ewma(config.latency_ms, result.latency_ms)
+                        row["fail_streak"] = 0
+                        row["last_error"] = None
+                    else:
+                        row["fail_streak"] = (config.fail_streak or 0) + 1
+                        row["last_error"] = result.error
+                    row["is_healthy"] = row["fail_streak"] < self._fail_threshold
+                rows.append(row)
+
+            self._assign_ranks(rows)
+            changed = any(
+                row["is_healthy"] != config.is_healthy or row["health_rank"] != config.health_rank
+                for config, row in zip(configs, rows)
+            )
+            await self._config_repo.update_health(rows)
+            if changed:
+                await self._version_repo.bump(EXTERNAL_LINKS_CACHE)
+
+        result = {
+            "checked": len(probed),
+            "healthy": sum(1 for row in rows if row["is_healthy"]),
+            "failed": sum(1 for r in probed if not r.ok),
+            "reordered": int(changed),
+        }
+        logger.info(f"External probe done: {result}")
+        return result
+
+    @staticmethod
+    def _assign_ranks(rows: list[dict]):
+        """Доступные — по задержке (непроверенные UDP-серверы в конце), недоступные без ранга."""
+        healthy = [row for row in rows if row["is_healthy"]]
+        healthy.sort(key=lambda row: (
+            row["latency_ms"] is None,
+            int(row["latency_ms"] // _LATENCY_BUCKET_MS) if row["latency_ms"] is not None else 0,
+            row["id"],
+        ))
+        for row in rows:
+            row["health_rank"] = None
+        for rank, row in enumerate(healthy):
+            row["health_rank"] = rank
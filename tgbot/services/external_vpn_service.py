@@ -1,13 +1,19 @@
-import base64
+import asyncio
+import hashlib
 import uuid
-from urllib.parse import unquote
+from datetime import datetime
 
 import httpx
 
 from database.repositories.external_vpn import ExternalSubscriptionRepository, ExternalConfigRepository
+from database.repositories.cache_version import CacheVersionRepository, EXTERNAL_LINKS_CACHE
 from db import ExternalConfig, ExternalSubscription
+from utils.sub_feed import iter_feed_links, parse_feed
+from utils.vpn_links import link_identity
+from loader import logger
 
-VALID_PREFIXES = ("vless://", "vmess://", "trojan://", "ss://", "hysteria2://", "hy2://", "tuic://")
+# Больше серверов из одного источника не читаем — остаток ответа не скачивается
+_MAX_FEED_LINKS = 20_000
 
 # Фиксированный HWID для запросов к внешним подпискам (имитация устройства)
 _HWID = str(uuid.uuid5(uuid.NAMESPACE_DNS, "vpn-bot-fetcher"))
@@ -22,38 +28,9 @@ _FETCH_HEADERS = {
 }
 
 
-def _extract_links(text: str) -> list[dict]:
-    """Извлекает VPN-ссылки из текста (по одной на строку)."""
-    links = []
-    for line in text.splitlines():
-        line = line.strip()
-        if any(line.startswith(p) for p in VALID_PREFIXES):
-            if "#" in line:
-                raw_link, fragment = line.rsplit("#", 1)
-                name = unquote(fragment).strip() or raw_link[:40]
-            else:
-                raw_link = line
-                name = line[:40]
-            links.append({"name": name, "raw_link": line})
-    return links
-
-
 def parse_subscription(content: str) -> list[dict]:
-    """
-    Парсит V2Ray/Xray subscription: base64-строка или plain-текст → список {name, raw_link}.
-    Сначала пробует plain-текст, потом base64 decode.
-    """
-    # Сначала проверяем plain-текст (прямая вставка конфигов)
-    links = _extract_links(content)
-    if links:
-        return links
-
-    # Пробуем base64 decode (стандартный формат подписки)
-    try:
-        decoded = base64.b64decode(content + "==").decode("utf-8", errors="ignore")
-        return _extract_links(decoded)
-    except Exception:
-        return []
+    """V2Ray/Xray subscription (base64 или plain-текст) → список {name, raw_link}."""
+    return parse_feed(content, _MAX_FEED_LINKS)
 
 
 def parse_raw_configs(text: str) -> list[dict]:
@@ -64,33 +41,177 @@ def parse_raw_configs(text: str) -> list[dict]:
     return parse_subscription(text)
 
 
+async def _read_feed(response: httpx.Response) -> tuple[list[dict], str]:
+    """Разбирает тело ответа по мере загрузки; возвращает (ссылки, sha256 прочитанного тела)."""
+    digest = hashlib.sha256()
+
+    async def chunks():
+        async for chunk in response.aiter_bytes():
+            digest.update(chunk)
+            yield chunk
+
+    links = [item async for item in iter_feed_links(chunks(), _MAX_FEED_LINKS)]
+    return links, digest.hexdigest()
+
+
+def diff_configs(stored: list[ExternalConfig], fetched: list[dict], now: datetime,
+                 activate_new: bool = True) -> tuple[list[dict], list[dict]]:
+    """
+    Сверяет свежий список серверов с сохранёнными по link_identity (название в ключ не входит).
+    Возвращает (inserts, updates): новые серверы; переименованные, пропавшие и вернувшиеся.
+    Решение админа (is_active) не трогаем — пропавшие только помечаются missing_since.
+    """
+    fresh: dict[str, dict] = {}
+    for item in fetched:
+        fresh.setdefault(link_identity(item["raw_link"]), item)
+
+    updates = []
+    known = set()
+    for config in stored:
+        key = config.identity_key or link_identity(config.raw_link)
+        if key in known:
+            continue
+        known.add(key)
+        item = fresh.get(key)
+        if item is None:
+            if config.missing_since is None:
+                updates.append({"id": config.id, "name": config.name, "raw_link": config.raw_link,
+                                "missing_since": now})
+        elif item["raw_link"] != config.raw_link or item["name"] != config.name or config.missing_since:
+            updates.append({"id": config.id, "name": item["name"], "raw_link": item["raw_link"],
+                            "missing_since": None})
+
+    inserts = [
+        {"name": item["name"], "raw_link": item["raw_link"], "is_active": activate_new}
+        for key, item in fresh.items() if key not in known
+    ]
+    return inserts, updates
+
+
 class ExternalVpnService:
     def __init__(
         self,
         sub_repo: ExternalSubscriptionRepository,
         config_repo: ExternalConfigRepository,
+        version_repo: CacheVersionRepository,
+        refresh_concurrency: int = 5,
+        refresh_timeout: float = 15.0,
+        refresh_activate_new: bool = True,
     ):
         self._sub_repo = sub_repo
         self._config_repo = config_repo
+        self._version_repo = version_repo
+        self._refresh_concurrency = max(refresh_concurrency, 1)
+        self._refresh_timeout = refresh_timeout
+        self._refresh_activate_new = refresh_activate_new
+        self._refresh_lock = asyncio.Lock()
+
+    async def _bump_links_version(self):
+        """Сообщает прокси /sub/, что набор активных внешних ссылок изменился."""
+        await self._version_repo.bump(EXTERNAL_LINKS_CACHE)
 
     async def fetch_and_parse(self, url: str) -> list[dict]:
         """Загружает URL подписки и возвращает список серверов [{name, raw_link}]."""
         async with httpx.AsyncClient(
             timeout=15, follow_redirects=True, verify=False
         ) as client:
-            response = await client.get(url, headers=_FETCH_HEADERS)
-            response.raise_for_status()
-        return parse_subscription(response.text)
+            async with client.stream("GET", url, headers=_FETCH_HEADERS) as response:
+                response.raise_for_status()
+                links, _ = await _read_feed(response)
+        return links
 
-    async def save_configs(self, url: str, name: str, selected: list[dict]) -> tuple[ExternalSubscription, int]:
-        """Создаёт ExternalSubscription и сохраняет выбранные конфиги."""
+    async def save_configs(self, url: str, name: str, selected: list[dict],
+                           all_servers: list[dict] | None = None) -> tuple[ExternalSubscription, int]:
+        """
+        Создаёт ExternalSubscription и сохраняет выбранные конфиги.
+        Невыбранные из all_servers сохраняются выключенными — иначе обновление подписки
+        сочтёт их новыми серверами.
+        """
         sub = await self._sub_repo.create(name=name, url=url)
-        count = await self._config_repo.create_many(sub.id, selected)
-        return sub, count
+        chosen = {c["raw_link"] for c in selected}
+        configs = [{**c, "is_active": True} for c in selected]
+        configs += [{**c, "is_active": False} for c in all_servers or [] if c["raw_link"] not in chosen]
+        await self._config_repo.create_many(sub.id, configs)
+        await self._bump_links_version()
+        return sub, len(selected)
+
+    async def refresh_all(self) -> dict[str, int] | None:
+        """
+        Перечитывает все источники с URL параллельно условными GET (ETag / Last-Modified).
+        Неизменившаяся подписка стоит одного 304 и не пишет в БД.
+        """
+        if self._refresh_lock.locked():
+            return None
+        async with self._refresh_lock:
+            subs = await self._sub_repo.get_refreshable()
+            if not subs:
+                return None
+            semaphore = asyncio.Semaphore(self._refresh_concurrency)
+
+            async def refresh_one(client: httpx.AsyncClient, sub: ExternalSubscription) -> dict | None:
+                async with semaphore:
+                    try:
+                        return await self._refresh_subscription(client, sub)
+                    except Exception as e:
+                        logger.warning(f"External subscription {sub.id} refresh failed: {e}")
+                        await self._sub_repo.update_feed_state(sub.id, last_error=str(e)[:200])
+                        return None
+
+            async with httpx.AsyncClient(
+                timeout=self._refresh_timeout, follow_redirects=True, verify=False
+            ) as client:
+                results = await asyncio.gather(*(refresh_one(client, sub) for sub in subs))
+
+        changed = [r for r in results if r]
+        total = {"sources": len(subs), "changed": len(changed)}
+        for key in ("inserted", "updated"):
+            total[key] = sum(r[key] for r in changed)
+        if changed:
+            await self._bump_links_version()
+        logger.info(f"External subscriptions refresh done: {total}")
+        return total
+
+    async def _refresh_subscription(self, client: httpx.AsyncClient, sub: ExternalSubscription) -> dict | None:
+        """Возвращает {'inserted', 'updated'}, если набор серверов источника изменился, иначе None."""
+        headers = dict(_FETCH_HEADERS)
+        if sub.etag:
+            headers["If-None-Match"] = sub.etag
+        if sub.last_modified:
+            headers["If-Modified-Since"] = sub.last_modified
+        async with client.stream("GET", sub.url, headers=headers) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            fetched, content_hash = await _read_feed(response)
+
+        now = datetime.now()
+        feed_state = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "content_hash": content_hash,
+            "last_fetched_at": now,
+            "last_error": None,
+        }
+        if content_hash == sub.content_hash:
+            # Сервер не поддерживает условные запросы, но тело то же — пишем только новые валидаторы
+            if (feed_state["etag"], feed_state["last_modified"]) != (sub.etag, sub.last_modified) or sub.last_error:
+                await self._sub_repo.update_feed_state(sub.id, **feed_state)
+            return None
+
+        if not fetched:
+            # Пустой ответ провайдера не повод скрывать все его серверы
+            raise ValueError("no VPN links in response")
+
+        stored = await self._config_repo.get_by_subscription(sub.id)
+        inserts, updates = diff_configs(stored, fetched, now, self._refresh_activate_new)
+        inserted = await self._config_repo.apply_refresh(sub.id, inserts, updates, feed_state)
+        if not inserted and not updates:
+            return None
+        return {"inserted": inserted, "updated": len(updates)}
 
     async def get_active_links(self) -> list[str]:
         """Возвращает список raw_link для всех активных внешних конфигов."""
-        configs: list[ExternalConfig] = await self._config_repo.get_active()
+        configs: list[ExternalConfig] = await self._config_repo.get_active(unique=True)
         return [c.raw_link for c in configs]
 
     async def get_all_subscriptions(self) -> list[ExternalSubscription]:
@@ -101,10 +222,14 @@ class ExternalVpnService:
 
     async def toggle_config(self, config_id: int) -> tuple[bool, int | None]:
         """Возвращает (новое_значение_is_active, subscription_id)."""
-        return await self._config_repo.toggle_active(config_id)
+        result = await self._config_repo.toggle_active(config_id)
+        await self._bump_links_version()
+        return result
 
     async def delete_config(self, config_id: int):
         await self._config_repo.delete(config_id)
+        await self._bump_links_version()
 
     async def delete_subscription(self, sub_id: int):
         await self._sub_repo.delete(sub_id)
+        await self._bump_links_version()
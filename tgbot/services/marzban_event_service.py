@@ -0,0 +1,93 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable
+
+from aiogram import Bot
+from cachetools import TTLCache
+
+from database.repositories.user import UserRepository
+from database.repositories.tariff import TariffRepository
+from marzban.init_client import MarzClientCache
+from tgbot.keyboards.inline import tariffs_keyboard
+from loader import logger
+
+# События Marzban, после которых пользователь теряет доступ
+_LOST_ACCESS_TEXTS = {
+    "user_limited": (
+        "⚠️ Вы израсходовали лимит трафика, доступ к VPN приостановлен.\n\n"
+        "Продлите подписку, чтобы восстановить доступ."
+    ),
+    "user_expired": (
+        "⏰ Ваша подписка истекла, доступ к VPN приостановлен.\n\n"
+        "Продлите подписку, чтобы продолжить пользоваться сервисом."
+    ),
+}
+
+
+class MarzbanEventService:
+    """Обрабатывает уведомления вебхука Marzban (user_created, user_updated, user_limited, ...)."""
+
+    def __init__(self, user_repo: UserRepository, tariff_repo: TariffRepository, marzban: MarzClientCache):
+        self._user_repo = user_repo
+        self._tariff_repo = tariff_repo
+        self._marzban = marzban
+        # Marzban повторяет доставку при ошибках — одно и то же событие не обрабатываем дважды
+        self._seen: TTLCache = TTLCache(maxsize=10000, ttl=3600)
+
+    async def handle_batch(self, events: Iterable[Dict[str, Any]], bot: Bot) -> Dict[str, int]:
+        """Применяет пачку событий по порядку. Возвращает {'processed', 'skipped'}."""
+        processed = skipped = 0
+        for event in events:
+            username = (event.get("username") or "").lower()
+            action = event.get("action")
+            if not username or not action:
+                skipped += 1
+                continue
+            event_key = (username, action, event.get("enqueued_at"))
+            if event_key in self._seen:
+                skipped += 1
+                continue
+            self._seen[event_key] = True
+            try:
+                await self._handle(username, action, event.get("user"), bot)
+                processed += 1
+            except Exception as e:
+                # Снимаем отметку, чтобы повторная доставка обработала событие
+                self._seen.pop(event_key, None)
+                logger.error(f"Failed to handle Marzban event {action} for {username}: {e}", exc_info=True)
+                raise
+        return {"processed": processed, "skipped": skipped}
+
+    async def _handle(self, username: str, action: str, payload: Dict[str, Any] | None, bot: Bot):
+        if action == "user_deleted":
+            await self._marzban.apply_external_change(username, None)
+            return
+        if payload:
+            await self._marzban.apply_external_change(username, payload)
+        else:
+            self._marzban.invalidate_user(username)
+
+        user = await self._user_repo.get_by_marzban_username(username)
+        if not user:
+            return
+
+        expire = (payload or {}).get("expire")
+        if expire:
+            end_date = datetime.fromtimestamp(expire)
+            if user.subscription_end_date != end_date:
+                await self._user_repo.set_subscription_end_date(user.user_id, end_date)
+
+        text = _LOST_ACCESS_TEXTS.get(action)
+        if text and user.user_id > 0:
+            await self._notify(bot, user.user_id, text)
+
+    async def _notify(self, bot: Bot, user_id: int, text: str):
+        try:
+            active_tariffs = await self._tariff_repo.get_active()
+            tariffs_list = list(active_tariffs) if active_tariffs else []
+            await bot.send_message(
+                chat_id=user_id,
+                text=text,
+                reply_markup=tariffs_keyboard(tariffs_list) if tariffs_list else None
+            )
+        except Exception as e:
+            logger.warning(f"Failed to notify user {user_id} about Marzban event: {e}")
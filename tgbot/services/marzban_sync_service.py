@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from database.repositories.marzban_mirror import MarzbanMirrorRepository
+from marzban.init_client import MarzClientCache
+from marzban.records import MarzbanUserRecord
+from loader import logger
+
+
+class MarzbanSyncService:
+    """Поддерживает таблицу marzban_users в актуальном состоянии."""
+
+    def __init__(self, mirror_repo: MarzbanMirrorRepository, marzban: MarzClientCache, page_size: int = 500):
+        self._mirror_repo = mirror_repo
+        self._marzban = marzban
+        self._page_size = page_size
+        self._lock = asyncio.Lock()
+
+    async def sync(self) -> Dict[str, int] | None:
+        """
+        Полная сверка с Marzban: обходит /api/users постранично и записывает только изменившиеся строки.
+        Строки удаляются, только если число пользователей не менялось за время обхода и все они
+        были увидены: иначе страницы могли сдвинуться, и «пропавший» пользователь на самом деле есть.
+        Возвращает {'seen', 'changed', 'deleted'} или None, если синхронизация уже идёт или панель недоступна.
+        """
+        if self._lock.locked():
+            return None
+        if not self._marzban.is_available:
+            logger.info("Marzban mirror sync skipped: panel is unavailable.")
+            return None
+
+        async with self._lock:
+            started_at = datetime.now()
+            seen: list[str] = []
+            changed = 0
+            batch: list[dict] = []
+            try:
+                total_before = await self._marzban.count_users()
+                async for record in self._marzban.iter_users(page_size=self._page_size):
+                    if not record.username:
+                        continue
+                    row = record.to_mirror_row()
+                    seen.append(row["username"])
+                    batch.append(row)
+                    if len(batch) >= self._page_size:
+                        changed += await self._mirror_repo.upsert_many(batch)
+                        batch = []
+                changed += await self._mirror_repo.upsert_many(batch)
+                total_after = await self._marzban.count_users()
+            except Exception as e:
+                logger.error(f"Marzban mirror sync failed after {len(seen)} users: {e}", exc_info=True)
+                return None
+
+            # Удаляем только по итогам полного обхода, в котором страницы не сдвигались
+            deleted = 0
+            if total_before == total_after == len(set(seen)):
+                deleted = await self._mirror_repo.delete_missing(seen)
+            else:
+                logger.info(
+                    f"Marzban mirror sync: users changed during scan "
+                    f"(total {total_before} -> {total_after}, seen {len(set(seen))}), deletion skipped."
+                )
+            await self._mirror_repo.mark_synced(started_at, len(seen))
+
+        result = {"seen": len(seen), "changed": changed, "deleted": deleted}
+        logger.info(f"Marzban mirror sync done: {result}")
+        return result
+
+    async def on_user_changed(self, username: str, payload: Optional[Dict[str, Any]]):
+        """Listener MarzClientCache: сразу отражает запись в зеркале, не дожидаясь синхронизации."""
+        if payload is None:
+            await self._mirror_repo.delete(username)
+        else:
+            await self._mirror_repo.upsert_many([MarzbanUserRecord.from_api(payload).to_mirror_row()])
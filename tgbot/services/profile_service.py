@@ -1,26 +1,73 @@
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
-from db import User
+from db import User, MarzbanUser
 from database.repositories.user import UserRepository
+from database.repositories.marzban_mirror import MarzbanMirrorRepository
 from marzban.init_client import MarzClientCache
+from marzban.resilience import CircuitOpenError
 from loader import logger
 
+_UNAVAILABLE_ERROR = (
+    "Сервер временно недоступен, данные о подписке не получены. "
+    "Попробуйте через минуту — доступ к VPN при этом сохраняется."
+)
+
 
 @dataclass
 class ProfileData:
     db_user: User | None
     marzban_user: Dict[str, Any] | None
     error: str | None = None
+    # True, если Marzban недоступен (circuit breaker открыт) и данные не запрашивались
+    degraded: bool = False
+    # True, если marzban_user взят из локального зеркала marzban_users
+    from_mirror: bool = False
+
+
+def _mirror_to_marzban_user(row: MarzbanUser) -> Dict[str, Any]:
+    """Строка зеркала в формате ответа Marzban (поля, которые используют хендлеры)."""
+    return {
+        "username": row.username,
+        "status": row.status,
+        "expire": row.expire,
+        "used_traffic": row.used_traffic,
+        "data_limit": row.data_limit,
+        "subscription_url": row.subscription_url or "",
+    }
 
 
 class ProfileService:
-    def __init__(self, user_repo: UserRepository, marzban: MarzClientCache):
+    def __init__(self, user_repo: UserRepository, marzban: MarzClientCache,
+                 mirror_repo: MarzbanMirrorRepository | None = None, mirror_max_age: int = 0):
         self._user_repo = user_repo
         self._marzban = marzban
+        self._mirror_repo = mirror_repo
+        self._mirror_max_age = mirror_max_age
 
-    async def get_profile(self, user_id: int) -> ProfileData:
-        """Возвращает данные профиля без побочных эффектов."""
+    async def _from_mirror(self, username: str, fresh_only: bool) -> Dict[str, Any] | None:
+        if not self._mirror_repo:
+            return None
+        try:
+            if fresh_only:
+                if self._mirror_max_age <= 0:
+                    return None
+                not_older_than = datetime.now() - timedelta(seconds=self._mirror_max_age)
+                row = await self._mirror_repo.get_if_fresh(username, not_older_than)
+            else:
+                row = await self._mirror_repo.get(username)
+        except Exception as e:
+            logger.error(f"Failed to read Marzban mirror for {username}: {e}", exc_info=True)
+            return None
+        return _mirror_to_marzban_user(row) if row else None
+
+    async def get_profile(self, user_id: int, allow_mirror: bool = True) -> ProfileData:
+        """
+        Возвращает данные профиля без побочных эффектов.
+        allow_mirror: брать статус из зеркала marzban_users, если оно не старше mirror_max_age.
+        Если Marzban недоступен, отдаём зеркало любой давности.
+        """
         user = await self._user_repo.get(user_id)
 
         if not user or not user.marzban_username:
@@ -29,6 +76,14 @@ class ProfileService:
                 error="У вас еще нет активной подписки. Пожалуйста, оплатите тариф, чтобы получить доступ."
             )
 
+        if allow_mirror:
+            mirrored = await self._from_mirror(user.marzban_username, fresh_only=True)
+            if mirrored:
+                return ProfileData(db_user=user, marzban_user=mirrored, from_mirror=True)
+
+        if not self._marzban.is_available:
+            return await self._degraded(user)
+
         try:
             marzban_user = await self._marzban.get_user(user.marzban_username)
             if not marzban_user:
@@ -37,9 +92,18 @@ class ProfileService:
                     error="Не удалось получить данные о вашей подписке. Пожалуйста, обратитесь в поддержку."
                 )
             return ProfileData(db_user=user, marzban_user=marzban_user)
+        except CircuitOpenError:
+            return await self._degraded(user)
         except Exception as e:
             logger.error(f"Failed to get user {user.marzban_username} from Marzban: {e}", exc_info=True)
             return ProfileData(
                 db_user=user, marzban_user=None,
                 error="Не удалось получить данные о вашей подписке. Пожалуйста, обратитесь в поддержку."
             )
+
+    async def _degraded(self, user: User) -> ProfileData:
+        """Marzban недоступен: отдаём последнее известное состояние из зеркала, если оно есть."""
+        mirrored = await self._from_mirror(user.marzban_username, fresh_only=False)
+        if mirrored:
+            return ProfileData(db_user=user, marzban_user=mirrored, from_mirror=True)
+        return ProfileData(db_user=user, marzban_user=None, error=_UNAVAILABLE_ERROR, degraded=True)
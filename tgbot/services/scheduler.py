@@ -4,11 +4,11 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot
 from datetime import datetime, timedelta
 
-from database import user_repo, tariff_repo
+from database import user_repo, tariff_repo, sub_analytics_repo
 from tgbot.keyboards.inline import tariffs_keyboard
 from utils import broadcaster
 from .utils import decline_word
-from loader import logger, config
+from loader import logger, config, marzban_client
 
 # --- 1. Основная функция, которую будет вызывать планировщик ---
 
@@ -77,6 +77,14 @@ async def check_subscriptions(bot: Bot):
         await broadcaster.broadcast(bot, config.tg_bot.admin_ids, "✅ Рассылка завершена. Сообщение доставлено {count} пользователям.")
 
 
+async def rollup_subscription_analytics():
+    """Пересчитывает почасовые агрегаты запросов /sub/ и чистит старые сырые события."""
+    now = datetime.now()
+    rows = await sub_analytics_repo.rollup(since=now - timedelta(hours=2))
+    purged = await sub_analytics_repo.purge_raw(now - timedelta(days=config.sub_proxy.analytics_retention_days))
+    logger.info(f"Subscription analytics rollup: {rows} hourly rows, {purged} raw events purged")
+
+
 # --- 3. Функция для добавления всех задач в планировщик ---
 
 def schedule_jobs(scheduler: AsyncIOScheduler, bot: Bot):
@@ -93,4 +101,55 @@ def schedule_jobs(scheduler: AsyncIOScheduler, bot: Bot):
         kwargs={'bot': bot}
     )
 
+    # Фоновое обновление шаблона inbounds Marzban (создание юзеров не ждёт /api/inbounds)
+    scheduler.add_job(
+        marzban_client.refresh_templates,
+        trigger='interval',
+        seconds=max(config.marzban.inbounds_ttl // 2, 30),
+    )
+
+    # Сверка зеркала marzban_users с Marzban
+    if config.marzban.mirror_sync_interval > 0:
+        from tgbot.services import marzban_sync_service
+        scheduler.add_job(
+            marzban_sync_service.sync,
+            trigger='interval',
+            seconds=config.marzban.mirror_sync_interval,
+            next_run_time=datetime.now(),
+            max_instances=1,
+            coalesce=True,
+        )
+
+    # Почасовые агрегаты аналитики /sub/ (последние 2 часа пересчитываются, поэтому хватает запуска раз в 15 минут)
+    scheduler.add_job(
+        rollup_subscription_analytics,
+        trigger='interval',
+        minutes=15,
+        max_instances=1,
+        coalesce=True,
+    )
+
+    # Обновление внешних подписок: провайдеры меняют серверы, сохранённые ссылки устаревают
+    if config.external_vpn.refresh_interval > 0:
+        from tgbot.services import external_vpn_service
+        scheduler.add_job(
+            external_vpn_service.refresh_all,
+            trigger='interval',
+            seconds=config.external_vpn.refresh_interval,
+            max_instances=1,
+            coalesce=True,
+        )
+
+    # Проверка доступности внешних серверов: порядок и состав ссылок в /sub/
+    if config.external_vpn.probe_interval > 0:
+        from tgbot.services import external_health_service
+        scheduler.add_job(
+            external_health_service.probe_all,
+            trigger='interval',
+            seconds=config.external_vpn.probe_interval,
+            next_run_time=datetime.now() + timedelta(seconds=30),
+            max_instances=1,
+            coalesce=True,
+        )
+
     logger.info("Scheduler jobs added.")
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 
 from database.repositories.user import UserRepository
 from marzban.init_client import MarzClientCache
@@ -25,12 +26,18 @@ class SubscriptionService:
             raise ValueError(f"User {user_id} not found in DB")
 
         marzban_username = self._resolve_marzban_username(user)
-        is_new = await self._ensure_marzban_user(marzban_username, days)
+
+        # Новая дата окончания считается по нашей БД и уходит в Marzban абсолютным expire:
+        # один GET + один PUT/POST вместо get → get → put
+        now = datetime.now()
+        current_end = user.subscription_end_date
+        new_end = (current_end if current_end and current_end > now else now) + timedelta(days=days)
+        _, is_new = await self._marzban.upsert_user(marzban_username, expire_ts=int(new_end.timestamp()))
 
         if not user.marzban_username:
             await self._user_repo.update_marzban_username(user_id, marzban_username)
 
-        await self._user_repo.extend_subscription(user_id, days)
+        await self._user_repo.set_subscription_end_date(user_id, new_end)
 
         logger.info(f"Subscription for user {user_id} extended by {days} days (marzban: {marzban_username}, new={is_new})")
         return ExtensionResult(is_new_marzban_user=is_new, marzban_username=marzban_username)
@@ -47,13 +54,3 @@ class SubscriptionService:
         if user.user_id > 0:
             return f"user_{user.user_id}"
         return f"web_{abs(user.user_id)}"
-
-    async def _ensure_marzban_user(self, username: str, days: int) -> bool:
-        """Создает или продлевает пользователя в Marzban. Возвращает True если создан новый."""
-        existing = await self._marzban.get_user(username)
-        if existing:
-            await self._marzban.modify_user(username=username, expire_days=days)
-            return False
-        else:
-            await self._marzban.add_user(username=username, expire_days=days)
-            return True
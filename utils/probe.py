@@ -0,0 +1,77 @@
+# utils/probe.py — проверка доступности VPN-сервера: TCP-подключение или TLS-рукопожатие
+
+import asyncio
+import ssl
+import time
+from dataclasses import dataclass
+
+from utils.vpn_links import VpnNode
+
+# UDP-протоколы: TCP-проверка для них ничего не говорит о доступности
+_UDP_PROTOCOLS = ("hysteria2", "tuic")
+
+
+@dataclass(slots=True)
+class ProbeResult:
+    ok: bool
+    # Время до установленного соединения / завершённого рукопожатия (мс)
+    latency_ms: float | None = None
+    error: str | None = None
+
+
+def _tls_context() -> ssl.SSLContext:
+    # Проверяем только, что сервер отвечает TLS: самоподписанные сертификаты и reality — норма
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+_TLS_CONTEXT = _tls_context()
+
+
+async def _connect(host: str, port: int, timeout: float, server_name: str | None = None,
+                   use_tls: bool = False) -> ProbeResult:
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port,
+                ssl=_TLS_CONTEXT if use_tls else None,
+                server_hostname=(server_name or host) if use_tls else None,
+            ),
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        return ProbeResult(ok=False, error="timeout")
+    except (OSError, ssl.SSLError) as e:
+        return ProbeResult(ok=False, error=f"{type(e).__name__}: {e}"[:200])
+    latency = (time.perf_counter() - started) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+    return ProbeResult(ok=True, latency_ms=round(latency, 2))
+
+
+async def probe_tcp(host: str, port: int, timeout: float = 5.0) -> ProbeResult:
+    return await _connect(host, port, timeout)
+
+
+async def probe_tls(host: str, port: int, server_name: str | None = None, timeout: float = 5.0) -> ProbeResult:
+    return await _connect(host, port, timeout, server_name=server_name, use_tls=True)
+
+
+def uses_tls(node: VpnNode) -> bool:
+    security = node.params.get("security")
+    return security in ("tls", "reality") or (node.protocol == "trojan" and not security)
+
+
+async def probe_node(node: VpnNode, timeout: float = 5.0) -> ProbeResult | None:
+    """TLS-рукопожатие для tls/reality, иначе TCP-подключение. None — протокол не проверяется (UDP)."""
+    if node.protocol in _UDP_PROTOCOLS:
+        return None
+    if uses_tls(node):
+        return await probe_tls(node.server, node.port, node.params.get("sni"), timeout)
+    return await probe_tcp(node.server, node.port, timeout)
@@ -0,0 +1,165 @@
+# utils/sub_feed.py — потоковый разбор подписки провайдера (plain-текст или base64) на ссылки
+
+import base64
+import binascii
+import logging
+from typing import AsyncIterable, AsyncIterator
+from urllib.parse import unquote
+
+from utils.vpn_links import VPN_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+_B64_ALPHABET = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=-_")
+# url-safe base64 → стандартный алфавит; всё вне алфавита (пробелы, мусор) выбрасывается до декодирования,
+# иначе сдвигается выравнивание по 4 символа
+_URLSAFE_TO_STD = bytes.maketrans(b"-_", b"+/")
+_NOT_B64 = bytes(b for b in range(256) if b not in _B64_ALPHABET)
+_WHITESPACE = b" \t\r\n"
+_VPN_PREFIXES = tuple(prefix.encode() for prefix in VPN_PREFIXES)
+# По скольким первым байтам определяется формат
+_FORMAT_PROBE = 4096
+# Строки длиннее — не ссылки (мусор или HTML); не копим их в памяти
+_MAX_LINE = 64 * 1024
+
+FORMAT_PLAIN = "plain"
+FORMAT_BASE64 = "base64"
+
+
+def _link_item(raw_link: str) -> dict:
+    """{name, raw_link}; name — из #fragment, иначе начало ссылки."""
+    raw, sep, fragment = raw_link.rpartition("#")
+    name = unquote(fragment).strip() if sep else ""
+    return {"name": name or (raw if sep else raw_link)[:40], "raw_link": raw_link}
+
+
+class SubscriptionStreamParser:
+    """
+    Разбирает тело подписки по мере поступления кусков.
+    Формат определяется один раз по первым _FORMAT_PROBE байтам; base64 декодируется блоками
+    по 4 символа, поэтому в памяти держится только незавершённая строка и хвост base64, а не всё тело.
+    """
+
+    def __init__(self, max_links: int | None = None):
+        self.format: str | None = None
+        self.count = 0
+        # Блоки base64, которые не удалось декодировать (их ссылки потеряны)
+        self.decode_errors = 0
+        self._max_links = max_links
+        self._head = bytearray()
+        self._b64 = bytearray()
+        self._line = bytearray()
+        self._skip_line = False
+
+    def feed(self, chunk: bytes) -> list[dict]:
+        if self.format is None:
+            self._head += chunk
+            self.format = self._detect(final=False)
+            if self.format is None:
+                return []
+            chunk, self._head = bytes(self._head), bytearray()
+        return self._dispatch(chunk)
+
+    def close(self) -> list[dict]:
+        """Досчитывает хвост после последнего куска."""
+        links = []
+        if self.format is None:
+            self.format = self._detect(final=True)
+            chunk, self._head = bytes(self._head), bytearray()
+            links += self._dispatch(chunk)
+        if self._b64:
+            tail, self._b64 = bytes(self._b64), bytearray()
+            links += self._lines(self._b64decode(tail + b"=" * (-len(tail) % 4)))
+        if self._line and not self._skip_line:
+            item = self._emit(bytes(self._line))
+            if item:
+                links.append(item)
+        self._line = bytearray()
+        return links
+
+    @property
+    def exhausted(self) -> bool:
+        return self._max_links is not None and self.count >= self._max_links
+
+    def _detect(self, final: bool) -> str | None:
+        text = self._head.lstrip(b"\xef\xbb\xbf" + _WHITESPACE)
+        if len(text) < _FORMAT_PROBE and not final:
+            return None
+        lines = [line.strip() for line in text[:_FORMAT_PROBE].split(b"\n")]
+        # Ссылка в любой из первых строк — plain, даже если первая строка похожа на base64 (заголовок "Servers")
+        if any(line.startswith(_VPN_PREFIXES) for line in lines):
+            return FORMAT_PLAIN
+        first = lines[0]
+        # Комментарии (#profile-title) и прочий текст содержат символы вне алфавита base64
+        if not first or b"://" in first or not set(first) <= _B64_ALPHABET:
+            return FORMAT_PLAIN
+        return FORMAT_BASE64
+
+    def _dispatch(self, chunk: bytes) -> list[dict]:
+        if self.format == FORMAT_PLAIN:
+            return self._lines(chunk)
+        self._b64 += chunk.translate(_URLSAFE_TO_STD, _NOT_B64)
+        ready = len(self._b64) // 4 * 4
+        if not ready:
+            return []
+        block = bytes(self._b64[:ready])
+        del self._b64[:ready]
+        return self._lines(self._b64decode(block))
+
+    def _b64decode(self, block: bytes) -> bytes:
+        try:
+            return base64.b64decode(block, validate=False)
+        except binascii.Error as e:
+            self.decode_errors += 1
+            logger.warning(f"Subscription feed: undecodable base64 block of {len(block)} bytes skipped: {e}")
+            # Начало строки до пропуска склеилось бы с чужим хвостом после него — отбрасываем обе части
+            self._line = bytearray()
+            self._skip_line = True
+            return b""
+
+    def _lines(self, data: bytes) -> list[dict]:
+        self._line += data
+        if b"\n" not in data:
+            if len(self._line) > _MAX_LINE:
+                self._line = bytearray()
+                self._skip_line = True
+            return []
+        *lines, rest = self._line.split(b"\n")
+        self._line = bytearray(rest)
+        links = []
+        for line in lines:
+            if self._skip_line:
+                self._skip_line = False
+                continue
+            item = self._emit(line)
+            if item:
+                links.append(item)
+        return links
+
+    def _emit(self, line: bytes) -> dict | None:
+        if self.exhausted:
+            return None
+        text = line.decode("utf-8", errors="ignore").strip()
+        if not text.startswith(VPN_PREFIXES):
+            return None
+        self.count += 1
+        return _link_item(text)
+
+
+def parse_feed(content: str | bytes, max_links: int | None = None) -> list[dict]:
+    """Разбор тела целиком (вставленный админом текст) тем же парсером."""
+    parser = SubscriptionStreamParser(max_links)
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    return parser.feed(data) + parser.close()
+
+
+async def iter_feed_links(chunks: AsyncIterable[bytes], max_links: int | None = None) -> AsyncIterator[dict]:
+    """Ссылки из потока кусков ответа (httpx Response.aiter_bytes())."""
+    parser = SubscriptionStreamParser(max_links)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.exhausted:
+            return
+    for item in parser.close():
+        yield item
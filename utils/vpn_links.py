@@ -0,0 +1,171 @@
+# utils/vpn_links.py — разбор VPN-ссылок (vless/vmess/trojan/ss/hysteria2/tuic) в структуру
+
+import base64
+import binascii
+import hashlib
+import json
+from dataclasses import dataclass, field
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+VPN_PREFIXES = ("vless://", "vmess://", "trojan://", "ss://", "hysteria2://", "hy2://", "tuic://")
+
+
+@dataclass(slots=True)
+class VpnNode:
+    """Один сервер из ссылки. params — query-параметры ссылки (type, security, sni, pbk, path, ...)."""
+    protocol: str
+    name: str
+    server: str
+    port: int
+    # uuid (vless/vmess/tuic) или пароль (trojan/ss/hysteria2)
+    credential: str
+    raw: str
+    password: str = ""
+    method: str = ""
+    params: dict[str, str] = field(default_factory=dict)
+
+
+def _b64decode(value: str) -> str:
+    value = value.strip().replace("-", "+").replace("_", "/")
+    return base64.b64decode(value + "=" * (-len(value) % 4)).decode("utf-8")
+
+
+def decode_subscription(content: str) -> list[str]:
+    """Декодирует подписку в список ссылок.
+
+    Сначала проверяет plain-text (b64decode молча декодирует любую строку без исключения),
+    затем пробует base64.
+    """
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    if any(line.startswith(VPN_PREFIXES) for line in lines):
+        return lines
+    try:
+        decoded = base64.b64decode(content + "==").decode("utf-8", errors="ignore")
+        return [line.strip() for line in decoded.splitlines() if line.strip()]
+    except Exception:
+        return lines
+
+
+def _parse_vmess(link: str) -> VpnNode | None:
+    data = json.loads(_b64decode(link[len("vmess://"):]))
+    params = {
+        "type": data.get("net") or "tcp",
+        "security": "tls" if data.get("tls") in ("tls", "reality") else "none",
+        "sni": data.get("sni") or "",
+        "host": data.get("host") or "",
+        "path": data.get("path") or "",
+        "fp": data.get("fp") or "",
+        "alpn": data.get("alpn") or "",
+        "headerType": data.get("type") or "",
+    }
+    return VpnNode(
+        protocol="vmess",
+        name=data.get("ps") or data.get("add", ""),
+        server=data.get("add", ""),
+        port=int(data.get("port") or 0),
+        credential=data.get("id", ""),
+        raw=link,
+        method=data.get("scy") or "auto",
+        params={k: v for k, v in params.items() if v},
+    )
+
+
+def _parse_ss(link: str) -> VpnNode | None:
+    body, _, fragment = link[len("ss://"):].partition("#")
+    body = body.split("?", 1)[0]
+    if "@" in body:
+        # SIP002: ss://base64(method:password)@host:port
+        userinfo, _, hostport = body.rpartition("@")
+        userinfo = unquote(userinfo)
+        if ":" not in userinfo:
+            userinfo = _b64decode(userinfo)
+    else:
+        # Старый формат: ss://base64(method:password@host:port)
+        userinfo, _, hostport = _b64decode(body).rpartition("@")
+    method, _, password = userinfo.partition(":")
+    host, _, port = hostport.rpartition(":")
+    return VpnNode(
+        protocol="ss",
+        name=unquote(fragment) or host,
+        server=host.strip("[]"),
+        port=int(port),
+        credential=password,
+        raw=link,
+        password=password,
+        method=method,
+    )
+
+
+def _parse_url(link: str) -> VpnNode | None:
+    parts = urlsplit(link)
+    protocol = "hysteria2" if parts.scheme == "hy2" else parts.scheme
+    credential = unquote(parts.username or "")
+    password = unquote(parts.password or "")
+    if protocol in ("trojan", "hysteria2"):
+        # trojan://password@host, hysteria2://password@host
+        password = credential
+    if not parts.hostname or not parts.port:
+        return None
+    return VpnNode(
+        protocol=protocol,
+        name=unquote(parts.fragment) or parts.hostname,
+        server=parts.hostname,
+        port=parts.port,
+        credential=credential,
+        raw=link,
+        password=password,
+        params=dict(parse_qsl(parts.query)),
+    )
+
+
+def parse_link(link: str) -> VpnNode | None:
+    """Разбирает одну ссылку; None — если протокол неизвестен или ссылка битая."""
+    link = link.strip()
+    try:
+        if link.startswith("vmess://"):
+            return _parse_vmess(link)
+        if link.startswith("ss://"):
+            return _parse_ss(link)
+        if link.startswith(VPN_PREFIXES):
+            return _parse_url(link)
+    except (ValueError, KeyError, UnicodeDecodeError, binascii.Error, json.JSONDecodeError):
+        return None
+    return None
+
+
+def parse_links(links: list[str]) -> list[VpnNode]:
+    return [node for node in (parse_link(link) for link in links) if node is not None]
+
+
+
+# Параметры ссылки, от которых зависит, к какому серверу и как подключится клиент
+_IDENTITY_PARAMS = (
+    "type", "security", "sni", "host", "path", "serviceName", "mode", "headerType",
+    "pbk", "sid", "spx", "flow", "obfs", "obfs-password",
+)
+# Значения по умолчанию: ссылка с type=tcp и без type — один и тот же сервер
+_IDENTITY_DEFAULTS = {"type": "tcp", "security": "none", "headerType": "none"}
+
+
+def link_identity(link: str) -> str:
+    """
+    Канонический ключ ссылки (sha1, 40 символов): протокол, адрес, порт, uuid/пароль и
+    параметры транспорта. Название (#fragment), порядок параметров и клиентские настройки
+    (fp, alpn) на ключ не влияют. Битые ссылки сравниваются по тексту без названия.
+    Ключи хранятся в external_configs.identity_key: изменение алгоритма — только вместе
+    с миграцией, которая их пересчитает (у 0001 своя замороженная копия).
+    """
+    node = parse_link(link)
+    if node is None:
+        canonical = link.strip().split("#", 1)[0]
+    else:
+        params = []
+        for key in _IDENTITY_PARAMS:
+            value = node.params.get(key, "")
+            if key in ("sni", "host"):
+                value = value.lower()
+            if value and value != _IDENTITY_DEFAULTS.get(key):
+                params.append(f"{key}={value}")
+        canonical = "|".join((node.protocol, node.server.lower(), str(node.port),
+                              node.method, node.credential, node.password, *params))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
@@ -0,0 +1,140 @@
+# webapp/core/compression.py
+"""
+Сжатие ответов: выбор gzip/br по Accept-Encoding и ASGI-мидлварь для обычных страниц.
+
+Brotli используется, только если установлен пакет brotli. Ответы, у которых уже есть
+Content-Encoding (например, заранее сжатые тела из кэша /sub/), мидлварь не трогает.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # опциональная зависимость
+    brotli = None
+
+ENCODING_BR = "br"
+ENCODING_GZIP = "gzip"
+
+_COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/xml", "image/svg+xml",
+)
+
+
+def available_encodings() -> tuple[str, ...]:
+    """Поддерживаемые кодировки в порядке предпочтения."""
+    return (ENCODING_BR, ENCODING_GZIP) if brotli else (ENCODING_GZIP,)
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """Лучшая из поддерживаемых кодировок по заголовку Accept-Encoding (с учётом q=0)."""
+    if not accept_encoding:
+        return None
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == ENCODING_BR:
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def compress_all(data: bytes, min_size: int, gzip_level: int = 6, brotli_quality: int = 5) -> dict[str, bytes]:
+    """Все поддерживаемые варианты тела (для кэша); маленькие тела не сжимаем."""
+    if len(data) < min_size:
+        return {}
+    return {encoding: compress(data, encoding, gzip_level, brotli_quality) for encoding in available_encodings()}
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith(_COMPRESSIBLE_TYPES)
+
+
+def _merge_vary(headers: list[tuple[bytes, bytes]]) -> list[tuple[bytes, bytes]]:
+    vary = [v.decode("latin-1") for k, v in headers if k == b"vary"]
+    values = [part.strip() for v in vary for part in v.split(",") if part.strip()]
+    if "accept-encoding" not in (v.lower() for v in values):
+        values.append("Accept-Encoding")
+    headers = [(k, v) for k, v in headers if k != b"vary"]
+    headers.append((b"vary", ", ".join(values).encode("latin-1")))
+    return headers
+
+
+class CompressionMiddleware:
+    """
+    Сжимает небуферизованные целиком ответы (одно тело без more_body) текстовых типов.
+    Потоковые ответы и ответы с Content-Encoding пропускаются как есть.
+    """
+
+    def __init__(self, app, min_size: int = 500, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), None)
+        encoding = negotiate_encoding(accept)
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = list(start_message.get("headers", []))
+            header_map = {k: v for k, v in headers}
+            content_type = header_map.get(b"content-type", b"").decode("latin-1")
+            eligible = (
+                not message.get("more_body", False)
+                and b"content-encoding" not in header_map
+                and len(body) >= self.min_size
+                and _is_compressible(content_type)
+            )
+            if not eligible:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            headers = [(k, v) for k, v in headers if k != b"content-length"]
+            headers.append((b"content-encoding", encoding.encode("ascii")))
+            headers.append((b"content-length", str(len(compressed)).encode("ascii")))
+            start_message["headers"] = _merge_vary(headers)
+            passthrough = True
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, wrapped_send)
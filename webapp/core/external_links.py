@@ -0,0 +1,151 @@
+# webapp/core/external_links.py
+"""
+Кэш активных внешних VPN-ссылок для прокси /sub/.
+
+Набор ссылок меняется только из админки бота (ExternalVpnService), которая
+увеличивает версию 'external_links' в cache_versions и шлёт pg_notify.
+Здесь держим готовый снимок в памяти и перечитываем его только при смене версии:
+по NOTIFY сразу, плюс редкий опрос версии на случай потери соединения LISTEN.
+Недоступные по итогам проверки серверы (ExternalHealthService) в снимок не попадают,
+остальные идут в порядке health_rank — версию при изменениях увеличивает сама проверка.
+Сервер, который есть у нескольких провайдеров, отдаётся один раз.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from db import async_engine
+from database import external_config_repo, cache_version_repo
+from database.repositories.cache_version import CACHE_VERSION_CHANNEL, EXTERNAL_LINKS_CACHE
+from utils.vpn_links import VpnNode, parse_links
+
+logger = logging.getLogger(__name__)
+
+# Интервал сверки версии, если LISTEN не работает (секунды)
+POLL_INTERVAL = 30
+
+
+@dataclass(frozen=True)
+class ExternalLinksSnapshot:
+    version: int
+    links: tuple[str, ...]
+    # Ссылки, уже склеенные через "\n" — добавляются к списку Marzban без повторной сборки
+    block: str
+    # Разобранные ссылки для Clash/sing-box — парсим один раз на версию
+    nodes: tuple[VpnNode, ...] = ()
+
+
+_EMPTY = ExternalLinksSnapshot(version=-1, links=(), block="")
+
+
+class ExternalLinksCache:
+    def __init__(self, poll_interval: int = POLL_INTERVAL):
+        self._poll_interval = poll_interval
+        self._snapshot = _EMPTY
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._listen_conn = None
+        self._listen_lost = False
+        self._load_failed_at: float | None = None
+
+    async def get(self) -> ExternalLinksSnapshot:
+        """
+        Текущий снимок; к БД обращаемся только до первой загрузки.
+        Если БД недоступна — отдаём пустой снимок (подписка только из Marzban), а не ошибку;
+        повторная попытка из запроса — не чаще poll_interval, в остальное время грузит фоновая задача.
+        """
+        if self._snapshot is _EMPTY and not self._recently_failed():
+            try:
+                await self.reload()
+            except Exception as e:
+                self._load_failed_at = time.monotonic()
+                logger.error(f"External links cache load failed, serving without external links: {e}")
+        return self._snapshot
+
+    def _recently_failed(self) -> bool:
+        return self._load_failed_at is not None and time.monotonic() - self._load_failed_at < self._poll_interval
+
+    async def reload(self, version: int | None = None):
+        """Перечитывает ссылки, если версия в БД отличается от загруженной."""
+        async with self._lock:
+            if version is None:
+                version = await cache_version_repo.get(EXTERNAL_LINKS_CACHE)
+            if version == self._snapshot.version:
+                return
+            configs = await external_config_repo.get_active(healthy_only=True, unique=True)
+            links = tuple(c.raw_link for c in configs)
+            self._snapshot = ExternalLinksSnapshot(version=version, links=links, block="\n".join(links),
+                                                   nodes=tuple(parse_links(list(links))))
+            logger.info(f"External links cache loaded: version={version}, links={len(links)}")
+
+    async def start(self):
+        """Запускает фоновое обновление (вызывается из lifespan)."""
+        await self._listen()
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.error(f"External links cache initial load failed: {e}", exc_info=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._unlisten()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if self._listen_conn is None or self._listen_lost:
+                    await self._listen()
+                await self.reload()
+            except Exception as e:
+                logger.error(f"External links cache refresh failed: {e}", exc_info=True)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        if payload == EXTERNAL_LINKS_CACHE:
+            self._wakeup.set()
+
+    def _on_connection_lost(self, connection):
+        logger.warning("External links cache: LISTEN connection lost, reconnecting on next poll")
+        self._listen_lost = True
+        self._wakeup.set()
+
+    async def _listen(self):
+        """Подписывается на NOTIFY через отдельное соединение asyncpg (без него работает только опрос)."""
+        await self._unlisten()
+        conn = None
+        try:
+            conn = await async_engine.connect()
+            raw = await conn.get_raw_connection()
+            driver_conn = raw.driver_connection
+            await driver_conn.add_listener(CACHE_VERSION_CHANNEL, self._on_notify)
+            driver_conn.add_termination_listener(self._on_connection_lost)
+            self._listen_conn = conn
+            self._listen_lost = False
+        except Exception as e:
+            logger.warning(f"External links cache: LISTEN unavailable ({e}), polling every {self._poll_interval}s")
+            if conn is not None:
+                await conn.close()
+
+    async def _unlisten(self):
+        if self._listen_conn is not None:
+            try:
+                await self._listen_conn.close()
+            except Exception:
+                pass
+            self._listen_conn = None
+
+
+external_links_cache = ExternalLinksCache()
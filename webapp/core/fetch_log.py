@@ -0,0 +1,156 @@
+# webapp/core/fetch_log.py
+"""
+Журнал запросов /sub/ для аналитики.
+
+Большую часть /sub/ nginx отдаёт из proxy_cache, не доходя до приложения, поэтому события
+берутся из access log nginx: он шлёт строку на каждый запрос (с $upstream_cache_status)
+по syslog/UDP в vpn_site (NginxLogReceiver). Без nginx события пишет сам обработчик /sub/.
+
+Приём события — только append кортежа в кольцевой буфер (deque с maxlen): при переполнении
+теряются самые старые события, а не замедляется ответ. Разбор User-Agent и запись в Postgres
+многострочными INSERT делает фоновая задача раз в flush_interval секунд.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import deque
+from datetime import datetime
+
+from database import sub_analytics_repo
+
+logger = logging.getLogger(__name__)
+
+_UA_MAX_LEN = 256
+# "Happ/2.1.6 (Linux)", "v2rayNG/1.8.5", "sing-box 1.9.0", "ClashMeta"
+_UA_RE = re.compile(r"^\s*([A-Za-z][\w.\-]*?)(?:[/ ]v?(\d[\w.\-]*))?(?:[\s;(]|$)")
+
+
+def parse_client(user_agent: str | None) -> tuple[str, str | None]:
+    """(приложение, версия) по User-Agent; браузеры сводятся к 'browser'."""
+    if not user_agent:
+        return "unknown", None
+    if user_agent.startswith("Mozilla/"):
+        return "browser", None
+    match = _UA_RE.match(user_agent)
+    if not match:
+        return "other", None
+    app, version = match.groups()
+    return app[:50], version[:30] if version else None
+
+
+class FetchLog:
+    def __init__(self, capacity: int, flush_interval: float = 5.0):
+        self._buffer: deque = deque(maxlen=max(capacity, 1))
+        self._enabled = capacity > 0
+        self._flush_interval = flush_interval
+        self._dropped = 0
+        self._task: asyncio.Task | None = None
+
+    def record(self, username: str, user_agent: str | None, ip: str | None,
+               status: int, size: int, latency: float, cache_status: str | None = None,
+               ts: float | None = None):
+        """Вызывается на каждый запрос: без I/O и разбора, только кортеж в буфер."""
+        if not self._enabled:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append((ts or time.time(), username, user_agent, ip, status, size, latency, cache_status))
+
+    async def start(self):
+        if self._enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[fetch_log] Flush failed: {e}", exc_info=True)
+
+    async def flush(self) -> int:
+        if not self._buffer:
+            return 0
+        # Забираем содержимое целиком без await — запросы продолжают писать в пустой буфер
+        events = list(self._buffer)
+        self._buffer.clear()
+        if self._dropped:
+            logger.warning(f"[fetch_log] Buffer overflow, dropped {self._dropped} events")
+            self._dropped = 0
+
+        rows = []
+        for ts, username, user_agent, ip, status, size, latency, cache_status in events:
+            app, version = parse_client(user_agent)
+            rows.append({
+                "fetched_at": datetime.fromtimestamp(ts),
+                "username": username,
+                "client_app": app,
+                "client_version": version,
+                "user_agent": user_agent[:_UA_MAX_LEN] if user_agent else None,
+                "ip": ip,
+                "status": status,
+                "bytes": size,
+                "latency_ms": round(latency * 1000, 2),
+                "cache_status": cache_status,
+            })
+        return await sub_analytics_repo.insert_fetches(rows)
+
+
+def parse_nginx_event(datagram: bytes) -> tuple | None:
+    """
+    Строка access log формата sub_fetch (etc/nginx/templates/default.conf.template) в аргументы record.
+    Перед JSON идёт заголовок syslog ("<190>Oct 18 06:10:21 sub_fetch: ").
+    """
+    start = datagram.find(b"{")
+    if start < 0:
+        return None
+    try:
+        event = json.loads(datagram[start:])
+        uri = event["uri"]
+        if not uri.lower().startswith("/sub/"):
+            return None
+        username = uri[5:].strip("/").split("/", 1)[0]
+        if not username:
+            return None
+        return (username, event.get("ua") or None, event.get("ip") or None, int(event["status"]),
+                int(event.get("bytes") or 0), float(event.get("rt") or 0), event.get("cache") or None,
+                float(event["ts"]))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class NginxLogReceiver(asyncio.DatagramProtocol):
+    """Принимает access log nginx по syslog (UDP) и складывает события в FetchLog."""
+
+    def __init__(self, fetch_log: FetchLog):
+        self._fetch_log = fetch_log
+        self._transport: asyncio.DatagramTransport | None = None
+
+    async def start(self, port: int, host: str = "0.0.0.0"):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        logger.info(f"[fetch_log] Receiving nginx access log on udp/{port}")
+
+    def stop(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def datagram_received(self, data: bytes, addr):
+        event = parse_nginx_event(data)
+        if event is None:
+            logger.debug(f"[fetch_log] Skipping malformed nginx log line: {data[:200]!r}")
+            return
+        self._fetch_log.record(*event)
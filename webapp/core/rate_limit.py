@@ -0,0 +1,55 @@
+# webapp/core/rate_limit.py
+"""
+Token bucket в памяти процесса для /sub/.
+
+Ключи (username, IP) хранятся в LRU ограниченного размера: при переполнении вытесняются
+давно не обращавшиеся, а для них корзина всё равно была бы полной.
+"""
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """burst — ёмкость корзины, per_minute — скорость пополнения. per_minute <= 0 — без ограничений."""
+
+    def __init__(self, burst: int, per_minute: float, max_keys: int = 100_000):
+        self.burst = max(burst, 1)
+        self.rate = per_minute / 60.0
+        self._max_keys = max_keys
+        # key -> (tokens, last_refill_monotonic)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (float(self.burst), now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key: str) -> float:
+        """Как hit, но токен не забирает: 0 — запрос был бы разрешён."""
+        if not self.enabled:
+            return 0.0
+        tokens = self._tokens(key, time.monotonic())
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def hit(self, key: str) -> float:
+        """Забирает токен. Возвращает 0, если запрос разрешён, иначе секунды до следующего токена."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        tokens = self._tokens(key, now)
+        self._buckets.pop(key, None)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            retry_after = (1 - tokens) / self.rate
+        while len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self) -> int:
+        return len(self._buckets)
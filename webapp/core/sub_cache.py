@@ -0,0 +1,215 @@
+# webapp/core/sub_cache.py
+"""
+Кэш собранных ответов прокси /sub/ по пользователю.
+
+Пока запись свежая (SUB_CACHE_TTL), прокси отвечает из памяти — 200 или 304 по ETag —
+и не ходит в Marzban. ETag строится из хэша тела Marzban, версии внешних ссылок, announce и
+пробрасываемых заголовков (subscription-userinfo).
+
+Устаревшая запись не выбрасывается: в окне stale-while-revalidate её отдают сразу и
+обновляют в фоне, а при ошибке Marzban — в пределах stale-if-error, чтобы клиенты
+не теряли список серверов во время перезапуска панели. Память ограничена по байтам;
+вытесненные записи при заданном SUB_CACHE_SPILL_DIR сохраняются на диск.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field, replace
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def make_etag(marzban_body: str, ext_version: int, announce: str, fmt: str = "v2ray",
+              headers: dict[str, str] | None = None) -> str:
+    """
+    Сильный валидатор ответа /sub/ (для каждого формата свой).
+    headers — заголовки, которые уходят клиенту (subscription-userinfo и др.): 304 обновляет
+    у nginx и клиента только валидатор, поэтому смена срока или трафика должна менять ETag.
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(marzban_body.encode("utf-8")).digest())
+    digest.update(str(ext_version).encode("ascii"))
+    digest.update(announce.encode("utf-8"))
+    digest.update(fmt.encode("ascii"))
+    for name, value in sorted((headers or {}).items()):
+        digest.update(f"\n{name.lower()}:{value}".encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Проверка If-None-Match (список через запятую, '*', слабые W/-валидаторы)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+@dataclass(frozen=True)
+class CachedSubscription:
+    etag: str
+    body: str
+    headers: dict[str, str]
+    ext_version: int
+    # time.time(), а не monotonic: запись читается с диска и после перезапуска
+    fetched_at: float
+    media_type: str = "text/plain; charset=utf-8"
+    # Заранее сжатые варианты тела {"gzip": ..., "br": ...}; на диск не пишутся, пересчитываются при чтении
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    def age(self) -> float:
+        return max(time.time() - self.fetched_at, 0.0)
+
+    def size(self) -> int:
+        return (len(self.body) + sum(len(v) for v in self.encoded.values())
+                + sum(len(k) + len(v) for k, v in self.headers.items()) + 256)
+
+
+class SubscriptionCache:
+    """
+    LRU по объёму тела в памяти + необязательный уровень на диске.
+    ttl — окно свежести, stale_while_revalidate — сколько после него отдаём старое
+    и обновляем в фоне, stale_if_error — сколько можно отдавать старое при ошибке Marzban.
+    """
+
+    def __init__(self, ttl: int, max_entries: int, max_bytes: int = 64 * 1024 * 1024,
+                 stale_while_revalidate: int = 600, stale_if_error: int = 7 * 24 * 3600,
+                 spill_dir: str | None = None,
+                 encoder: Callable[[bytes], dict[str, bytes]] | None = None):
+        self.ttl = ttl
+        self._encoder = encoder
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._spill_dir = spill_dir or None
+        self._entries: OrderedDict[str, CachedSubscription] = OrderedDict()
+        self._bytes = 0
+        if self._spill_dir:
+            os.makedirs(self._spill_dir, exist_ok=True)
+
+    # --- Политика свежести ---
+
+    def is_fresh(self, entry: CachedSubscription, ext_version: int) -> bool:
+        return entry.ext_version == ext_version and entry.age() < self.ttl
+
+    def can_revalidate_in_background(self, entry: CachedSubscription) -> bool:
+        return entry.age() < self.ttl + self.stale_while_revalidate
+
+    def usable_on_error(self, entry: CachedSubscription) -> bool:
+        return entry.age() < self.stale_if_error
+
+    # --- Хранилище ---
+
+    async def get(self, key: str) -> CachedSubscription | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        if not self._spill_dir:
+            return None
+        entry = await asyncio.to_thread(self._read_spilled, key)
+        if entry is not None and entry.age() < self.stale_if_error:
+            return await self._store(key, entry)
+        return None
+
+    def peek(self, key: str) -> CachedSubscription | None:
+        """Запись из памяти без обновления LRU и без чтения с диска."""
+        return self._entries.get(key)
+
+    async def put(self, key: str, etag: str, body: str, headers: dict[str, str], ext_version: int,
+                  media_type: str = "text/plain; charset=utf-8") -> CachedSubscription:
+        entry = CachedSubscription(etag=etag, body=body, headers=dict(headers), ext_version=ext_version,
+                                   fetched_at=time.time(), media_type=media_type)
+        return await self._store(key, entry)
+
+    async def _store(self, key: str, entry: CachedSubscription) -> CachedSubscription:
+        if self._encoder and not entry.encoded:
+            # Сжимаем один раз при записи, а не на каждый запрос
+            entry = replace(entry, encoded=self._encoder(entry.body.encode("utf-8")))
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size()
+        self._entries[key] = entry
+        self._bytes += entry.size()
+
+        evicted = []
+        while self._entries and (len(self._entries) > self._max_entries or self._bytes > self._max_bytes):
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._bytes -= old_entry.size()
+            if old_key != key:
+                evicted.append((old_key, old_entry))
+        if evicted and self._spill_dir:
+            await asyncio.to_thread(self._spill, evicted)
+        return entry
+
+    async def discard(self, key: str):
+        """Удаляет запись (например, пользователь удалён в Marzban) — её нельзя отдавать как last good."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size()
+        if self._spill_dir:
+            await asyncio.to_thread(self._remove_spilled, key)
+
+    async def flush(self):
+        """Сохраняет все записи из памяти на диск (при остановке), чтобы пережить перезапуск."""
+        if self._spill_dir and self._entries:
+            await asyncio.to_thread(self._spill, list(self._entries.items()))
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    # --- Диск ---
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._spill_dir, name[:2], f"{name}.json")
+
+    def _spill(self, items: list[tuple[str, CachedSubscription]]):
+        for key, entry in items:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    data = asdict(entry)
+                    data.pop("encoded", None)
+                    json.dump(data, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"[sub_cache] Failed to spill entry to disk: {e}")
+
+    def _remove_spilled(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"[sub_cache] Failed to remove spilled entry: {e}")
+
+    def _read_spilled(self, key: str) -> CachedSubscription | None:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return CachedSubscription(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"[sub_cache] Broken spilled entry: {e}")
+            return None
@@ -0,0 +1,278 @@
+# webapp/core/sub_render.py
+"""
+Форматы ответа /sub/: v2ray (base64-список ссылок), Clash (mihomo YAML), sing-box (JSON).
+
+Формат выбирается параметром ?format= или по User-Agent клиента. Ссылки разбираются
+в VpnNode один раз (внешние — при смене версии, Marzban — при смене тела), а общий
+каркас конфигов Clash/sing-box собран заранее: при рендере подставляются только серверы.
+"""
+import base64
+import json
+
+from utils.vpn_links import VpnNode
+
+FORMAT_V2RAY = "v2ray"
+FORMAT_CLASH = "clash"
+FORMAT_SINGBOX = "singbox"
+
+_FORMAT_ALIASES = {
+    "v2ray": FORMAT_V2RAY, "base64": FORMAT_V2RAY, "links": FORMAT_V2RAY,
+    "clash": FORMAT_CLASH, "mihomo": FORMAT_CLASH, "clash-meta": FORMAT_CLASH,
+    "singbox": FORMAT_SINGBOX, "sing-box": FORMAT_SINGBOX,
+}
+# Подстроки User-Agent (в нижнем регистре) → формат
+_UA_FORMATS = (
+    (("clash", "mihomo", "stash"), FORMAT_CLASH),
+    (("sing-box", "singbox", "sfa/", "sfi/", "sfm/", "sft/"), FORMAT_SINGBOX),
+)
+
+MEDIA_TYPES = {
+    FORMAT_V2RAY: "text/plain; charset=utf-8",
+    FORMAT_CLASH: "text/yaml; charset=utf-8",
+    FORMAT_SINGBOX: "application/json; charset=utf-8",
+}
+
+_PROXY_GROUP = "PROXY"
+_AUTO_GROUP = "AUTO"
+_TEST_URL = "https://www.gstatic.com/generate_204"
+
+
+def select_format(format_param: str | None, user_agent: str | None) -> str:
+    if format_param:
+        return _FORMAT_ALIASES.get(format_param.lower(), FORMAT_V2RAY)
+    ua = (user_agent or "").lower()
+    for needles, fmt in _UA_FORMATS:
+        if any(needle in ua for needle in needles):
+            return fmt
+    return FORMAT_V2RAY
+
+
+def _unique_names(nodes: list[VpnNode]) -> list[str]:
+    """Clash и sing-box требуют уникальные имена серверов."""
+    seen: dict[str, int] = {}
+    names = []
+    for node in nodes:
+        name = node.name or node.server
+        count = seen.get(name, 0) + 1
+        seen[name] = count
+        names.append(name if count == 1 else f"{name} {count}")
+    return names
+
+
+def _security(node: VpnNode) -> str:
+    # trojan всегда поверх TLS, даже если security в ссылке не указан
+    return node.params.get("security") or ("tls" if node.protocol == "trojan" else "none")
+
+
+def _is_insecure(node: VpnNode) -> bool:
+    return node.params.get("allowInsecure") in ("1", "true") or node.params.get("insecure") in ("1", "true")
+
+
+# --- v2ray ---
+
+def render_v2ray(links: list[str]) -> str:
+    return base64.b64encode("\n".join(links).encode("utf-8")).decode("utf-8")
+
+
+# --- Clash (mihomo) ---
+
+def _clash_transport(node: VpnNode, proxy: dict):
+    network = node.params.get("type", "tcp")
+    if network in ("ws", "grpc", "http", "h2"):
+        proxy["network"] = network
+    if network == "ws":
+        opts = {"path": node.params.get("path", "/")}
+        if node.params.get("host"):
+            opts["headers"] = {"Host": node.params["host"]}
+        proxy["ws-opts"] = opts
+    elif network == "grpc":
+        proxy["grpc-opts"] = {"grpc-service-name": node.params.get("serviceName", "")}
+
+
+def _clash_tls(node: VpnNode, proxy: dict, sni_key: str = "servername"):
+    security = _security(node)
+    if security not in ("tls", "reality"):
+        return
+    proxy["tls"] = True
+    if node.params.get("sni"):
+        proxy[sni_key] = node.params["sni"]
+    if node.params.get("fp"):
+        proxy["client-fingerprint"] = node.params["fp"]
+    if node.params.get("alpn"):
+        proxy["alpn"] = node.params["alpn"].split(",")
+    if _is_insecure(node):
+        proxy["skip-cert-verify"] = True
+    if security == "reality":
+        proxy["reality-opts"] = {"public-key": node.params.get("pbk", ""), "short-id": node.params.get("sid", "")}
+
+
+def _clash_proxy(node: VpnNode, name: str) -> dict | None:
+    proxy = {"name": name, "server": node.server, "port": node.port, "udp": True}
+    if node.protocol == "vless":
+        proxy.update(type="vless", uuid=node.credential)
+        if node.params.get("flow"):
+            proxy["flow"] = node.params["flow"]
+        _clash_tls(node, proxy)
+        _clash_transport(node, proxy)
+    elif node.protocol == "vmess":
+        proxy.update(type="vmess", uuid=node.credential, alterId=0, cipher=node.method or "auto")
+        _clash_tls(node, proxy)
+        _clash_transport(node, proxy)
+    elif node.protocol == "trojan":
+        proxy.update(type="trojan", password=node.password)
+        _clash_tls(node, proxy, sni_key="sni")
+        proxy.pop("tls", None)
+        _clash_transport(node, proxy)
+    elif node.protocol == "ss":
+        proxy.update(type="ss", cipher=node.method, password=node.password)
+    elif node.protocol == "hysteria2":
+        proxy.update(type="hysteria2", password=node.password)
+        if node.params.get("sni"):
+            proxy["sni"] = node.params["sni"]
+        if node.params.get("obfs"):
+            proxy["obfs"] = node.params["obfs"]
+            proxy["obfs-password"] = node.params.get("obfs-password", "")
+        if _is_insecure(node):
+            proxy["skip-cert-verify"] = True
+    elif node.protocol == "tuic":
+        proxy.update(type="tuic", uuid=node.credential, password=node.password)
+        if node.params.get("sni"):
+            proxy["sni"] = node.params["sni"]
+        if node.params.get("alpn"):
+            proxy["alpn"] = node.params["alpn"].split(",")
+        if node.params.get("congestion_control"):
+            proxy["congestion-controller"] = node.params["congestion_control"]
+    else:
+        return None
+    return proxy
+
+
+# Каркас конфига: JSON — подмножество YAML, поэтому прокси и группы пишем flow-стилем через json.dumps
+_CLASH_HEAD = (
+    "mixed-port: 7890\n"
+    "allow-lan: false\n"
+    "mode: rule\n"
+    "log-level: warning\n"
+    "proxies:\n"
+)
+_CLASH_GROUPS = (
+    "proxy-groups:\n"
+    f"  - {{name: {_PROXY_GROUP}, type: select, proxies: {{select}}}}\n"
+    f"  - {{name: {_AUTO_GROUP}, type: url-test, url: \"{_TEST_URL}\", interval: 300, proxies: {{auto}}}}\n"
+    "rules:\n"
+    f"  - MATCH,{_PROXY_GROUP}\n"
+)
+
+
+def render_clash(nodes: list[VpnNode]) -> str:
+    proxies = []
+    for node, name in zip(nodes, _unique_names(nodes)):
+        proxy = _clash_proxy(node, name)
+        if proxy:
+            proxies.append(proxy)
+    names = [p["name"] for p in proxies]
+
+    def dump(value) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
+    body = "".join(f"  - {dump(p)}\n" for p in proxies) if proxies else "  []\n"
+    groups = (_CLASH_GROUPS
+              .replace("{select}", dump([_AUTO_GROUP] + names))
+              .replace("{auto}", dump(names or ["DIRECT"])))
+    return _CLASH_HEAD + body + groups
+
+
+# --- sing-box ---
+
+def _singbox_tls(node: VpnNode) -> dict | None:
+    security = _security(node)
+    if node.protocol not in ("hysteria2", "tuic") and security not in ("tls", "reality"):
+        return None
+    tls: dict = {"enabled": True}
+    if node.params.get("sni"):
+        tls["server_name"] = node.params["sni"]
+    if node.params.get("alpn"):
+        tls["alpn"] = node.params["alpn"].split(",")
+    if _is_insecure(node):
+        tls["insecure"] = True
+    if node.params.get("fp"):
+        tls["utls"] = {"enabled": True, "fingerprint": node.params["fp"]}
+    if security == "reality":
+        tls["reality"] = {"enabled": True, "public_key": node.params.get("pbk", ""),
+                          "short_id": node.params.get("sid", "")}
+    return tls
+
+
+def _singbox_transport(node: VpnNode) -> dict | None:
+    network = node.params.get("type", "tcp")
+    if network == "ws":
+        transport = {"type": "ws", "path": node.params.get("path", "/")}
+        if node.params.get("host"):
+            transport["headers"] = {"Host": node.params["host"]}
+        return transport
+    if network == "grpc":
+        return {"type": "grpc", "service_name": node.params.get("serviceName", "")}
+    if network in ("http", "h2"):
+        return {"type": "http", "path": node.params.get("path", "/")}
+    return None
+
+
+def _singbox_outbound(node: VpnNode, tag: str) -> dict | None:
+    outbound = {"tag": tag, "server": node.server, "server_port": node.port}
+    if node.protocol == "vless":
+        outbound.update(type="vless", uuid=node.credential)
+        if node.params.get("flow"):
+            outbound["flow"] = node.params["flow"]
+    elif node.protocol == "vmess":
+        outbound.update(type="vmess", uuid=node.credential, security=node.method or "auto", alter_id=0)
+    elif node.protocol == "trojan":
+        outbound.update(type="trojan", password=node.password)
+    elif node.protocol == "ss":
+        outbound.update(type="shadowsocks", method=node.method, password=node.password)
+    elif node.protocol == "hysteria2":
+        outbound.update(type="hysteria2", password=node.password)
+        if node.params.get("obfs"):
+            outbound["obfs"] = {"type": node.params["obfs"], "password": node.params.get("obfs-password", "")}
+    elif node.protocol == "tuic":
+        outbound.update(type="tuic", uuid=node.credential, password=node.password)
+        if node.params.get("congestion_control"):
+            outbound["congestion_control"] = node.params["congestion_control"]
+    else:
+        return None
+    if node.protocol != "ss":
+        tls = _singbox_tls(node)
+        if tls:
+            outbound["tls"] = tls
+    if node.protocol in ("vless", "vmess", "trojan"):
+        transport = _singbox_transport(node)
+        if transport:
+            outbound["transport"] = transport
+    return outbound
+
+
+# Каркас конфига сериализован один раз; на месте маркера подставляются outbounds
+_SINGBOX_MARKER = "__OUTBOUNDS__"
+_SINGBOX_HEAD, _SINGBOX_TAIL = json.dumps({
+    "log": {"level": "warn"},
+    "inbounds": [{
+        "type": "tun", "tag": "tun-in", "address": ["172.19.0.1/30"],
+        "auto_route": True, "strict_route": True,
+    }],
+    "outbounds": _SINGBOX_MARKER,
+    "route": {"auto_detect_interface": True, "final": _PROXY_GROUP},
+}, ensure_ascii=False).split(f'"{_SINGBOX_MARKER}"')
+
+
+def render_singbox(nodes: list[VpnNode]) -> str:
+    outbounds = []
+    for node, tag in zip(nodes, _unique_names(nodes)):
+        outbound = _singbox_outbound(node, tag)
+        if outbound:
+            outbounds.append(outbound)
+    tags = [o["tag"] for o in outbounds]
+    groups = [
+        {"type": "selector", "tag": _PROXY_GROUP, "outbounds": [_AUTO_GROUP] + tags + ["direct"]},
+        {"type": "urltest", "tag": _AUTO_GROUP, "outbounds": tags or ["direct"], "url": _TEST_URL},
+    ]
+    all_outbounds = groups + outbounds + [{"type": "direct", "tag": "direct"}]
+    return _SINGBOX_HEAD + json.dumps(all_outbounds, ensure_ascii=False) + _SINGBOX_TAIL
@@ -6,34 +6,59 @@ from datetime import datetime
 
 from fastapi import FastAPI, Request, Depends
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware 
 from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
 
-from db import User
+from db import User, render_pool_metrics
+from db_pool import metrics_authorized
 from webapp.routers import auth, dashboard, payment, subscription
 from webapp.dependencies import get_current_user
-from loader import logger, marzban_client
+from webapp.core.external_links import external_links_cache
+from webapp.core.compression import CompressionMiddleware
+from loader import config, logger, marzban_client
 from typing import Optional
 from db import Tariff
 from database import tariff_repo
+from database.migrations import check_schema
 
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    pending = await check_schema()
+    if pending:
+        logger.error(f"Database schema is behind: {len(pending)} pending migrations. Run: python3 -m database.migrations")
     app.state.marz_client = marzban_client
+    # Общий пул соединений для агрегирующего прокси /sub/
+    app.state.sub_client = subscription.create_sub_client()
+    # Снимок внешних VPN-ссылок для /sub/, обновляется по версии из cache_versions
+    await external_links_cache.start()
+    # Аналитика запросов /sub/: фоновый сброс буфера в БД
+    await subscription.fetch_log.start()
+    if config.sub_proxy.analytics_syslog_port > 0 and config.sub_proxy.analytics_buffer > 0:
+        await subscription.fetch_log_receiver.start(config.sub_proxy.analytics_syslog_port)
 
     yield  # Здесь приложение работает (принимает запросы)
     
     # 2. При выключении очищаем ресурсы
-    if hasattr(app.state, "marz_client") and app.state.marz_client._http_client:
-        await app.state.marz_client._http_client.aclose()
+    await subscription.shutdown_sub_cache()
+    await external_links_cache.stop()
+    await app.state.sub_client.aclose()
+    if hasattr(app.state, "marz_client"):
+        await app.state.marz_client.close()
         logger.info("💤 Marzban Client closed")
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=["*"])
+# gzip/br для страниц; тела /sub/ приходят уже сжатыми из кэша и пропускаются
+app.add_middleware(
+    CompressionMiddleware,
+    min_size=config.webapp.compress_min_size,
+    gzip_level=config.webapp.gzip_level,
+    brotli_quality=config.webapp.brotli_quality,
+)
 
 # --- Статика (создаем папку, если нет) ---
 static_dir = "webapp/static"
@@ -61,6 +86,18 @@ app.include_router(auth.router)
 app.include_router(dashboard.router)
 app.include_router(payment.router)
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Метрики пула соединений с БД процесса сайта (Prometheus)."""
+    token = config.dataBase.metrics_token
+    if not token:
+        return Response(status_code=404)
+    if not metrics_authorized(request.headers.get("authorization"), token):
+        return Response(status_code=403)
+    return PlainTextResponse(render_pool_metrics())
+
+
 # --- Главная ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request, user: User = Depends(get_current_user)):
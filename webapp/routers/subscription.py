@@ -3,23 +3,90 @@ webapp/routers/subscription.py
 
 Агрегирующий прокси для Marzban subscription URL.
 Перехватывает запросы на /sub/{marzban_username}, добавляет внешние VPN-конфиги
-если у пользователя активная подписка, и возвращает объединённый base64-список.
+если у пользователя активная подписка, и возвращает объединённый список:
+base64 (v2ray), Clash или sing-box — по ?format= или User-Agent клиента.
 """
 
+import asyncio
 import base64
 import time
 
 import httpx
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import Response
 
-from database import external_config_repo
-from loader import logger
+from loader import config, logger, marzban_client
+from marzban.resilience import CircuitOpenError
+from webapp.core.external_links import ExternalLinksSnapshot, external_links_cache
+from webapp.core.compression import compress_all, negotiate_encoding
+from webapp.core.fetch_log import FetchLog, NginxLogReceiver
+from webapp.core.rate_limit import TokenBucketLimiter
+from webapp.core.sub_cache import CachedSubscription, SubscriptionCache, etag_matches, make_etag
+from webapp.core.sub_render import (
+    FORMAT_CLASH, FORMAT_V2RAY, MEDIA_TYPES, render_clash, render_singbox, render_v2ray, select_format,
+)
+from utils.vpn_links import decode_subscription, parse_links
 
 router = APIRouter()
 
 # Marzban subscription endpoint внутри Docker-сети (без SSL verify)
-_MARZBAN_BASE = "https://marzban:8002"
+_MARZBAN_BASE = config.sub_proxy.marzban_url
+# Клиенты ждут ответ синхронно: при подвисшей панели лучше быстро отдать пустой ответ
+_MARZBAN_TIMEOUT = httpx.Timeout(5.0, connect=2.0)
+
+
+
+def create_sub_client() -> httpx.AsyncClient:
+    """
+    Пул соединений к Marzban для /sub/ — создаётся и закрывается в lifespan приложения.
+    Keep-alive убирает TLS-рукопожатие с каждого опроса подписки.
+    """
+    limits = httpx.Limits(
+        max_connections=config.marzban.pool_size,
+        max_keepalive_connections=config.marzban.keepalive_connections,
+        keepalive_expiry=config.marzban.keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        base_url=_MARZBAN_BASE,
+        verify=False,
+        timeout=_MARZBAN_TIMEOUT,
+        limits=limits,
+    )
+
+
+# Собранные ответы по пользователю: в окне свежести Marzban не запрашивается
+_sub_cache = SubscriptionCache(
+    ttl=config.sub_proxy.cache_ttl,
+    max_entries=config.sub_proxy.cache_max_entries,
+    max_bytes=config.sub_proxy.cache_max_bytes,
+    stale_while_revalidate=config.sub_proxy.stale_while_revalidate,
+    stale_if_error=config.sub_proxy.stale_if_error,
+    spill_dir=config.sub_proxy.spill_dir,
+    # Тела хранятся уже сжатыми (gzip/br), запросы только выбирают вариант
+    encoder=lambda data: compress_all(data, config.webapp.compress_min_size,
+                                      config.webapp.gzip_level, config.webapp.brotli_quality),
+)
+# Защита панели от клиентов, опрашивающих подписку слишком часто
+_user_limiter = TokenBucketLimiter(config.sub_proxy.rate_user_burst, config.sub_proxy.rate_user_per_minute,
+                                   config.sub_proxy.rate_max_keys)
+_ip_limiter = TokenBucketLimiter(config.sub_proxy.rate_ip_burst, config.sub_proxy.rate_ip_per_minute,
+                                 config.sub_proxy.rate_max_keys)
+# События запросов для аналитики (кольцевой буфер, сброс в БД в фоне).
+# За nginx источник — его access log (NginxLogReceiver): большая часть /sub/ отдаётся из proxy_cache
+fetch_log = FetchLog(config.sub_proxy.analytics_buffer, config.sub_proxy.analytics_flush_interval)
+fetch_log_receiver = NginxLogReceiver(fetch_log)
+_RECORD_IN_APP = config.sub_proxy.analytics_syslog_port <= 0
+# Фоновые обновления устаревших записей (не больше одного на пользователя и формат)
+_refresh_tasks: dict[str, asyncio.Task] = {}
+
+async def shutdown_sub_cache():
+    """Останавливает фоновые обновления и сбрасывает кэш ответов на диск (из lifespan)."""
+    for task in list(_refresh_tasks.values()):
+        task.cancel()
+    await _sub_cache.flush()
+    fetch_log_receiver.stop()
+    await fetch_log.stop()
+
 
 # Заголовки Marzban которые пробрасываем клиенту
 _PASSTHROUGH_HEADERS = (
@@ -41,27 +108,137 @@ def _b64_header(text: str) -> str:
 
 
 @router.get("/sub/{marzban_username}")
-async def subscription_proxy(marzban_username: str):
+async def subscription_proxy(marzban_username: str, request: Request):
     """
-    1. Запрашивает подписку из Marzban напрямую по внутреннему адресу
-    2. Пробрасывает оригинальные заголовки Marzban (subscription-userinfo и др.)
-    3. Проверяет статус подписки по subscription-userinfo
-    4. Если подписка активна — добавляет внешние VPN-конфиги + announce
-    5. Если истекла — возвращает только Marzban + announce об истечении
+    1. Если в кэше есть свежий ответ — отдаём его (или 304 по If-None-Match) без Marzban
+    2. Если ответ устарел недавно — отдаём его сразу и обновляем из Marzban в фоне
+    3. Иначе запрашивает подписку из Marzban напрямую по внутреннему адресу
+    4. Пробрасывает оригинальные заголовки Marzban (subscription-userinfo и др.)
+    5. Проверяет статус подписки по subscription-userinfo
+    6. Если подписка активна — добавляет внешние VPN-конфиги + announce
+    7. Если истекла — возвращает только Marzban + announce об истечении
+    При ошибке Marzban отдаём последний удачный ответ, а не пустой список серверов.
+    Сверх лимита запросов (по username и IP) — ответ из кэша без обращения к Marzban или 429.
     """
-    marz_url = f"{_MARZBAN_BASE}/sub/{marzban_username}"
+    started = time.perf_counter()
+    client_ip = _client_ip(request)
+    response = await _subscription_response(marzban_username, request, client_ip)
+    if _RECORD_IN_APP:
+        fetch_log.record(marzban_username, request.headers.get("user-agent"), client_ip,
+                         response.status_code, len(response.body), time.perf_counter() - started)
+    return response
+
 
-    # Получаем оригинальную подписку из Marzban
+def _client_ip(request: Request) -> str:
+    """
+    IP клиента для лимита и аналитики. nginx перезаписывает X-Real-IP своим $remote_addr,
+    а X-Forwarded-For (и request.client за ProxyHeadersMiddleware) начинается со значения клиента.
+    """
+    real_ip = request.headers.get("x-real-ip", "").strip()
+    if real_ip:
+        return real_ip
+    return request.client.host if request.client else "unknown"
+
+
+async def _subscription_response(marzban_username: str, request: Request, client_ip: str) -> Response:
+    if_none_match = request.headers.get("if-none-match")
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    client: httpx.AsyncClient = request.app.state.sub_client
+    fmt = select_format(request.query_params.get("format"), request.headers.get("user-agent"))
+    cache_key = _cache_key(marzban_username, fmt)
+    # Активные внешние конфиги — из кэша в памяти (без запросов к БД)
+    ext = await external_links_cache.get()
+
+    cached = await _sub_cache.get(cache_key)
+    # Сначала проверяем обе корзины, токены забираем, только если разрешают обе
+    retry_after = max(_user_limiter.retry_after(marzban_username), _ip_limiter.retry_after(client_ip))
+    if not retry_after:
+        _user_limiter.hit(marzban_username)
+        _ip_limiter.hit(client_ip)
+    else:
+        # Сверх лимита в Marzban не ходим: отдаём что есть в кэше или 429
+        if cached and _sub_cache.usable_on_error(cached):
+            return _cached_response(cached, if_none_match, encoding)
+        logger.info(f"[sub_proxy] Rate limited {marzban_username} from {client_ip}")
+        return Response("", status_code=429, media_type="text/plain; charset=utf-8",
+                        headers={"retry-after": str(int(retry_after) + 1), "cache-control": "no-store"})
+
+    if cached:
+        if _sub_cache.is_fresh(cached, ext.version):
+            return _cached_response(cached, if_none_match, encoding)
+        if _sub_cache.can_revalidate_in_background(cached):
+            _schedule_refresh(marzban_username, fmt, client)
+            return _cached_response(cached, if_none_match, encoding)
+
+    entry = await _refresh(marzban_username, fmt, client, ext)
+    if entry:
+        return _cached_response(entry, if_none_match, encoding)
+    if cached and cache_key in _sub_cache and _sub_cache.usable_on_error(cached):
+        logger.info(f"[sub_proxy] Serving last good response for {marzban_username} ({int(cached.age())}s old)")
+        return _cached_response(cached, if_none_match, encoding)
+    return _empty_response()
+
+
+async def _fetch_marzban(client: httpx.AsyncClient, marzban_username: str) -> tuple[str, httpx.Headers] | None:
+    """Подписка из Marzban: (тело, заголовки) или None, если панель не ответила."""
+    # Breaker общий с API-клиентом: если панель лежит, не держим соединение клиента до таймаута
+    breaker = marzban_client.breaker
     try:
-        async with httpx.AsyncClient(verify=False, timeout=10) as client:
-            resp = await client.get(marz_url)
-            resp.raise_for_status()
-            marz_content = resp.text.strip()
-            marz_headers = resp.headers
+        breaker.before_call()
+        resp = await client.get(f"/sub/{marzban_username}")
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        resp.raise_for_status()
+        return resp.text.strip(), resp.headers
+    except CircuitOpenError as e:
+        logger.warning(f"[sub_proxy] Skipping Marzban for {marzban_username}: {e}")
+    except httpx.HTTPStatusError as e:
+        logger.warning(f"[sub_proxy] Marzban request failed for {marzban_username}: {e}")
+        if e.response.status_code < 500:
+            # Пользователя нет/отозван — старый ответ больше не отдаём
+            for fmt in MEDIA_TYPES:
+                await _sub_cache.discard(_cache_key(marzban_username, fmt))
     except httpx.HTTPError as e:
+        if isinstance(e, httpx.TransportError):
+            breaker.record_failure()
         logger.warning(f"[sub_proxy] Marzban request failed for {marzban_username}: {e}")
-        return Response("", media_type="text/plain; charset=utf-8")
+    return None
+
 
+def _cache_key(marzban_username: str, fmt: str) -> str:
+    return f"{marzban_username}|{fmt}"
+
+
+async def _refresh(marzban_username: str, fmt: str, client: httpx.AsyncClient,
+                   ext: ExternalLinksSnapshot) -> CachedSubscription | None:
+    fetched = await _fetch_marzban(client, marzban_username)
+    if fetched is None:
+        return None
+    marz_content, marz_headers = fetched
+    return await _build_entry(marzban_username, fmt, marz_content, marz_headers, ext)
+
+
+def _schedule_refresh(marzban_username: str, fmt: str, client: httpx.AsyncClient):
+    cache_key = _cache_key(marzban_username, fmt)
+    if cache_key in _refresh_tasks:
+        return
+
+    async def run():
+        try:
+            await _refresh(marzban_username, fmt, client, await external_links_cache.get())
+        except Exception as e:
+            logger.error(f"[sub_proxy] Background refresh failed for {marzban_username}: {e}", exc_info=True)
+        finally:
+            _refresh_tasks.pop(cache_key, None)
+
+    _refresh_tasks[cache_key] = asyncio.create_task(run())
+
+
+async def _build_entry(marzban_username: str, fmt: str, marz_content: str, marz_headers: httpx.Headers,
+                       ext: ExternalLinksSnapshot) -> CachedSubscription:
+    """Собирает ответ из подписки Marzban и внешних ссылок и кладёт его в кэш."""
     # Собираем заголовки для ответа (проброс из Marzban)
     response_headers = {}
     for hdr in _PASSTHROUGH_HEADERS:
@@ -70,39 +247,62 @@ async def subscription_proxy(marzban_username: str):
 
     # Проверяем статус подписки
     sub_active = _is_subscription_active(marz_headers.get("subscription-userinfo", ""))
-
-    if not sub_active:
-        response_headers["announce"] = _b64_header(_ANNOUNCE_EXPIRED)
-        return Response(
-            marz_content,
-            media_type="text/plain; charset=utf-8",
-            headers=response_headers,
-        )
-
-    # Announce для активных пользователей
-    response_headers["announce"] = _b64_header(_ANNOUNCE_ACTIVE)
-
-    # Получаем активные внешние конфиги
-    ext_configs = await external_config_repo.get_active()
-    if not ext_configs:
-        return Response(
-            marz_content,
-            media_type="text/plain; charset=utf-8",
-            headers=response_headers,
-        )
-
-    # Декодируем Marzban base64 → список ссылок + добавляем внешние
-    marz_links = _decode_links(marz_content)
-    ext_links = [c.raw_link for c in ext_configs]
-
-    combined = marz_links + ext_links
-    encoded = base64.b64encode("\n".join(combined).encode("utf-8")).decode("utf-8")
-
-    return Response(
-        encoded,
-        media_type="text/plain; charset=utf-8",
-        headers=response_headers,
-    )
+    announce = _ANNOUNCE_ACTIVE if sub_active else _ANNOUNCE_EXPIRED
+    response_headers["announce"] = _b64_header(announce)
+
+    cache_key = _cache_key(marzban_username, fmt)
+    etag = make_etag(marz_content, ext.version, announce, fmt, response_headers)
+    previous = _sub_cache.peek(cache_key)
+    if previous and previous.etag == etag:
+        # Ничего не поменялось — не разбираем и не рендерим заново, только продлеваем свежесть
+        body = previous.body
+    else:
+        body = _render(fmt, marz_content, ext if sub_active else None)
+    return await _sub_cache.put(cache_key, etag, body, response_headers, ext.version, MEDIA_TYPES[fmt])
+
+
+def _render(fmt: str, marz_content: str, ext: ExternalLinksSnapshot | None) -> str:
+    """Тело ответа в нужном формате; ext=None — без внешних конфигов (подписка истекла)."""
+    if fmt == FORMAT_V2RAY:
+        if not ext or not ext.links:
+            return marz_content
+        # Декодируем Marzban base64 → список ссылок + добавляем готовый блок внешних
+        marz_links = decode_subscription(marz_content)
+        return render_v2ray(marz_links + [ext.block])
+
+    nodes = parse_links(decode_subscription(marz_content))
+    if ext:
+        nodes.extend(ext.nodes)
+    return render_clash(nodes) if fmt == FORMAT_CLASH else render_singbox(nodes)
+
+
+def _cached_response(entry: CachedSubscription, if_none_match: str | None, encoding: str | None) -> Response:
+    """200 с телом или 304, если у клиента уже эта версия. Заголовки отдаём в обоих случаях."""
+    age = int(entry.age())
+    headers = {
+        **entry.headers,
+        "etag": entry.etag,
+        "age": str(age),
+        # Формат и сжатие зависят от клиента
+        "vary": "User-Agent, Accept-Encoding",
+        # Клиент/nginx могут переиспользовать ответ до конца окна свежести, дальше — перепроверка по ETag;
+        # при недоступности vpn_site nginx может отдать устаревшую копию
+        "cache-control": (
+            f"max-age={max(_sub_cache.ttl - age, 0)}, "
+            f"stale-while-revalidate={_sub_cache.stale_while_revalidate}, "
+            f"stale-if-error={_sub_cache.stale_if_error}"
+        ),
+    }
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding in entry.encoded:
+        headers["content-encoding"] = encoding
+        return Response(entry.encoded[encoding], media_type=entry.media_type, headers=headers)
+    return Response(entry.body, media_type=entry.media_type, headers=headers)
+
+
+def _empty_response() -> Response:
+    return Response("", media_type="text/plain; charset=utf-8", headers={"cache-control": "no-store"})
 
 
 def _is_subscription_active(userinfo_header: str) -> bool:
@@ -137,22 +337,3 @@ def _is_subscription_active(userinfo_header: str) -> bool:
             return False
 
     return True
-
-
-_VPN_PREFIXES = ("vless://", "vmess://", "trojan://", "ss://", "hysteria2://", "hy2://", "tuic://")
-
-
-def _decode_links(content: str) -> list[str]:
-    """Декодирует подписку в список ссылок.
-
-    Сначала проверяет plain-text (b64decode молча декодирует любую строку без исключения),
-    затем пробует base64.
-    """
-    lines = [line.strip() for line in content.splitlines() if line.strip()]
-    if any(line.startswith(_VPN_PREFIXES) for line in lines):
-        return lines
-    try:
-        decoded = base64.b64decode(content + "==").decode("utf-8", errors="ignore")
-        return [line.strip() for line in decoded.splitlines() if line.strip()]
-    except Exception:
-        return lines